@@ -0,0 +1,129 @@
+"""Gunicorn settings, read automatically from the working directory."""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Import Django, the views and the recommender snapshot once in the master
+# so forked workers share those pages copy-on-write instead of each loading
+# their own. Code changes then need a full restart rather than a HUP.
+preload_app = True
+
+# SERVER_MODE=asgi serves merobazar.asgi on uvicorn workers, where the async
+# views (payment initiation, cart and wishlist badges) wait on I/O without
+# holding a worker. The default is the WSGI app on sync workers. An app
+# given on the command line overrides either.
+if os.environ.get('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'merobazar.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'merobazar.wsgi:application'
+
+
+# Workers write their metrics here so /metrics can merge them. Set only for
+# gunicorn: other processes (manage.py commands, shells) keep in-memory
+# metrics. It has to be in the environment before prometheus_client is
+# imported, which preload_app does before on_starting runs.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'merobazar-metrics'))
+
+
+# manage.py loops that run next to the web workers because they need this
+# host's disk, which a separate service doesn't have:
+# - the thumbnail and WebP builder reads uploads from MEDIA_ROOT and
+#   UPLOAD_STAGING_ROOT; IMAGE_DERIVATIVE_WORKERS processes (0 turns it off).
+# - the recommender snapshot build writes the RECOMMENDER_SNAPSHOT['DIR']
+#   that workers map; every RECOMMENDER_SNAPSHOT_INTERVAL seconds (0, the
+#   default, turns it off).
+image_workers = int(os.environ.get('IMAGE_DERIVATIVE_WORKERS', '1'))
+snapshot_interval = float(os.environ.get('RECOMMENDER_SNAPSHOT_INTERVAL', '0'))
+background = []
+
+
+def background_commands():
+    commands = []
+    if image_workers:
+        commands.append(['generate_image_derivatives', '--loop', '--workers', str(image_workers)])
+    if snapshot_interval:
+        commands.append(['build_recommender_snapshot', '--loop', '--interval', str(snapshot_interval)])
+    return commands
+
+
+def start_background(server):
+    env = dict(os.environ)
+    # Their metrics aren't served by /metrics; keep them in memory.
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    manage = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manage.py')
+    for command in background_commands():
+        process = subprocess.Popen([sys.executable, manage, *command], env=env)
+        background.append(process)
+        server.log.info(f"Started {command[0]} (pid {process.pid})")
+
+
+def on_starting(server):
+    # Metric files from a previous run would be merged into this one's.
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def check_connection_budget(server):
+    """Warn if the workers could open more connections than Postgres allows."""
+    from django.db import connection
+
+    if connection.vendor != 'postgresql':
+        return
+    pool = connection.settings_dict['OPTIONS'].get('pool')
+    per_worker = pool.get('max_size', 4) if isinstance(pool, dict) else server.cfg.threads
+    wanted = server.cfg.workers * per_worker
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW max_connections')
+        limit = int(cursor.fetchone()[0])
+    # Leave room for migrations, background workers and psql sessions.
+    if wanted > limit * 0.8:
+        server.log.warning(
+            f"{server.cfg.workers} workers x {per_worker} connections = {wanted} may exhaust "
+            f"max_connections ({limit}); lower WEB_CONCURRENCY, threads or DB_POOL_MAX_SIZE"
+        )
+
+
+def when_ready(server):
+    from django.db import connections
+    from django.urls import get_resolver
+
+    from recommendations.snapshot import get_state
+
+    get_resolver().url_patterns
+    get_state()
+    check_connection_budget(server)
+    start_background(server)
+    # Workers must open their own database connections, not inherit one,
+    # and a pool's background threads don't survive fork.
+    connections.close_all()
+    for connection in connections.all(initialized_only=True):
+        if connection.settings_dict['OPTIONS'].get('pool'):
+            connection.close_pool()
+
+
+def post_fork(server, worker):
+    from products.sampling import reseed
+
+    reseed()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    for process in background:
+        if process.poll() is None:
+            process.terminate()
+    for process in background:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,97 @@
+"""HTTP cache policies that views declare and CachePolicyMiddleware applies.
+
+    @public_cache(max_age=60)   catalog pages; guests get an ETag built from
+                                the catalog version and a 304 when it matches
+    @public_cache(max_age=60, stale=300, page=True)
+                                additionally keeps guest renders in the
+                                server-side page cache
+    @no_store                   transactional pages that must never be kept
+
+Views without a policy are revalidated on every request. Authenticated
+users and unsafe methods always get ``no-store``.
+
+ETags and the page cache need the catalog version in a cache every worker
+shares (Redis, Memcached or the database); on a per-process backend such
+as the default LocMemCache public pages are revalidated on every request.
+"""
+import hashlib
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+
+from .metrics import record_cache_lookup
+
+PUBLIC = 'public'
+NO_STORE = 'no-store'
+
+CachePolicy = namedtuple('CachePolicy', 'policy max_age stale page')
+DEFAULT_POLICY = CachePolicy(None, 0, 0, False)
+
+PAGE_CACHE_PREFIX = 'page:'
+# How long one request may hold the right to re-render a stale page.
+REGENERATE_TIMEOUT = 30
+# Cached pages are shared between guests, so the per-browser CSRF token is
+# rendered as this marker and swapped for the requester's token on the way
+# out. It is not a valid token, so a page that escapes unswapped is harmless.
+CSRF_PLACEHOLDER = 'csrf-token-placeholder'
+
+
+def cache_policy(policy, max_age=0, stale=0, page=False):
+    def decorator(view_func):
+        view_func.cache_policy = CachePolicy(policy, max_age, stale, page)
+        return view_func
+    return decorator
+
+
+def public_cache(max_age=60, stale=0, page=False):
+    return cache_policy(PUBLIC, max_age, stale, page)
+
+
+def no_store(view_func):
+    return cache_policy(NO_STORE)(view_func)
+
+
+def public_etag(request, version):
+    # The CSRF secret is part of the key because the pages embed a token
+    # derived from it; a new cookie must not revalidate an old copy.
+    key = '|'.join([str(version), request.get_full_path(), request.META.get('CSRF_COOKIE', '')])
+    return 'W/"%s"' % hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def page_cache_key(request):
+    # Filter params are sorted so ?a=1&b=2 and ?b=2&a=1 share an entry.
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    url = f'{request.path}?{query}'
+    return PAGE_CACHE_PREFIX + hashlib.md5(url.encode(), usedforsecurity=False).hexdigest()
+
+
+def get_cached_page(key, version, policy):
+    """Return a cached page entry to serve, or None if this request should render.
+
+    An entry is fresh while it matches the catalog version and is younger
+    than ``max_age``. After that it may still be served for ``stale`` more
+    seconds, but only while another request is re-rendering it.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        age = time.time() - entry['time']
+        if entry['version'] == version and age < policy.max_age:
+            record_cache_lookup('page', 'hit')
+            return entry
+        if age < policy.max_age + policy.stale and not cache.add(f'{key}:lock', 1, REGENERATE_TIMEOUT):
+            record_cache_lookup('page', 'stale')
+            return entry
+    record_cache_lookup('page', 'miss')
+    return None
+
+
+def store_page(key, version, policy, response):
+    cache.set(key, {
+        'version': version,
+        'time': time.time(),
+        'content': response.content,
+        'content_type': response['Content-Type'],
+    }, policy.max_age + policy.stale)
+    cache.delete(f'{key}:lock')
@@ -0,0 +1,22 @@
+from django.utils.functional import SimpleLazyObject
+
+from products.catalog import catalog_version
+
+from .caching import CSRF_PLACEHOLDER
+
+
+def caching(request):
+    """``catalog_version`` for fragment cache keys, e.g.
+
+        {% cache 600 category_menu catalog_version %}
+    """
+    context = {
+        'catalog_version': SimpleLazyObject(
+            lambda: getattr(request, 'catalog_version', None) or catalog_version()
+        ),
+    }
+    if getattr(request, 'csrf_placeholder', False):
+        # Overrides the built-in csrf processor for pages bound for the
+        # shared page cache; the middleware fills in the real token.
+        context['csrf_token'] = CSRF_PLACEHOLDER
+    return context
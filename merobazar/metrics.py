@@ -0,0 +1,53 @@
+"""Prometheus metrics, exposed in text format at /metrics.
+
+Under gunicorn, PROMETHEUS_MULTIPROC_DIR names a directory shared by all
+workers (gunicorn.conf.py sets a default, empties it at startup and cleans
+up after dead workers). Each worker then writes its samples to mmap'd
+files there and the endpoint merges them, so a scrape sees the whole
+server, not whichever worker answered it.
+"""
+import os
+
+# prometheus_client writes its files on the first sample, so a process that
+# inherits the variable without gunicorn's on_starting needs the directory.
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    'merobazar_request_duration_seconds', 'Time spent serving a request', ['view', 'method'],
+)
+REQUESTS = Counter(
+    'merobazar_requests_total', 'Requests served', ['view', 'method', 'status'],
+)
+REQUEST_QUERIES = Histogram(
+    'merobazar_request_db_queries', 'SQL queries run per request', ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+REQUEST_DB_TIME = Histogram(
+    'merobazar_request_db_seconds', 'Time spent in SQL per request', ['view'],
+)
+CACHE_LOOKUPS = Counter(
+    'merobazar_cache_lookups_total', 'Application cache lookups', ['cache', 'result'],
+)
+RECOMMENDER_STAGE = Histogram(
+    'merobazar_recommender_stage_seconds', 'Time spent in each recommender stage', ['stage'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+
+
+def record_cache_lookup(cache, result):
+    """``result`` is 'hit', 'miss' or, for caches that serve stale entries, 'stale'."""
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+
+def render_metrics():
+    """Return ``(body, content_type)`` for the current metrics."""
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
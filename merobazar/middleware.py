@@ -1,8 +1,211 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.deprecation import MiddlewareMixin
 
-class NoCacheMiddleware(MiddlewareMixin):
+from products.catalog import catalog_version, catalog_version_is_shared
+
+from .caching import (
+    CSRF_PLACEHOLDER, DEFAULT_POLICY, NO_STORE, PUBLIC,
+    get_cached_page, page_cache_key, public_etag, store_page,
+)
+from .metrics import REQUEST_DB_TIME, REQUEST_LATENCY, REQUEST_QUERIES, REQUESTS
+from .profiling import QueryProfiler
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class CachePolicyMiddleware(MiddlewareMixin):
+    """Apply the cache policy a view declared through merobazar.caching."""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        policy = getattr(view_func, 'cache_policy', DEFAULT_POLICY)
+        request.cache_policy = policy
+        if policy.policy != PUBLIC or request.method not in SAFE_METHODS or request.user.is_authenticated:
+            return None
+        # Without a version every worker agrees on, guests get no ETag or
+        # page cache and revalidate in full.
+        if not catalog_version_is_shared():
+            return None
+
+        request.catalog_version = catalog_version()
+        # A pending flash message has to be rendered, so don't short-circuit.
+        if 'messages' in request.COOKIES:
+            return None
+        response = get_conditional_response(request, etag=public_etag(request, request.catalog_version))
+        if response is not None or not policy.page:
+            return response
+
+        key = page_cache_key(request)
+        entry = get_cached_page(key, request.catalog_version, policy)
+        request.csrf_placeholder = True
+        if entry is not None:
+            # Possibly a stale copy; label it with the version it was built from.
+            request.catalog_version = entry['version']
+            return HttpResponse(entry['content'], content_type=entry['content_type'])
+        request.page_cache_key = key
+        return None
+
     def process_response(self, request, response):
-        response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response['Pragma'] = 'no-cache'
-        response['Expires'] = '0'
-        return response
\ No newline at end of file
+        if getattr(request, 'csrf_placeholder', False) and not response.streaming:
+            self.fill_page_cache(request, response)
+
+        # Leave responses that chose their own policy alone (e.g. static and
+        # media files from merobazar.serving).
+        if response.has_header('Cache-Control'):
+            return response
+
+        policy = getattr(request, 'cache_policy', DEFAULT_POLICY)
+        user = getattr(request, 'user', None)
+        if policy.policy == NO_STORE or request.method not in SAFE_METHODS or (user and user.is_authenticated):
+            response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+            response['Pragma'] = 'no-cache'
+            response['Expires'] = '0'
+            return response
+
+        version = getattr(request, 'catalog_version', None)
+        if version is not None and response.status_code in (200, 304) and not self.showed_messages(request):
+            response['ETag'] = public_etag(request, version)
+            directives = {'max_age': policy.max_age}
+            if policy.stale:
+                directives['stale_while_revalidate'] = policy.stale
+            # Pages that embed a CSRF token belong to one browser only.
+            if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+                patch_cache_control(response, private=True, **directives)
+            else:
+                patch_cache_control(response, public=True, **directives)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def fill_page_cache(self, request, response):
+        key = getattr(request, 'page_cache_key', None)
+        # Only plain, cookie-free guest renders are shared.
+        if key and request.method == 'GET' and response.status_code == 200 \
+                and not response.cookies and not self.showed_messages(request):
+            store_page(key, request.catalog_version, request.cache_policy, response)
+
+        placeholder = CSRF_PLACEHOLDER.encode()
+        if placeholder in response.content:
+            response.content = response.content.replace(placeholder, get_token(request).encode())
+
+    def showed_messages(self, request):
+        messages = getattr(request, '_messages', None)
+        return bool(messages and messages.used)
+
+
+class QueryProfilerMiddleware:
+    """Count queries and database time for every request.
+
+    The totals go out in a Server-Timing header. Slow statements are
+    logged with the code that issued them on every request; a sampled
+    fraction of requests (QUERY_PROFILER['SAMPLE_RATE']) also logs
+    repeated statements and the request's totals.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiler = self.start(request)
+        start = time.perf_counter()
+        with connection.execute_wrapper(profiler):
+            response = self.get_response(request)
+        return self.finish(request, response, profiler, start)
+
+    async def __acall__(self, request):
+        profiler = self.start(request)
+        start = time.perf_counter()
+        # Async ORM calls run on the request's sync thread, which has its own
+        # connection, so the wrapper is installed there.
+        await sync_to_async(lambda: connection.execute_wrappers.append(profiler))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(profiler))()
+        return self.finish(request, response, profiler, start)
+
+    def start(self, request):
+        options = settings.QUERY_PROFILER
+        profiler = QueryProfiler(
+            sampled=random.random() < options['SAMPLE_RATE'],
+            slow_ms=options['SLOW_QUERY_MS'],
+            duplicate_threshold=options['DUPLICATE_THRESHOLD'],
+        )
+        request.query_profile = profiler
+        return profiler
+
+    def finish(self, request, response, profiler, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        if settings.QUERY_PROFILER['SERVER_TIMING']:
+            timing = f'db;dur={profiler.duration * 1000:.1f};desc="{profiler.count} queries", app;dur={total_ms:.1f}'
+            if response.has_header('Server-Timing'):
+                timing = f"{response['Server-Timing']}, {timing}"
+            response['Server-Timing'] = timing
+        where = f"{request.method} {request.path}"
+        for ms, sql, origin in profiler.slow:
+            logger.warning(f"{where}: slow query ({ms:.0f} ms) from {origin}: {sql[:300]}")
+        if profiler.sampled:
+            self.report(where, profiler, total_ms)
+        return response
+
+    def report(self, where, profiler, total_ms):
+        for sql, origin in profiler.duplicates.items():
+            logger.warning(f"{where}: {profiler.statements[sql]} identical queries from {origin}: {sql[:300]}")
+        logger.info(f"{where}: {profiler.count} queries in {profiler.duration * 1000:.1f} ms ({total_ms:.1f} ms total)")
+
+
+class MetricsMiddleware:
+    """Record latency, status and query counts per view for /metrics.
+
+    Sits outside QueryProfilerMiddleware so the request's query profile is
+    complete by the time it is read.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_LATENCY.labels(view, request.method).observe(elapsed)
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        profile = getattr(request, 'query_profile', None)
+        if profile is not None:
+            REQUEST_QUERIES.labels(view).observe(profile.count)
+            REQUEST_DB_TIME.labels(view).observe(profile.duration)
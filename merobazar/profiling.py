@@ -0,0 +1,59 @@
+"""Per-request SQL accounting, installed by QueryProfilerMiddleware.
+
+Every request gets a query count and total database time, and any slow
+statement is kept with the line of project code that issued it. Sampled
+requests additionally keep each statement's text so repeated SQL (the
+usual sign of an N+1 loop) can be logged with its origin too.
+"""
+import os
+import time
+import traceback
+from collections import Counter
+
+from django.conf import settings
+
+_PROJECT_ROOT = str(settings.BASE_DIR) + os.sep
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def query_origin():
+    """The innermost frame of project code on the current stack."""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_PROJECT_ROOT) and filename != _THIS_FILE and 'site-packages' not in filename:
+            return f'{os.path.relpath(filename, _PROJECT_ROOT)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class QueryProfiler:
+    def __init__(self, sampled=False, slow_ms=100, duplicate_threshold=5):
+        self.sampled = sampled
+        self.slow_ms = slow_ms
+        self.duplicate_threshold = duplicate_threshold
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        # sql -> origin of the call that crossed the duplicate threshold
+        self.duplicates = {}
+        # (milliseconds, sql, origin)
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            ms = elapsed * 1000
+            # Only slow statements pay for walking the stack.
+            if ms >= self.slow_ms:
+                self.slow.append((ms, sql, query_origin()))
+            if self.sampled:
+                self.record(sql)
+
+    def record(self, sql):
+        self.statements[sql] += 1
+        if self.statements[sql] == self.duplicate_threshold:
+            self.duplicates[sql] = query_origin()
@@ -0,0 +1,81 @@
+"""Static and media file serving for deployments without a front-end proxy.
+
+Files go out through FileResponse, which hands the open file to the WSGI
+server's file_wrapper (gunicorn uses sendfile), and carry ETag and
+Last-Modified validators so repeat requests can be answered with a 304.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .storage import CONTENT_ADDRESSED_NAME
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+# ManifestStaticFilesStorage names look like app.3f2a9c1b0d4e.css
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+# Checked in order of preference against Accept-Encoding.
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+def serve_file(request, root, path, cache_control, precompressed=False):
+    try:
+        fullpath = safe_join(root, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    served, encoding = fullpath, None
+    if precompressed:
+        accepted = request.headers.get('Accept-Encoding', '')
+        for name, suffix in PRECOMPRESSED:
+            if name in accepted and os.path.isfile(fullpath + suffix):
+                served, encoding = fullpath + suffix, name
+                break
+
+    stat = os.stat(served)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(
+            open(served, 'rb'),
+            content_type=content_type or 'application/octet-stream',
+            filename=os.path.basename(fullpath),
+        )
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control
+    if precompressed:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    # Storage reuses a name once its file is deleted, so only paths under a
+    # content hash are safe to cache forever; the rest revalidate by ETag.
+    cache_control = IMMUTABLE if CONTENT_ADDRESSED_NAME.search(path) else REVALIDATE
+    return serve_file(request, settings.MEDIA_ROOT, path, cache_control)
+
+
+@require_safe
+def serve_static(request, path):
+    cache_control = IMMUTABLE if HASHED_NAME.search(path) else REVALIDATE
+    return serve_file(request, settings.STATIC_ROOT, path, cache_control, precompressed=True)
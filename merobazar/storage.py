@@ -0,0 +1,72 @@
+import gzip
+import os
+import re
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always written
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico')
+MIN_COMPRESS_SIZE = 256
+
+CONTENT_HASH_LENGTH = 16
+# product_images/0123456789abcdef/shoe.jpg. Uploads only choose the file
+# name, never a directory, so only content_addressed_name() makes these.
+CONTENT_ADDRESSED_NAME = re.compile(r'(?:^|/)[0-9a-f]{%d}/[^/]+$' % CONTENT_HASH_LENGTH)
+
+
+def content_addressed_name(name, sha256):
+    """product_images/shoe.jpg -> product_images/<sha256 prefix>/shoe.jpg
+
+    A media file under its content hash only ever holds those bytes, even
+    if it is deleted and the name reused, so its URL can be cached forever.
+    A hash directory already in ``name`` is replaced.
+    """
+    directory, filename = os.path.split(name)
+    if CONTENT_ADDRESSED_NAME.search(name):
+        directory = os.path.dirname(directory)
+    return os.path.join(directory, sha256[:CONTENT_HASH_LENGTH], filename)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Hashed static files with precompressed .gz and .br siblings.
+
+    merobazar.serving picks the smallest variant the client accepts.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        # Templates reference a few images that aren't shipped; fall back to
+        # the unhashed URL instead of raising on render.
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for original, hashed in self.hashed_files.items():
+            for name in {original, hashed}:
+                if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                    self.compress(self.path(name))
+
+    def compress(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data)))
+        for suffix, compressed in variants:
+            # Only keep variants that actually save bytes.
+            if len(compressed) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.unlink(path + suffix)
@@ -1,13 +1,14 @@
 from django.contrib import admin
-from django.urls import path,include
+from django.urls import path,include,re_path
 from . import views
+from .serving import serve_media, serve_static
 from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('', include('userapp.urls')),
     path('adminapp/', include('adminapp.urls')),
     path('products/', include('products.urls')),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('metrics', views.metrics_view, name='metrics'),
+    re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
+    re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), serve_static, name='static'),
+]
\ No newline at end of file
@@ -1,6 +1,24 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 
+from .caching import no_store
+from .metrics import render_metrics
+
 def home_view(request):
     return render(request,'base.html')
 def home(request):
-    return render(request, 'home.html')  # or whatever template you want
\ No newline at end of file
+    return render(request, 'home.html')  # or whatever template you want
+
+
+@no_store
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        return HttpResponse(status=401)
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
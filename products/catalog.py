@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# Backends whose entries live inside one process. A version bumped in one
+# worker never reaches the others, so ETags built from it would keep
+# answering 304 for pages that have changed.
+PER_PROCESS_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def catalog_version():
+    """Counter that changes whenever anything shown on browse pages changes.
+
+    Lives in the default cache so every worker sees the same value, as long
+    as that cache is shared (see ``catalog_version_is_shared``). If the
+    cache loses it, it restarts from the current time so it never repeats a
+    value clients may still hold in an ETag.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def catalog_version_is_shared():
+    """Whether every worker reads the same version, which ETags need."""
+    return settings.CACHES['default']['BACKEND'] not in PER_PROCESS_BACKENDS
+
+
+def bump_catalog_version():
+    """Invalidate cached catalog pages once the current transaction commits."""
+    def bump():
+        # A fresh stamp rather than cache.incr(): incr is a get and set on
+        # the database backend, which races and resets the timeout, while
+        # set() never expires and any new value invalidates.
+        cache.set(CATALOG_VERSION_KEY, max(time.time_ns(), (cache.get(CATALOG_VERSION_KEY) or 0) + 1), None)
+
+    transaction.on_commit(bump)
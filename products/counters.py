@@ -0,0 +1,86 @@
+"""Per-user wishlist and cart sizes for the header badges.
+
+The counts are denormalized onto the user row as ``wishlist_count`` and
+``cart_count`` and moved with an F() update in the same transaction that
+adds or removes rows (see signals.py), so every worker sees the same exact
+value and a badge is read from the ``request.user`` the auth middleware
+has already loaded. ``manage.py reconcile_badge_counts`` recounts them
+from the tables, for changes that skip signals such as bulk_create.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Cart, Wishlist
+
+COUNTED_MODELS = (Wishlist, Cart)
+
+_batches = threading.local()
+
+
+def count_field(model):
+    return f'{model._meta.model_name}_count'
+
+
+def get_count(model, user_id):
+    """How many ``model`` rows (Wishlist or Cart) belong to ``user_id``, read fresh from the user row."""
+    field = count_field(model)
+    return get_user_model().objects.filter(pk=user_id).values_list(field, flat=True).first() or 0
+
+
+async def aget_count(model, user_id):
+    field = count_field(model)
+    return await get_user_model().objects.filter(pk=user_id).values_list(field, flat=True).afirst() or 0
+
+
+def adjust_count(model, user_id, delta, using=None):
+    """Move a user's count by ``delta`` as part of the current transaction."""
+    batch = getattr(_batches, 'deltas', None)
+    if batch is not None:
+        batch[model, user_id, using] += delta
+        return
+    _update_count(model, user_id, delta, using)
+
+
+@contextmanager
+def batched_counts():
+    """Apply the count changes made inside the block as one UPDATE per user and model.
+
+    Queryset deletes send post_delete per row, so emptying a cart would
+    otherwise update the user row once per item.
+    """
+    if getattr(_batches, 'deltas', None) is not None:
+        yield
+        return
+    _batches.deltas = Counter()
+    try:
+        yield
+        deltas = _batches.deltas
+    finally:
+        _batches.deltas = None
+    for (model, user_id, using), delta in deltas.items():
+        if delta:
+            _update_count(model, user_id, delta, using)
+
+
+def _update_count(model, user_id, delta, using):
+    field = count_field(model)
+    # Greatest() keeps a drifted count from failing the change that found it.
+    get_user_model().objects.using(using).filter(pk=user_id).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def reconcile_counts(users=None):
+    """Recount every user's (or just ``users``') counts from the tables; returns rows changed."""
+    users = get_user_model().objects.all() if users is None else users
+    changed = 0
+    for model in COUNTED_MODELS:
+        field = count_field(model)
+        actual = Coalesce(Subquery(
+            model.objects.filter(user=OuterRef('pk')).order_by().values('user').annotate(rows=Count('pk')).values('rows')
+        ), 0)
+        changed += users.exclude(**{field: actual}).update(**{field: actual})
+    return changed
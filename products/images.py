@@ -0,0 +1,84 @@
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from merobazar.storage import content_addressed_name
+
+logger = logging.getLogger(__name__)
+
+# Bounding box for the JPEG thumbnail used as the card <img src>.
+THUMBNAIL_SIZE = (400, 400)
+# WebP widths offered to the browser through srcset.
+WEBP_WIDTHS = (320, 640, 1024)
+
+
+def derivative_name(name, suffix, ext):
+    """product_images/shoe.jpg -> product_images/shoe.<suffix>.<ext>"""
+    base, _ = os.path.splitext(name)
+    return f"{base}.{suffix}.{ext}"
+
+
+def derivative_names(derivatives):
+    """Every file name recorded in a ProductImage.derivatives dict."""
+    names = list(derivatives.get('webp', {}).values())
+    if derivatives.get('thumbnail'):
+        names.append(derivatives['thumbnail'])
+    return names
+
+
+def _save(storage, name, image, fmt, **params):
+    buffer = BytesIO()
+    image.save(buffer, fmt, **params)
+    content = buffer.getvalue()
+    # Stored under their own content hash, so a rebuild with different
+    # settings gets new URLs and the old ones can be cached forever.
+    name = content_addressed_name(name, hashlib.sha256(content).hexdigest())
+    return storage.save(name, ContentFile(content))
+
+
+def build_derivatives(name, storage=default_storage):
+    """Write the thumbnail and WebP variants of an image next to it.
+
+    Returns ``{'thumbnail': name, 'webp': {'<width>': name, ...}}``, an
+    empty dict if the source can't be decoded, or None if it isn't in
+    storage (yet), so the caller can try again later.
+    """
+    try:
+        with storage.open(name, 'rb') as f, Image.open(f) as source:
+            image = ImageOps.exif_transpose(source)
+    except FileNotFoundError as e:
+        logger.warning(f"Could not build derivatives for {name}: {str(e)}")
+        return None
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.warning(f"Could not build derivatives for {name}: {str(e)}")
+        return {}
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    thumbnail = image.convert('RGB')
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    derivatives = {
+        'thumbnail': _save(storage, derivative_name(name, 'thumb', 'jpg'), thumbnail, 'JPEG',
+                           quality=80, optimize=True, progressive=True),
+        'webp': {},
+    }
+
+    for width in WEBP_WIDTHS:
+        # Never upscale; the original width becomes the largest variant.
+        if width >= image.width:
+            width = image.width
+        variant = image
+        if width < image.width:
+            variant = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        derivatives['webp'][str(width)] = _save(storage, derivative_name(name, f"w{width}", 'webp'), variant, 'WEBP',
+                                                quality=80, method=4)
+        if width == image.width:
+            break
+
+    return derivatives
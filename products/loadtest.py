@@ -0,0 +1,225 @@
+"""HTTP load test for the main shopping journeys.
+
+Driven by ``manage.py loadtest``. Virtual users run concurrently on one
+asyncio loop against a live server:
+
+    guest   dashboard -> search -> category -> product detail
+    buyer   login -> category -> product detail -> wishlist toggle
+            -> add to cart -> checkout -> Khalti initiate -> payment callback
+    poller  login -> batched cart and wishlist state for a page of cards
+
+The server's Khalti calls go to ``KhaltiStub``, a local HTTP server that
+speaks the two ePayment endpoints, so checkout is timed through the real
+KhaltiBackend without leaving the machine.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urljoin, urlparse
+
+import httpx
+import numpy as np
+
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+ORDER_ID = re.compile(r'/order/success/(\d+)/')
+
+
+class KhaltiStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self.reply(400, {'detail': 'Invalid JSON'})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.path.rstrip('/').endswith('epayment/initiate'):
+            pidx = uuid.uuid4().hex
+            query = urlencode({
+                'pidx': pidx,
+                'purchase_order_id': payload.get('purchase_order_id', ''),
+                'status': 'Completed',
+            })
+            self.reply(200, {
+                'pidx': pidx,
+                'payment_url': f"{payload.get('return_url', '')}?{query}",
+                'expires_in': 1800,
+            })
+        elif self.path.rstrip('/').endswith('epayment/lookup'):
+            self.reply(200, {'pidx': payload.get('pidx'), 'status': 'Completed'})
+        else:
+            self.reply(404, {'detail': 'Not found'})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KhaltiStub(ThreadingHTTPServer):
+    """Approves every payment; ``latency`` seconds are added to each call."""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0):
+        super().__init__((host, port), KhaltiStubHandler)
+        self.latency = latency
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/api/v2/'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class Recorder:
+    """Latencies and failures per endpoint label."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, label, method, url, expect=(200, 302), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[label] += 1
+            return None
+        self.latencies[label].append(time.perf_counter() - start)
+        if response.status_code not in expect:
+            self.errors[label] += 1
+            return None
+        return response
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for label in sorted(set(self.latencies) | set(self.errors)):
+            seconds = np.array(self.latencies[label])
+            p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) if len(seconds) else (0, 0, 0)
+            endpoints[label] = {
+                'requests': len(seconds),
+                'errors': self.errors[label],
+                'p50_ms': round(float(p50) * 1000, 2),
+                'p95_ms': round(float(p95) * 1000, 2),
+                'p99_ms': round(float(p99) * 1000, 2),
+                'rps': round(len(seconds) / elapsed, 2) if elapsed else 0,
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'rps': round(total / elapsed, 2) if elapsed else 0,
+            'endpoints': endpoints,
+        }
+
+
+def csrf_headers(client, referer):
+    return {'X-CSRFToken': client.cookies.get('csrftoken', ''), 'Referer': referer}
+
+
+async def guest_journey(client, recorder, catalog, words, rng):
+    category_id, product_id = rng.choice(catalog)
+    await recorder.request(client, 'dashboard', 'GET', '/')
+    await recorder.request(client, 'search', 'GET', '/search/', params={'q': rng.choice(words)})
+    await recorder.request(client, 'category', 'GET', f'/products/category/{category_id}/')
+    await recorder.request(client, 'product_detail', 'GET', f'/products/product/{product_id}/')
+
+
+async def login(client, recorder, username, password):
+    page = await recorder.request(client, 'login_page', 'GET', '/login/')
+    if page is None:
+        return False
+    match = CSRF_INPUT.search(page.text)
+    response = await recorder.request(client, 'login', 'POST', '/login/', expect=(302,), data={
+        'csrfmiddlewaretoken': match.group(1) if match else '',
+        'username': username,
+        'password': password,
+    }, headers={'Referer': str(client.base_url.join('/login/'))})
+    return response is not None and 'sessionid' in client.cookies
+
+
+async def buyer_journey(client, recorder, catalog, rng):
+    category_id, product_id = rng.choice(catalog)
+    detail_url = f'/products/product/{product_id}/'
+    await recorder.request(client, 'category', 'GET', f'/products/category/{category_id}/')
+    await recorder.request(client, 'product_detail', 'GET', detail_url)
+
+    headers = csrf_headers(client, str(client.base_url.join(detail_url)))
+    await recorder.request(client, 'toggle_wishlist', 'POST', f'/products/wishlist/toggle/{product_id}/',
+                           headers=headers, expect=(200,))
+    await recorder.request(client, 'add_to_cart', 'POST', f'/products/cart/add/{product_id}/',
+                           headers=headers, expect=(200,))
+
+    checkout = await recorder.request(client, 'checkout', 'GET', '/products/checkout/', expect=(302,))
+    match = checkout and ORDER_ID.search(checkout.headers.get('Location', ''))
+    if not match:
+        return
+    await recorder.request(client, 'order_success', 'GET', f'/products/order/success/{match.group(1)}/')
+
+    payment = await recorder.request(client, 'initiate_payment', 'GET',
+                                     f'/products/initiate-payment/{match.group(1)}/', expect=(302,))
+    location = payment and payment.headers.get('Location', '')
+    # A failed initiation sends the buyer back to the order page instead.
+    if not location or not urlparse(location).path.endswith('/payment-response/'):
+        if payment is not None:
+            recorder.errors['initiate_payment'] += 1
+        return
+    await recorder.request(client, 'payment_response', 'GET', urljoin(str(client.base_url), location))
+
+
+async def poller_journey(client, recorder, catalog, rng):
+    # The batched request every signed-in page makes for its product cards.
+    ids = ','.join(str(product_id) for _, product_id in rng.sample(catalog, min(12, len(catalog))))
+    await recorder.request(client, 'product_state', 'GET', '/products/state/', params={'ids': ids}, expect=(200,))
+
+
+async def virtual_user(base_url, recorder, journey, iterations, rng, timeout, credentials=None, **kwargs):
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        if credentials and not await login(client, recorder, *credentials):
+            return
+        for _ in range(iterations):
+            await journey(client, recorder, rng=rng, **kwargs)
+
+
+async def run_load(base_url, catalog, words, buyers, guests, iterations, seed=0, timeout=30, pollers=0):
+    """Run ``guests`` anonymous users, ``len(buyers)`` buyers and ``pollers`` concurrently.
+
+    ``catalog`` is a list of ``(category_id, product_id)`` pairs to browse
+    and ``buyers`` a list of ``(username, password)`` pairs, which the
+    pollers sign in with too.
+    """
+    recorder = Recorder()
+    tasks = [
+        virtual_user(base_url, recorder, guest_journey, iterations, random.Random(seed + i), timeout,
+                     catalog=catalog, words=words)
+        for i in range(guests)
+    ] + [
+        virtual_user(base_url, recorder, buyer_journey, iterations, random.Random(seed + guests + i), timeout,
+                     credentials=account, catalog=catalog)
+        for i, account in enumerate(buyers)
+    ] + [
+        virtual_user(base_url, recorder, poller_journey, iterations, random.Random(seed + guests + len(buyers) + i),
+                     timeout, credentials=buyers[i % len(buyers)], catalog=catalog)
+        for i in range(pollers if buyers else 0)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    return recorder.summary(time.perf_counter() - start)
@@ -0,0 +1,112 @@
+import copy
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import load_backend
+
+# Connection settings per mode, over a copy of DATABASES['default'].
+MODES = {
+    'per-request': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    'pool': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True, 'pool': {'min_size': 1, 'max_size': 1}},
+}
+
+
+def simulate_requests(settings_dict, requests, queries):
+    """Seconds per request and the server pids seen, for requests run as Django runs them.
+
+    Each request is bracketed by close_if_unusable_or_obsolete(), which is
+    what the request_started and request_finished handlers call, so
+    connections are opened, checked, reused and closed exactly as in a view.
+    """
+    backend = load_backend(settings_dict['ENGINE'])
+    # A pool registry of its own so the benchmark's pool never replaces the
+    # app's. It keeps the default alias because connection_created receivers
+    # look connections up by alias.
+    wrapper_class = type('BenchmarkDatabaseWrapper', (backend.DatabaseWrapper,), {'_connection_pools': {}})
+    wrapper = wrapper_class(settings_dict, DEFAULT_DB_ALIAS)
+    seconds, pids = [], set()
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            wrapper.close_if_unusable_or_obsolete()
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                pids.add(cursor.fetchone()[0])
+                for _ in range(queries - 1):
+                    cursor.execute('SELECT 1')
+            wrapper.close_if_unusable_or_obsolete()
+            seconds.append(time.perf_counter() - start)
+    finally:
+        wrapper.close()
+        if settings_dict['OPTIONS'].get('pool'):
+            wrapper.close_pool()
+    return seconds, pids
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request database connection overhead with and without reuse and pooling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Simulated requests per mode')
+        parser.add_argument('--queries', type=int, default=3, help='Queries per request')
+        parser.add_argument('--modes', default=','.join(MODES), help=f"Comma-separated, from {', '.join(MODES)}")
+        parser.add_argument('--output', default='connections-benchmark.json', help='Where to write JSON results')
+
+    def handle(self, *args, **options):
+        base = connections[DEFAULT_DB_ALIAS]
+        if base.vendor != 'postgresql':
+            raise CommandError('The connection benchmark needs PostgreSQL.')
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+        if options['requests'] < 2 or options['queries'] < 1:
+            raise CommandError('Use at least 2 requests and 1 query per request')
+
+        results = {}
+        for mode in modes:
+            overrides = dict(MODES[mode])
+            settings_dict = copy.deepcopy(base.settings_dict)
+            settings_dict['OPTIONS'].pop('pool', None)
+            pool = overrides.pop('pool', None)
+            if pool:
+                if base.Database.__name__ != 'psycopg':
+                    self.stdout.write(f'{mode:<12} skipped: pooling needs psycopg 3 (pip install "psycopg[pool]")')
+                    continue
+                settings_dict['OPTIONS']['pool'] = pool
+            settings_dict.update(overrides)
+
+            seconds, pids = simulate_requests(settings_dict, options['requests'], options['queries'])
+            cuts = statistics.quantiles(seconds, n=20)
+            p50, p95 = cuts[9], cuts[18]
+            results[mode] = {
+                'requests': len(seconds),
+                'server_connections': len(pids),
+                'mean_ms': statistics.fmean(seconds) * 1000,
+                'p50_ms': p50 * 1000,
+                'p95_ms': p95 * 1000,
+            }
+            self.stdout.write(
+                f"{mode:<12} p50 {p50 * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms  "
+                f"{len(pids)} server connection{'s' if len(pids) != 1 else ''}"
+            )
+
+        baseline = results.get('per-request')
+        for mode, result in results.items():
+            if baseline and mode != 'per-request':
+                saved = baseline['mean_ms'] - result['mean_ms']
+                result['saved_ms_per_request'] = saved
+                self.stdout.write(f'{mode} saves {saved:.2f} ms per request over per-request connections')
+
+        with open(options['output'], 'w') as f:
+            json.dump({
+                'benchmark': 'connections',
+                'host': base.settings_dict['HOST'] or 'localhost',
+                'queries_per_request': options['queries'],
+                'results': results,
+            }, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.uploads import clear_staging
+
+
+class Command(BaseCommand):
+    help = 'Delete staged product image uploads that were never published'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Minimum age of files to delete')
+
+    def handle(self, *args, **options):
+        freed = clear_staging(options['hours'] * 3600)
+        self.stdout.write(self.style.SUCCESS(f'Freed {freed} bytes from the upload staging area.'))
@@ -0,0 +1,98 @@
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.catalog import bump_catalog_version
+from products.models import ImageBlob, ProductImage
+from products.images import derivative_names
+
+
+def file_digest(name, storage=default_storage):
+    digest = hashlib.sha256()
+    with storage.open(name, 'rb') as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'Deduplicate stored product images by content hash and report reclaimed space'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be reclaimed without changing anything')
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help='Also delete files under product_images/ that no product image references')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = default_storage
+
+        groups = {}
+        for name in ProductImage.objects.exclude(image='').values_list('image', flat=True).distinct():
+            if not storage.exists(name):
+                self.stderr.write(f'Missing file: {name}')
+                continue
+            groups.setdefault(file_digest(name, storage), []).append(name)
+
+        reclaimed = duplicates = 0
+        for sha256, names in groups.items():
+            blob = ImageBlob.objects.filter(sha256=sha256).first()
+            canonical = blob.name if blob and blob.name in names else min(names)
+            extra = [name for name in names if name != canonical]
+
+            rows = ProductImage.objects.filter(image__in=names)
+            derivatives = rows.filter(image=canonical).exclude(derivatives={}).values_list('derivatives', flat=True).first() or {}
+            stale = set()
+            for row_derivatives in rows.exclude(image=canonical).values_list('derivatives', flat=True):
+                stale.update(derivative_names(row_derivatives))
+            stale.difference_update(derivative_names(derivatives))
+
+            doomed = [name for name in extra + sorted(stale) if storage.exists(name)]
+            reclaimed += sum(storage.size(name) for name in doomed)
+            duplicates += len(extra)
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                blob, _ = ImageBlob.objects.update_or_create(
+                    sha256=sha256, defaults={'name': canonical, 'size': storage.size(canonical)}
+                )
+                count = rows.update(image=canonical, blob=blob, derivatives=derivatives)
+                ImageBlob.objects.filter(pk=blob.pk).update(ref_count=count)
+            for name in doomed:
+                storage.delete(name)
+
+        if duplicates and not dry_run:
+            bump_catalog_version()
+
+        orphans = self.find_orphans(storage)
+        orphan_bytes = sum(storage.size(name) for name in orphans)
+        if options['delete_orphans']:
+            reclaimed += orphan_bytes
+            if not dry_run:
+                for name in orphans:
+                    storage.delete(name)
+
+        verb = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {reclaimed} bytes: {duplicates} duplicate files across {len(groups)} distinct images.'
+        ))
+        self.stdout.write(f'{len(orphans)} unreferenced files ({orphan_bytes} bytes) under product_images/.')
+
+    def find_orphans(self, storage):
+        upload_to = ProductImage._meta.get_field('image').upload_to
+        referenced = set()
+        for name, derivatives in ProductImage.objects.values_list('image', 'derivatives'):
+            referenced.add(name)
+            referenced.update(derivative_names(derivatives))
+        try:
+            _, files = storage.listdir(upload_to)
+        except FileNotFoundError:
+            return []
+        return [
+            name for name in (os.path.join(upload_to, filename) for filename in files)
+            if name not in referenced
+        ]
@@ -0,0 +1,88 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from products.catalog import bump_catalog_version
+from products.images import build_derivatives, derivative_names
+from products.models import ProductImage
+
+# With --loop, originals missing from storage are retried after this many
+# seconds, doubling per attempt up to MAX_RETRY_DELAY.
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+
+
+def _build(image_name):
+    return image_name, build_derivatives(image_name, default_storage)
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails and WebP variants for product images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true', help='Rebuild images that already have derivatives')
+        parser.add_argument('--loop', action='store_true', help='Keep processing new uploads as a background worker')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        # name -> (attempts, monotonic time of the next try)
+        self.missing = {}
+        while True:
+            close_old_connections()
+            self.run_once(options)
+            if not options['loop']:
+                break
+            options['force'] = False
+            time.sleep(options['interval'])
+
+    def run_once(self, options):
+        images = ProductImage.objects.exclude(image='')
+        if not options['force']:
+            images = images.filter(derivatives={})
+        pending = {}
+        previous = {}
+        now = time.monotonic()
+        for pk, name, derivatives in images.values_list('pk', 'image', 'derivatives'):
+            if name in self.missing and self.missing[name][1] > now:
+                continue
+            pending.setdefault(name, []).append(pk)
+            previous.setdefault(name, set()).update(derivative_names(derivatives))
+
+        if not pending:
+            if not options['loop']:
+                self.stdout.write('No images to process.')
+            return
+
+        # Workers only touch storage; don't let them inherit DB connections.
+        connections.close_all()
+        done = failed = missing = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for name, derivatives in pool.map(_build, pending, chunksize=4):
+                if derivatives is None:
+                    # Possibly not uploaded or synced yet: leave it pending.
+                    attempts = self.missing.get(name, (0, 0))[0] + 1
+                    delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+                    self.missing[name] = (attempts, time.monotonic() + delay)
+                    missing += 1
+                    continue
+                self.missing.pop(name, None)
+                if not derivatives:
+                    self.stderr.write(f'Skipped {name}: could not decode image')
+                    failed += 1
+                else:
+                    done += 1
+                ProductImage.objects.filter(pk__in=pending[name]).update(derivatives=derivatives or {'failed': True})
+                # Rebuilt files get new names; drop the ones they replace.
+                for old_name in previous[name] - set(derivative_names(derivatives)):
+                    default_storage.delete(old_name)
+
+        if done or failed:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {done} images ({failed} skipped, {missing} missing from storage).'
+        ))
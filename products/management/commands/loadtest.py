@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+import httpx
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from products.loadtest import KhaltiStub, run_load
+from products.models import Product
+from recommendations import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Load-test browsing, search and checkout over HTTP and report latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to test')
+        parser.add_argument('--serve', action='store_true',
+                            help='Start gunicorn on --url, wired to the Khalti stub, for the duration of the run')
+        parser.add_argument('--workers', type=int, default=2, help='Gunicorn workers with --serve')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='wsgi',
+                            help='Server mode with --serve; "both" runs the same load against each and compares')
+        parser.add_argument('--guests', type=int, default=10, help='Concurrent anonymous users')
+        parser.add_argument('--buyers', type=int, default=10, help='Concurrent signed-in users checking out')
+        parser.add_argument('--pollers', type=int, default=0,
+                            help='Concurrent signed-in users polling cart and wishlist state')
+        parser.add_argument('--iterations', type=int, default=5, help='Journeys per virtual user')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--stub-port', type=int, default=8765, help='Port for the local Khalti stub')
+        parser.add_argument('--stub-latency', type=float, default=0, help='Seconds the stub waits per call')
+        parser.add_argument('--seed-data', action='store_true',
+                            help='Generate a synthetic catalog first if there is none')
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic users with --seed-data')
+        parser.add_argument('--clear', action='store_true', help='Remove the synthetic data afterwards')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default='loadtest-benchmark.json', help='Where to write JSON results')
+
+    def handle(self, *args, **options):
+        if not benchmark.has_data():
+            if not options['seed_data']:
+                raise CommandError('No synthetic catalog found; run with --seed-data.')
+            users = max(options['users'], options['buyers'])
+            benchmark.generate(users, max(users // 10, 10), 20, 20, 1.1, options['seed'], log=self.stdout.write)
+
+        password = benchmark.PREFIX + 'password'
+        buyers = list(benchmark.bench_users().order_by('id').values_list('username', flat=True)[:options['buyers']])
+        benchmark.bench_users().filter(username__in=buyers).update(password=make_password(password))
+        catalog = list(
+            Product.objects.filter(is_active=True, user__username__startswith=benchmark.PREFIX)
+            .values_list('category_id', 'id')[:1000]
+        )
+
+        stub = KhaltiStub(port=options['stub_port'], latency=options['stub_latency']).start()
+        self.stdout.write(f'Khalti stub listening at {stub.base_url}')
+        if not options['serve']:
+            self.stdout.write(f'Start the server with KHALTI_BASE_URL={stub.base_url} to include checkout.')
+        modes = ['wsgi', 'asgi'] if options['mode'] == 'both' else [options['mode']]
+
+        reports = {}
+        try:
+            for mode in modes:
+                server = self.start_server(options, stub, mode) if options['serve'] else None
+                try:
+                    reports[mode] = asyncio.run(run_load(
+                        options['url'], catalog, benchmark.VOCABULARY[:50],
+                        [(username, password) for username in buyers],
+                        options['guests'], options['iterations'], options['seed'], options['timeout'],
+                        options['pollers'],
+                    ))
+                finally:
+                    if server is not None:
+                        server.terminate()
+                        server.wait()
+                if options['serve']:
+                    self.stdout.write(f'\n{mode.upper()}')
+                self.print_report(reports[mode])
+        finally:
+            stub.shutdown()
+            if options['clear']:
+                benchmark.clear()
+
+        report = reports[modes[0]] if len(modes) == 1 else {'modes': reports}
+        if len(modes) > 1:
+            self.print_comparison(reports)
+        report['parameters'] = {
+            key: options[key]
+            for key in ('url', 'guests', 'buyers', 'pollers', 'iterations', 'stub_latency', 'workers', 'mode')
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    def start_server(self, options, stub, mode):
+        address = urlparse(options['url'])
+        env = {
+            **os.environ,
+            # gunicorn.conf.py picks the app and worker class from this.
+            'SERVER_MODE': mode,
+            'PAYMENT_GATEWAY_BACKEND': 'products.payments.KhaltiBackend',
+            'KHALTI_BASE_URL': stub.base_url,
+            'KHALTI_SECRET_KEY': os.environ.get('KHALTI_SECRET_KEY') or 'loadtest',
+            # Keep background builders from competing with the measured workers.
+            'IMAGE_DERIVATIVE_WORKERS': '0',
+            'RECOMMENDER_SNAPSHOT_INTERVAL': '0',
+        }
+        server = subprocess.Popen([
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'{address.hostname}:{address.port or 80}', '--workers', str(options['workers']),
+        ], env=env)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited with status {server.returncode}')
+            try:
+                httpx.get(options['url'] + '/login/', timeout=1)
+                return server
+            except httpx.HTTPError:
+                time.sleep(0.25)
+        server.terminate()
+        raise CommandError(f"Server at {options['url']} did not come up within 30 seconds")
+
+    def print_report(self, report):
+        self.stdout.write(f"{'endpoint':<20}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'p99 ms':>10}{'req/s':>9}")
+        for label, stats in report['endpoints'].items():
+            self.stdout.write(
+                f"{label:<20}{stats['requests']:>9}{stats['errors']:>8}{stats['p50_ms']:>10.1f}"
+                f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['rps']:>9.1f}"
+            )
+        self.stdout.write(
+            f"{report['requests']} requests, {report['errors']} errors in {report['elapsed_seconds']}s "
+            f"({report['rps']} req/s)"
+        )
+
+    def print_comparison(self, reports):
+        wsgi, asgi = reports['wsgi'], reports['asgi']
+        self.stdout.write(f"\n{'endpoint':<20}{'WSGI p95':>10}{'ASGI p95':>10}{'WSGI req/s':>12}{'ASGI req/s':>12}")
+        for label in sorted(set(wsgi['endpoints']) | set(asgi['endpoints'])):
+            before = wsgi['endpoints'].get(label, {})
+            after = asgi['endpoints'].get(label, {})
+            self.stdout.write(
+                f"{label:<20}{before.get('p95_ms', 0):>10.1f}{after.get('p95_ms', 0):>10.1f}"
+                f"{before.get('rps', 0):>12.1f}{after.get('rps', 0):>12.1f}"
+            )
+        self.stdout.write(f"{'total':<20}{'':>20}{wsgi['rps']:>12.1f}{asgi['rps']:>12.1f}")
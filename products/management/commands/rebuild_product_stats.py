@@ -0,0 +1,34 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from products.stats import rebuild_stats
+
+
+def date_argument(value):
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise CommandError(f'Not a YYYY-MM-DD date: {value}')
+    return date
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-product daily stats from raw interactions and sales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date_argument, help='First day to rebuild (default: --days ago)')
+        parser.add_argument('--end', type=date_argument, help='Last day to rebuild (default: today)')
+        parser.add_argument('--days', type=int, default=30, help='Days back from --end when --start is not given')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        start = options['start'] or end - datetime.timedelta(days=options['days'] - 1)
+        if start > end:
+            raise CommandError('--start is after --end')
+        rows = rebuild_stats(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} product-day rows for {start} to {end}.'))
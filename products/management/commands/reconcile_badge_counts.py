@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from products.counters import reconcile_counts
+
+
+class Command(BaseCommand):
+    help = "Recount users' wishlist and cart badge counts from the tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running as a background worker')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            changed = reconcile_counts()
+            if changed:
+                self.stdout.write(f'Corrected {changed} badge counts')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+            close_old_connections()
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from products.payments import pending_callbacks, stale_payments, verify_payments
+
+
+class Command(BaseCommand):
+    help = 'Verify pending Khalti payments and settle or cancel their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent gateway lookups')
+        parser.add_argument('--recheck-after', type=float, default=30,
+                            help='Seconds before a callback the gateway still reports as pending is looked up again')
+        parser.add_argument('--sweep-after', type=int, default=10,
+                            help='Minutes before an unpaid order without a callback is checked')
+        parser.add_argument('--loop', action='store_true', help='Keep running as a background worker')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            self.run_once(options)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def run_once(self, options):
+        callbacks = verify_payments(
+            pending_callbacks(options['batch_size'], timedelta(seconds=options['recheck_after'])),
+            options['workers'],
+        )
+        swept = verify_payments(
+            stale_payments(options['batch_size'], timedelta(minutes=options['sweep_after'])),
+            options['workers'],
+        )
+        for label, counts in (('Callbacks', callbacks), ('Sweep', swept)):
+            if any(counts.values()):
+                self.stdout.write(
+                    f"{label}: {counts['completed']} completed, {counts['failed']} failed, "
+                    f"{counts['refund_due']} refund due, "
+                    f"{counts['pending']} still pending, {counts['unavailable']} gateway unavailable"
+                )
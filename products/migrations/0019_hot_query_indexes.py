@@ -0,0 +1,85 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:10
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Indexes are built concurrently so live tables keep taking writes;
+    # the FK indexes they make redundant are dropped afterwards.
+    atomic = False
+
+    dependencies = [
+        ('products', '0018_productdailystats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_new_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='product_active_new_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', '-created_at'], include=('id',), name='product_active_cat_new_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', 'price'], name='product_active_cat_price_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['subcategory', '-created_at'], name='product_active_sub_new_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['subsubcategory', '-created_at'], name='product_active_subsub_new_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['user', '-created_at'], name='product_user_new_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productsimilarity',
+            index=models.Index(fields=['product1', '-similarity_score'], name='prodsim_product1_score_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='sale',
+            index=models.Index(django.db.models.functions.datetime.TruncDate('sold_at'), name='sale_sold_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usersimilarity',
+            index=models.Index(fields=['user1', '-similarity_score'], name='usersim_user1_score_idx'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='productsimilarity',
+            name='product1',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similarities_as_product1', to='products.product'),
+        ),
+        migrations.AlterField(
+            model_name='usersimilarity',
+            name='user1',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similarities_as_user1', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,12 +1,12 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Avg, Count
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+from django.db.models import Avg, Count, Q
+from django.db.models.functions import TruncDate
 import json
 from datetime import datetime, timedelta
+from .catalog import bump_catalog_version
+from .images import build_derivatives, derivative_names
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -45,7 +45,8 @@ class Product(models.Model):
         ('used_fair', 'Used - Fair'),
     ]
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Meta's (user, ...) indexes serve FK lookups too.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     subcategory = models.ForeignKey(SubCategory, on_delete=models.SET_NULL, null=True, blank=True)
     subsubcategory = models.ForeignKey(SubSubCategory, on_delete=models.SET_NULL, null=True, blank=True)
@@ -64,14 +65,48 @@ class Product(models.Model):
     city = models.CharField(max_length=100, blank=True, null=True)
     location_address = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        # Listing pages only show active products, newest or cheapest
+        # first, so the partial indexes skip sold listings entirely. ``id``
+        # is included so category_product_ids is an index-only scan.
+        indexes = [
+            models.Index(fields=['-created_at'], condition=Q(is_active=True), name='product_active_new_idx'),
+            models.Index(fields=['category', '-created_at'], include=['id'], condition=Q(is_active=True),
+                         name='product_active_cat_new_idx'),
+            models.Index(fields=['category', 'price'], condition=Q(is_active=True),
+                         name='product_active_cat_price_idx'),
+            models.Index(fields=['subcategory', '-created_at'], condition=Q(is_active=True),
+                         name='product_active_sub_new_idx'),
+            models.Index(fields=['subsubcategory', '-created_at'], condition=Q(is_active=True),
+                         name='product_active_subsub_new_idx'),
+            models.Index(fields=['user', '-created_at'], name='product_user_new_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+class ImageBlob(models.Model):
+    """One stored image file, shared by every ProductImage with the same bytes."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+    def derivatives(self):
+        """Derivatives already built for this file by any image using it."""
+        return self.images.exclude(derivatives={}).values_list('derivatives', flat=True).first() or {}
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images', null=True, blank=True)
     image = models.ImageField(upload_to='product_images/')
+    blob = models.ForeignKey(ImageBlob, on_delete=models.SET_NULL, related_name='images', null=True, blank=True)
     is_primary = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    derivatives = models.JSONField(default=dict, blank=True)  # see products/images.py
 
     class Meta:
         ordering = ['-is_primary', 'uploaded_at']
@@ -79,6 +114,35 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"Image for {self.product.name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.image and not self.derivatives:
+            self.generate_derivatives()
+
+    def generate_derivatives(self):
+        derivatives = build_derivatives(self.image.name, self.image.storage)
+        if derivatives is None:
+            # Not in storage; left pending for generate_image_derivatives.
+            return
+        previous = derivative_names(self.derivatives)
+        # {'failed': True} keeps undecodable files out of the backfill queue.
+        self.derivatives = derivatives or {'failed': True}
+        # Deduplicated images share one file, so they share its derivatives.
+        ProductImage.objects.filter(image=self.image.name).update(derivatives=self.derivatives)
+        bump_catalog_version()
+        for name in set(previous) - set(derivative_names(self.derivatives)):
+            self.image.storage.delete(name)
+
+    @property
+    def thumbnail_url(self):
+        name = self.derivatives.get('thumbnail')
+        return self.image.storage.url(name) if name else self.image.url
+
+    @property
+    def srcset(self):
+        variants = sorted(self.derivatives.get('webp', {}).items(), key=lambda item: int(item[0]))
+        return ", ".join(f"{self.image.storage.url(name)} {width}w" for width, name in variants)
+
 class Wishlist(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wishlist_items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -114,21 +178,36 @@ class Sale(models.Model):
     sold_price = models.DecimalField(max_digits=10, decimal_places=2)
     notes = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Matches ``sold_at__date`` lookups, which compare
+            # (sold_at AT TIME ZONE TIME_ZONE)::date; rebuild it if TIME_ZONE changes.
+            models.Index(TruncDate('sold_at'), name='sale_sold_date_idx'),
+        ]
+
     def __str__(self):
         return f"Sale of {self.product.name} for Rs. {self.sold_price}"
 
 class Order(models.Model):
     STATUS_CHOICES = [
         ('unpaid', 'Unpaid'),   
+        ('processing', 'Processing'),
         ('paid', 'Paid'),
         ('cancelled', 'Cancelled'),
     ]
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Meta's (user, ...) indexes serve FK lookups too.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            models.Index(fields=['user', '-created_at'], name='order_user_new_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
@@ -141,6 +220,32 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.price} (Seller: {self.seller.username})"
 
+class Payment(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        # Completed at the gateway for an order that was already cancelled
+        # or paid; needs a refund or manual review.
+        ('refund_due', 'Refund due'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='payments', on_delete=models.CASCADE)
+    pidx = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    gateway_status = models.CharField(max_length=50, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    checked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Payment {self.pidx} for Order #{self.order_id} ({self.status})"
+
 class UserInteraction(models.Model):
     INTERACTION_TYPES = [
         ('view', 'View'),
@@ -163,19 +268,50 @@ class UserInteraction(models.Model):
         ]
 
 class UserSimilarity(models.Model):
-    user1 = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='similarities_as_user1')
+    # Meta's (user1, ...) indexes serve FK lookups too.
+    user1 = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='similarities_as_user1',
+                              db_index=False)
     user2 = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='similarities_as_user2')
     similarity_score = models.FloatField()
     calculated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         unique_together = ('user1', 'user2')
+        indexes = [
+            models.Index(fields=['user1', '-similarity_score'], name='usersim_user1_score_idx'),
+        ]
 
 class ProductSimilarity(models.Model):
-    product1 = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similarities_as_product1')
+    # Meta's (product1, ...) indexes serve FK lookups too.
+    product1 = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similarities_as_product1',
+                                 db_index=False)
     product2 = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similarities_as_product2')
     similarity_score = models.FloatField()
     calculated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        unique_together = ('product1', 'product2')
\ No newline at end of file
+        unique_together = ('product1', 'product2')
+        indexes = [
+            models.Index(fields=['product1', '-similarity_score'], name='prodsim_product1_score_idx'),
+        ]
+
+class ProductDailyStats(models.Model):
+    """One product's counters for one day, kept up to date by products.stats."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_stats')
+    # Copied from product.user so a seller's range is one index scan.
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='product_stats')
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    clicks = models.PositiveIntegerField(default=0)
+    wishlist_adds = models.PositiveIntegerField(default=0)
+    cart_adds = models.PositiveIntegerField(default=0)
+    purchases = models.PositiveIntegerField(default=0)
+    sales = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('product', 'date')
+        indexes = [
+            models.Index(fields=['seller', 'date']),
+        ]
+        verbose_name_plural = "Product daily stats"
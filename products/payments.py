@@ -0,0 +1,463 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .catalog import bump_catalog_version
+from .models import Order, Payment, Product, Sale
+from .stats import record_sales
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'products.payments.KhaltiBackend',
+    'BASE_URL': 'https://a.khalti.com/api/v2/',
+    'SECRET_KEY': '',
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    'MAX_RETRIES': 2,
+    'BACKOFF_FACTOR': 0.5,
+    'POOL_MAXSIZE': 10,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+    'STUB_LATENCY': 0,
+}
+
+
+class PaymentGatewayError(Exception):
+    """Base class for payment gateway failures."""
+
+
+class GatewayUnavailable(PaymentGatewayError):
+    """The gateway could not be reached, timed out, or returned a 5xx."""
+
+
+class PaymentRejected(PaymentGatewayError):
+    """The gateway answered but refused the request (4xx)."""
+
+    def __init__(self, message, data=None):
+        super().__init__(message)
+        self.data = data or {}
+
+
+class CircuitBreaker:
+    """Fail fast after repeated gateway outages.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are refused for ``reset_timeout`` seconds. The next call after
+    that is let through as a trial; success closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: allow one trial call, re-open if it fails.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Payment gateway circuit opened after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+
+
+class KhaltiBackend:
+    """Khalti ePayment API over a pooled, retrying requests session.
+
+    The ``a``-prefixed methods do the same over an httpx client per call
+    for async views, retrying gateway errors with the same backoff.
+    """
+
+    RETRY_STATUSES = (502, 503, 504)
+    INITIATE = 'epayment/initiate/'
+    LOOKUP = 'epayment/lookup/'
+    # Errors raised before the request was sent, so always safe to retry.
+    CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+    def __init__(self, options):
+        self.base_url = options['BASE_URL']
+        self.secret_key = options['SECRET_KEY']
+        self.timeout = (options['CONNECT_TIMEOUT'], options['READ_TIMEOUT'])
+        self.max_retries = options['MAX_RETRIES']
+        self.backoff_factor = options['BACKOFF_FACTOR']
+
+        retry = Retry(
+            total=options['MAX_RETRIES'],
+            backoff_factor=options['BACKOFF_FACTOR'],
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=options['POOL_MAXSIZE'], max_retries=retry)
+        # Initiate isn't idempotent: once the request may have reached Khalti
+        # (a read error or a 5xx), a retry could open a second payment session
+        # for the order. Only failures to connect are retried.
+        initiate_retry = Retry(
+            total=options['MAX_RETRIES'],
+            connect=options['MAX_RETRIES'],
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=options['BACKOFF_FACTOR'],
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False,
+        )
+        initiate_adapter = HTTPAdapter(pool_maxsize=options['POOL_MAXSIZE'], max_retries=initiate_retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Requests picks the adapter with the longest matching prefix.
+        self.session.mount(self.base_url + self.INITIATE, initiate_adapter)
+        # Replaced in tests with an httpx.MockTransport.
+        self.async_transport = None
+
+    @property
+    def headers(self):
+        return {
+            'Authorization': f"key {self.secret_key}",
+            'Content-Type': 'application/json',
+        }
+
+    def _parse(self, response):
+        if response.status_code >= 500:
+            raise GatewayUnavailable(f"Gateway returned HTTP {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code != 200:
+            raise PaymentRejected(f"Gateway returned HTTP {response.status_code}", data)
+        return data
+
+    def _post(self, path, payload):
+        try:
+            response = self.session.post(self.base_url + path, json=payload, headers=self.headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise GatewayUnavailable(str(e)) from e
+        return self._parse(response)
+
+    def _async_client(self):
+        connect, read = self.timeout
+        return httpx.AsyncClient(timeout=httpx.Timeout(read, connect=connect), transport=self.async_transport)
+
+    async def _apost(self, path, payload, idempotent=True):
+        """POST with retries; unless ``idempotent``, only connection failures are retried, as for initiate."""
+        # A client per call, closed on the way out: under WSGI every async
+        # view runs on a fresh event loop, and a client kept from an earlier
+        # loop can't be reused or cleanly closed. Retries share its
+        # connection.
+        async with self._async_client() as client:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+                try:
+                    response = await client.post(self.base_url + path, json=payload, headers=self.headers)
+                except httpx.HTTPError as e:
+                    if attempt == self.max_retries or not (idempotent or isinstance(e, self.CONNECT_ERRORS)):
+                        raise GatewayUnavailable(str(e)) from e
+                    continue
+                if not idempotent or response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                    return self._parse(response)
+
+    def initiate(self, payload):
+        return self._post(self.INITIATE, payload)
+
+    def lookup(self, pidx):
+        return self._post(self.LOOKUP, {'pidx': pidx})
+
+    async def ainitiate(self, payload):
+        return await self._apost(self.INITIATE, payload, idempotent=False)
+
+    async def alookup(self, pidx):
+        return await self._apost(self.LOOKUP, {'pidx': pidx})
+
+
+class StubBackend:
+    """Offline stand-in that approves every payment.
+
+    The payment URL points straight back at ``return_url``, so checkout can
+    be exercised end to end (and load-tested) without reaching Khalti.
+    ``STUB_LATENCY`` adds an artificial delay in seconds to each call.
+    """
+
+    def __init__(self, options):
+        self.latency = options['STUB_LATENCY']
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    async def _await(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def initiate(self, payload):
+        self._wait()
+        return self._approve(payload)
+
+    def lookup(self, pidx):
+        self._wait()
+        return {'pidx': pidx, 'status': 'Completed'}
+
+    async def ainitiate(self, payload):
+        await self._await()
+        return self._approve(payload)
+
+    async def alookup(self, pidx):
+        await self._await()
+        return {'pidx': pidx, 'status': 'Completed'}
+
+    def _approve(self, payload):
+        pidx = uuid.uuid4().hex
+        query = urlencode({
+            'pidx': pidx,
+            'purchase_order_id': payload['purchase_order_id'],
+            'status': 'Completed',
+        })
+        return {'pidx': pidx, 'payment_url': f"{payload['return_url']}?{query}"}
+
+
+class PaymentGateway:
+    """Routes gateway calls through the configured backend and circuit breaker."""
+
+    def __init__(self, options=None):
+        options = {**DEFAULTS, **(options or {})}
+        self.backend = import_string(options['BACKEND'])(options)
+        self.breaker = CircuitBreaker(options['FAILURE_THRESHOLD'], options['RESET_TIMEOUT'])
+
+    def _call(self, method, *args):
+        if not self.breaker.allow_request():
+            raise GatewayUnavailable("Payment gateway circuit is open")
+        try:
+            result = getattr(self.backend, method)(*args)
+        except GatewayUnavailable:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def _acall(self, method, *args):
+        if not self.breaker.allow_request():
+            raise GatewayUnavailable("Payment gateway circuit is open")
+        try:
+            result = await getattr(self.backend, method)(*args)
+        except GatewayUnavailable:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def initiate(self, payload):
+        return self._call('initiate', payload)
+
+    def lookup(self, pidx):
+        return self._call('lookup', pidx)
+
+    async def ainitiate(self, payload):
+        return await self._acall('ainitiate', payload)
+
+    async def alookup(self, pidx):
+        return await self._acall('alookup', pidx)
+
+
+_gateway = None
+
+
+def get_gateway():
+    """Return the process-wide gateway so its connection pool is reused."""
+    global _gateway
+    if _gateway is None:
+        _gateway = PaymentGateway(getattr(settings, 'PAYMENT_GATEWAY', None))
+    return _gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting == 'PAYMENT_GATEWAY':
+        _gateway = None
+
+
+# Khalti lookup statuses after which a payment will never complete.
+FAILED_STATUSES = {'Expired', 'User canceled', 'Refunded', 'Partially Refunded'}
+
+
+def settle_order(order):
+    """Mark an unpaid order as paid and record its sales.
+
+    The status transition is a conditional UPDATE, so only one caller can
+    settle a given order; duplicate callbacks get False and write nothing.
+    """
+    with transaction.atomic():
+        settled = Order.objects.filter(
+            pk=order.pk, status__in=['unpaid', 'processing']
+        ).update(status='paid')
+        if not settled:
+            return False
+
+        items = list(order.items.values_list('product_id', 'price'))
+        Product.objects.filter(
+            id__in=[product_id for product_id, _ in items]
+        ).update(is_active=False, updated_at=timezone.now())
+        bump_catalog_version()
+
+        sales = Sale.objects.bulk_create([
+            Sale(
+                product_id=product_id,
+                buyer_id=order.user_id,
+                sold_price=price,
+                notes="Sold via Khalti payment"
+            )
+            for product_id, price in items
+        ])
+        # bulk_create doesn't send post_save.
+        record_sales(sales)
+
+    order.status = 'paid'
+    return True
+
+
+def record_callback(order, pidx):
+    """Store the pidx from a gateway callback and queue the order for verification.
+
+    Returns None if the pidx already belongs to a different order.
+    """
+    payment, _ = Payment.objects.get_or_create(pidx=pidx, defaults={'order': order})
+    if payment.order_id != order.id:
+        return None
+    if Order.objects.filter(pk=order.pk, status='unpaid').update(status='processing'):
+        order.status = 'processing'
+    return payment
+
+
+def _lookup(payment):
+    try:
+        return get_gateway().lookup(payment.pidx)
+    except PaymentGatewayError as e:
+        return e
+
+
+def apply_lookup(payment, result):
+    """Update a payment (and settle or cancel its order) from a lookup result."""
+    if isinstance(result, PaymentRejected):
+        gateway_status = result.data.get('status', '')
+        failed = True
+    else:
+        gateway_status = result.get('status', '')
+        failed = gateway_status in FAILED_STATUSES
+
+    payment.attempts += 1
+    payment.checked_at = timezone.now()
+    payment.gateway_status = gateway_status
+
+    with transaction.atomic():
+        if gateway_status == 'Completed':
+            if settle_order(payment.order):
+                payment.status = 'completed'
+            else:
+                # The buyer paid, but the order was already cancelled or
+                # settled by another payment: the money has to go back.
+                payment.status = 'refund_due'
+                order_status = Order.objects.filter(pk=payment.order_id).values_list('status', flat=True).first()
+                logger.error(
+                    f"Payment {payment.pidx} completed but order #{payment.order_id} is {order_status}; "
+                    f"refund or review needed"
+                )
+        elif failed:
+            payment.status = 'failed'
+            # Only orders whose buyer came back through the callback are
+            # cancelled; abandoned unpaid orders stay payable. A buyer may
+            # have abandoned one pidx and paid with another, so the order
+            # is left alone while any other payment could still settle it.
+            other_payments = Payment.objects.filter(
+                order=OuterRef('pk'), status__in=['pending', 'completed'],
+            ).exclude(pk=payment.pk)
+            Order.objects.filter(pk=payment.order_id, status='processing').exclude(
+                Exists(other_payments)
+            ).update(status='cancelled')
+
+        payment.save(update_fields=['status', 'gateway_status', 'attempts', 'checked_at'])
+    return payment.status
+
+
+def verify_payments(payments, workers=4):
+    """Look up a batch of pending payments concurrently and apply the results.
+
+    Gateway lookups run in a thread pool; all database writes happen on the
+    calling thread. Payments whose lookup hit an unavailable gateway are left
+    pending for the next run. Returns a count per resulting status.
+    """
+    payments = list(payments)
+    counts = {'completed': 0, 'failed': 0, 'refund_due': 0, 'pending': 0, 'unavailable': 0}
+    if not payments:
+        return counts
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(payments))) as pool:
+        results = list(pool.map(_lookup, payments))
+
+    for payment, result in zip(payments, results):
+        if isinstance(result, GatewayUnavailable):
+            counts['unavailable'] += 1
+            continue
+        counts[apply_lookup(payment, result)] += 1
+    return counts
+
+
+def pending_callbacks(batch_size=50, recheck_after=timedelta(seconds=30)):
+    """Payments reported back by the gateway callback and awaiting verification.
+
+    Payments the gateway still reports as pending wait ``recheck_after``
+    before the next lookup, and the least recently checked go first, so a
+    backlog of stuck payments can't crowd newer callbacks out of the batch.
+    """
+    cutoff = timezone.now() - recheck_after
+    return Payment.objects.filter(
+        Q(checked_at__isnull=True) | Q(checked_at__lte=cutoff),
+        status='pending',
+        order__status='processing',
+    ).select_related('order').order_by(F('checked_at').asc(nulls_first=True), 'created_at')[:batch_size]
+
+
+def stale_payments(batch_size=50, older_than=timedelta(minutes=10)):
+    """Pending payments on unpaid orders whose callback never arrived."""
+    cutoff = timezone.now() - older_than
+    return Payment.objects.filter(
+        Q(checked_at__isnull=True) | Q(checked_at__lte=cutoff),
+        status='pending',
+        order__status='unpaid',
+        created_at__lte=cutoff,
+    ).select_related('order').order_by('created_at')[:batch_size]
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import numpy as np
+
+from merobazar.metrics import record_cache_lookup
+
+from .catalog import catalog_version
+from .models import Product
+
+_rng = np.random.default_rng()
+_lock = threading.Lock()
+# Seconds an id list is kept even if the catalog version hasn't moved. With
+# a per-process cache backend (LocMemCache, the default) the version only
+# moves in the worker that made the change, so this bounds how long the
+# others keep sampling a stale list.
+CATEGORY_IDS_TTL = 60
+# category_id -> (catalog version, monotonic expiry time, array of active product ids)
+_category_ids = {}
+
+
+def reseed():
+    """Give this process its own random stream; forked workers would otherwise share one."""
+    _rng.bit_generator.state = np.random.default_rng().bit_generator.state
+
+
+def category_product_ids(category_id):
+    """Active product ids in a category, rebuilt when the catalog version moves or the entry expires."""
+    version = catalog_version()
+    now = time.monotonic()
+    cached = _category_ids.get(category_id)
+    if cached is not None and cached[0] == version and cached[1] > now:
+        record_cache_lookup('category_ids', 'hit')
+        return cached[2]
+    record_cache_lookup('category_ids', 'miss')
+    ids = np.fromiter(
+        Product.objects.filter(category_id=category_id, is_active=True).values_list('id', flat=True),
+        dtype=np.int64,
+    )
+    with _lock:
+        _category_ids[category_id] = (version, now + CATEGORY_IDS_TTL, ids)
+    return ids
+
+
+def sample_ids(ids, k, exclude=None, rng=_rng):
+    """Pick up to ``k`` distinct ids at random, skipping ``exclude``.
+
+    Small populations are shuffled outright; larger ones draw random
+    positions and drop repeats, which costs O(k) however big the category.
+    """
+    n = len(ids)
+    wanted = k + 1  # room for the excluded id
+    if n <= 4 * wanted:
+        picked = ids[rng.permutation(n)]
+    else:
+        positions = np.empty(0, dtype=np.int64)
+        while len(positions) < wanted:
+            positions = np.union1d(positions, rng.integers(n, size=2 * wanted))
+        picked = ids[rng.permutation(positions)[:wanted]]
+    if exclude is not None:
+        picked = picked[picked != exclude]
+    return picked[:k].tolist()
+
+
+def random_category_products(product, k=8):
+    """Up to ``k`` other active products from ``product``'s category, in one query."""
+    ids = sample_ids(category_product_ids(product.category_id), k, exclude=product.id)
+    return Product.objects.filter(id__in=ids, is_active=True)
@@ -21,9 +21,23 @@ class SubSubCategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'subcategory']
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    thumbnail = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'is_primary']
+        fields = ['id', 'image', 'thumbnail', 'srcset', 'is_primary']
+
+    def _absolute(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnail(self, obj):
+        return self._absolute(obj.thumbnail_url)
+
+    def get_srcset(self, obj):
+        variants = sorted(obj.derivatives.get('webp', {}).items(), key=lambda item: int(item[0]))
+        return ", ".join(f"{self._absolute(obj.image.storage.url(name))} {width}w" for width, name in variants)
 
 class ProductSerializer(serializers.ModelSerializer):
     category = CategorySerializer()
@@ -0,0 +1,53 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .counters import adjust_count
+from .models import Cart, Category, Product, ProductImage, Sale, SubCategory, SubSubCategory, UserInteraction, Wishlist
+from .stats import record_interaction, record_sales
+from .uploads import release_blob
+
+CATALOG_MODELS = (Category, SubCategory, SubSubCategory, Product, ProductImage)
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_image_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        release_blob(instance.blob_id, instance.derivatives)
+
+
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_save, sender=Cart)
+def saved_product_added(sender, instance, created, using, **kwargs):
+    if created:
+        adjust_count(sender, instance.user_id, 1, using)
+
+
+# Queryset deletes (checkout, cascades) send this per row too, in the
+# deleting transaction.
+@receiver(post_delete, sender=Wishlist)
+@receiver(post_delete, sender=Cart)
+def saved_product_removed(sender, instance, using, **kwargs):
+    adjust_count(sender, instance.user_id, -1, using)
+
+
+@receiver(post_save, sender=UserInteraction)
+def count_interaction(sender, instance, created, using, **kwargs):
+    if created:
+        record_interaction(instance, using)
+
+
+# settle_order bulk-creates its sales and records them itself.
+@receiver(post_save, sender=Sale)
+def count_sale(sender, instance, created, using, **kwargs):
+    if created:
+        record_sales([instance], using)
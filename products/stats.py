@@ -0,0 +1,139 @@
+"""Per-product daily counters behind the seller analytics page.
+
+Each UserInteraction and Sale adds to its product's ProductDailyStats row
+for the day with one INSERT ... ON CONFLICT DO UPDATE in the same
+transaction (see signals.py), so analytics read a seller's pre-aggregated
+rows through the (seller, date) index and never scan raw events.
+``manage.py rebuild_product_stats`` recomputes rows from the raw tables
+for a backfill or after bulk loads that skip signals.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Product, ProductDailyStats, Sale, UserInteraction
+
+# UserInteraction.interaction_type -> counter
+INTERACTION_COUNTERS = {
+    'view': 'views',
+    'click': 'clicks',
+    'wishlist': 'wishlist_adds',
+    'cart': 'cart_adds',
+    'purchase': 'purchases',
+}
+COUNTERS = [*INTERACTION_COUNTERS.values(), 'sales', 'revenue']
+# Longest range the analytics endpoint serves in one request.
+MAX_RANGE_DAYS = 366
+
+
+def add_to_stats(product_id, date, using='default', **amounts):
+    """Add ``amounts`` (counter -> increment) to a product's row for ``date``.
+
+    Missing products are skipped rather than raising, like the interaction
+    rows the recommender middleware writes for any ``pk`` in a URL.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(ProductDailyStats._meta.db_table)
+    columns = ', '.join(quote(name) for name in COUNTERS)
+    placeholders = ', '.join(['%s'] * len(COUNTERS))
+    updates = ', '.join(f'{quote(name)} = {table}.{quote(name)} + EXCLUDED.{quote(name)}' for name in amounts)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ("product_id", "seller_id", "date", {columns}) '
+            f'SELECT "id", "user_id", %s, {placeholders} FROM {quote(Product._meta.db_table)} WHERE "id" = %s '
+            f'ON CONFLICT ("product_id", "date") DO UPDATE SET {updates}',
+            [date, *(amounts.get(name, 0) for name in COUNTERS), product_id],
+        )
+
+
+def record_interaction(interaction, using='default'):
+    counter = INTERACTION_COUNTERS.get(interaction.interaction_type)
+    if counter:
+        add_to_stats(interaction.product_id, timezone.localdate(interaction.timestamp), using, **{counter: 1})
+
+
+def record_sales(sales, using='default'):
+    """Count ``sales``, one statement per product and day."""
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for sale in sales:
+        total = totals[sale.product_id, timezone.localdate(sale.sold_at)]
+        total[0] += 1
+        total[1] += sale.sold_price
+    for (product_id, date), (count, revenue) in totals.items():
+        add_to_stats(product_id, date, using, sales=count, revenue=revenue)
+
+
+def rebuild_stats(start, end):
+    """Recompute every row dated ``start``..``end`` from UserInteraction and Sale.
+
+    Returns the number of rows written.
+    """
+    rows = {}
+
+    def row(product_id, seller_id, date):
+        if (product_id, date) not in rows:
+            rows[product_id, date] = ProductDailyStats(product_id=product_id, seller_id=seller_id, date=date)
+        return rows[product_id, date]
+
+    interactions = (
+        UserInteraction.objects.filter(timestamp__date__range=(start, end))
+        .values('product_id', 'product__user_id', 'interaction_type', day=TruncDate('timestamp'))
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    sales = (
+        Sale.objects.filter(sold_at__date__range=(start, end))
+        .values('product_id', 'product__user_id', day=TruncDate('sold_at'))
+        .annotate(count=Count('id'), revenue=Sum('sold_price'))
+        .order_by()
+    )
+    with transaction.atomic():
+        for interaction in interactions:
+            counter = INTERACTION_COUNTERS.get(interaction['interaction_type'])
+            if counter:
+                stats = row(interaction['product_id'], interaction['product__user_id'], interaction['day'])
+                setattr(stats, counter, interaction['count'])
+        for sale in sales:
+            stats = row(sale['product_id'], sale['product__user_id'], sale['day'])
+            stats.sales, stats.revenue = sale['count'], sale['revenue']
+
+        ProductDailyStats.objects.filter(date__range=(start, end)).delete()
+        ProductDailyStats.objects.bulk_create(rows.values(), batch_size=5000)
+    return len(rows)
+
+
+def seller_stats(seller, start, end, top=20):
+    """Totals, a per-day series and the top products for ``seller`` between two dates.
+
+    Three queries over ProductDailyStats whatever the traffic. Days with
+    no activity appear in the series as zeros.
+    """
+    rows = ProductDailyStats.objects.filter(seller=seller, date__range=(start, end))
+    sums = {name: Sum(name, default=0) for name in COUNTERS}
+
+    by_day = {row.pop('date'): row for row in rows.values('date').annotate(**sums).order_by()}
+    empty = dict.fromkeys(COUNTERS, 0)
+    days = []
+    date = start
+    while date <= end:
+        days.append({'date': date, **by_day.get(date, empty)})
+        date += datetime.timedelta(days=1)
+
+    products = list(
+        rows.values('product_id', 'product__name')
+        .annotate(**sums)
+        .order_by('-sales', '-views', 'product_id')[:top]
+    )
+    return {
+        'start': start,
+        'end': end,
+        'totals': rows.aggregate(**sums),
+        'days': days,
+        'products': [{'name': product.pop('product__name'), **product} for product in products],
+    }
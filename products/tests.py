@@ -1,3 +1,1193 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+import json
+import shutil
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, LiveServerTestCase, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+from PIL import Image
+
+from merobazar.caching import CSRF_PLACEHOLDER, page_cache_key
+from merobazar.storage import content_addressed_name
+from recommendations import benchmark
+
+from .catalog import CATALOG_VERSION_KEY, bump_catalog_version, catalog_version
+from .counters import adjust_count, get_count
+from .loadtest import KhaltiStub, run_load
+from .models import (
+    Cart, Category, ImageBlob, Order, OrderItem, Payment, Product, ProductDailyStats, ProductImage, Sale,
+    SubCategory, SubSubCategory, UserInteraction, Wishlist,
+)
+from .payments import (
+    CircuitBreaker, GatewayUnavailable, PaymentGateway, apply_lookup, get_gateway, pending_callbacks,
+    settle_order, stale_payments, verify_payments,
+)
+from .sampling import CATEGORY_IDS_TTL, category_product_ids, sample_ids
+from .stats import rebuild_stats
+from .serializers import ProductImageSerializer
+from .uploads import finalize_upload, publish_upload, stage_upload, staged_path
+from .views import MAX_STATE_IDS
+
+User = get_user_model()
+
+
+class CheckoutViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+
+    def setUp(self):
+        self.client.force_login(self.buyer)
+
+    def fill_cart(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                user=self.seller,
+                category=self.category,
+                name=f'Product {i}',
+                description='Test product',
+                price=Decimal('100.00') + i,
+                condition='new',
+            )
+            Cart.objects.create(user=self.buyer, product=product)
+
+    def checkout_query_count(self, cart_size):
+        Cart.objects.filter(user=self.buyer).delete()
+        self.fill_cart(cart_size)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('products:checkout'))
+        self.assertEqual(response.status_code, 302)
+        return len(ctx.captured_queries)
+
+    def test_checkout_creates_order_and_empties_cart(self):
+        self.fill_cart(3)
+
+        response = self.client.get(reverse('products:checkout'))
+
+        order = Order.objects.get(user=self.buyer)
+        self.assertRedirects(response, reverse('products:order_success', args=[order.id]), fetch_redirect_response=False)
+        self.assertEqual(order.status, 'unpaid')
+        self.assertEqual(order.total_price, Decimal('303.00'))
+        self.assertEqual(order.items.count(), 3)
+        self.assertFalse(order.items.exclude(seller=self.seller).exists())
+        self.assertFalse(Cart.objects.filter(user=self.buyer).exists())
+
+    def test_empty_cart_redirects_to_cart(self):
+        response = self.client.get(reverse('products:checkout'))
+
+        self.assertRedirects(response, reverse('products:cart_view'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+    def test_query_count_is_independent_of_cart_size(self):
+        small = self.checkout_query_count(1)
+        large = self.checkout_query_count(10)
+
+        self.assertEqual(small, large)
+        self.assertEqual(OrderItem.objects.count(), 11)
+
+
+class PaymentSettlementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.buyer, total_price=Decimal('300.00'), status='unpaid')
+        for i in range(3):
+            product = Product.objects.create(
+                user=self.seller,
+                name=f'Product {i}',
+                description='Test product',
+                price=Decimal('100.00'),
+                condition='new',
+            )
+            OrderItem.objects.create(order=self.order, product=product, seller=self.seller, price=product.price)
+
+    def lookup_gateway(self, status=None, error=None):
+        gateway = mock.Mock()
+        gateway.lookup.return_value = {'status': status}
+        gateway.lookup.side_effect = error
+        return mock.patch('products.payments.get_gateway', return_value=gateway)
+
+    def test_settle_order_marks_products_sold(self):
+        self.assertTrue(settle_order(self.order))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertFalse(Product.objects.filter(is_active=True).exists())
+        self.assertEqual(Sale.objects.filter(buyer=self.buyer).count(), 3)
+
+    def test_settle_order_is_idempotent(self):
+        stale_copy = Order.objects.get(pk=self.order.pk)
+
+        self.assertTrue(settle_order(self.order))
+        self.assertFalse(settle_order(stale_copy))
+        self.assertEqual(Sale.objects.count(), 3)
+
+    def test_payment_response_queues_order_without_calling_gateway(self):
+        self.client.force_login(self.buyer)
+        url = reverse('products:payment_response')
+        params = {'pidx': 'abc', 'purchase_order_id': self.order.id}
+
+        with self.lookup_gateway('Completed') as get_gateway_mock:
+            response = self.client.get(url, params)
+            self.client.get(url, params)
+
+        self.assertRedirects(response, reverse('order_detail', args=[self.order.id]), fetch_redirect_response=False)
+        get_gateway_mock.assert_not_called()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'processing')
+        self.assertEqual(Payment.objects.filter(order=self.order, pidx='abc').count(), 1)
+
+    def test_reconciler_settles_completed_payment_once(self):
+        Payment.objects.create(order=self.order, pidx='abc')
+        Order.objects.filter(pk=self.order.pk).update(status='processing')
+
+        with self.lookup_gateway('Completed'):
+            counts = verify_payments(pending_callbacks())
+            verify_payments(pending_callbacks())
+
+        self.assertEqual(counts['completed'], 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(Sale.objects.count(), 3)
+
+    def test_reconciler_cancels_failed_payment(self):
+        Payment.objects.create(order=self.order, pidx='abc')
+        Order.objects.filter(pk=self.order.pk).update(status='processing')
+
+        with self.lookup_gateway('User canceled'):
+            verify_payments(pending_callbacks())
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        self.assertEqual(Payment.objects.get(pidx='abc').status, 'failed')
+        self.assertFalse(Sale.objects.exists())
+
+    def test_abandoned_payment_does_not_cancel_an_order_paid_with_another(self):
+        Payment.objects.create(order=self.order, pidx='abandoned')
+        Payment.objects.create(order=self.order, pidx='paid')
+        Order.objects.filter(pk=self.order.pk).update(status='processing')
+        gateway = mock.Mock()
+        gateway.lookup.side_effect = lambda pidx: {'status': 'Expired' if pidx == 'abandoned' else 'Completed'}
+
+        with mock.patch('products.payments.get_gateway', return_value=gateway):
+            counts = verify_payments(pending_callbacks())
+
+        self.assertEqual(counts['failed'], 1)
+        self.assertEqual(counts['completed'], 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(Payment.objects.get(pidx='abandoned').status, 'failed')
+        self.assertEqual(Sale.objects.count(), 3)
+
+    def test_payment_completed_for_a_cancelled_order_is_flagged_for_refund(self):
+        Payment.objects.create(order=self.order, pidx='late')
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        payment = Payment.objects.select_related('order').get(pidx='late')
+
+        with self.assertLogs('products.payments', 'ERROR') as logs:
+            status = apply_lookup(payment, {'status': 'Completed'})
+
+        self.assertEqual(status, 'refund_due')
+        self.assertEqual(Payment.objects.get(pidx='late').status, 'refund_due')
+        self.assertIn('is cancelled', logs.output[0])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        self.assertFalse(Sale.objects.exists())
+
+    def test_reconciler_leaves_payment_pending_when_gateway_is_down(self):
+        Payment.objects.create(order=self.order, pidx='abc')
+        Order.objects.filter(pk=self.order.pk).update(status='processing')
+
+        with self.lookup_gateway(error=GatewayUnavailable('timeout')):
+            counts = verify_payments(pending_callbacks())
+
+        self.assertEqual(counts['unavailable'], 1)
+        self.assertEqual(Payment.objects.get(pidx='abc').status, 'pending')
+
+    def test_stuck_callbacks_back_off_instead_of_crowding_out_new_ones(self):
+        stuck = Payment.objects.create(order=self.order, pidx='stuck')
+        Order.objects.filter(pk=self.order.pk).update(status='processing')
+
+        with self.lookup_gateway('Pending'):
+            self.assertEqual(verify_payments(pending_callbacks())['pending'], 1)
+        new = Payment.objects.create(order=self.order, pidx='new')
+
+        self.assertEqual(list(pending_callbacks()), [new])
+        Payment.objects.filter(pk=stuck.pk).update(checked_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(list(pending_callbacks(batch_size=1)), [new])
+        self.assertEqual(list(pending_callbacks()), [new, stuck])
+
+    def test_sweep_settles_payment_without_callback(self):
+        payment = Payment.objects.create(order=self.order, pidx='abc')
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+        with self.lookup_gateway('Completed'):
+            verify_payments(stale_payments())
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+
+class PaymentGatewayTests(SimpleTestCase):
+    def test_circuit_opens_after_repeated_failures(self):
+        gateway = PaymentGateway({'BACKEND': 'products.payments.StubBackend', 'FAILURE_THRESHOLD': 2})
+        gateway.backend = mock.Mock()
+        gateway.backend.lookup.side_effect = GatewayUnavailable('timeout')
+
+        for _ in range(2):
+            with self.assertRaises(GatewayUnavailable):
+                gateway.lookup('abc')
+        with self.assertRaisesMessage(GatewayUnavailable, 'circuit is open'):
+            gateway.lookup('abc')
+        self.assertEqual(gateway.backend.lookup.call_count, 2)
+
+    def test_circuit_closes_after_successful_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertIsNone(breaker.opened_at)
+
+    def test_initiate_only_retries_connection_failures(self):
+        backend = PaymentGateway({'SECRET_KEY': 'test'}).backend
+        initiate = backend.session.get_adapter(backend.base_url + 'epayment/initiate/').max_retries
+        lookup = backend.session.get_adapter(backend.base_url + 'epayment/lookup/').max_retries
+        self.assertEqual((initiate.connect, initiate.read, initiate.status, initiate.status_forcelist), (2, 0, 0, set()))
+        self.assertEqual((lookup.total, lookup.read, lookup.status_forcelist), (2, None, (502, 503, 504)))
+
+    @override_settings(PAYMENT_GATEWAY={'BACKEND': 'products.payments.StubBackend'})
+    def test_stub_backend_round_trip(self):
+        gateway = get_gateway()
+
+        data = gateway.initiate({'return_url': 'http://testserver/products/payment-response/', 'purchase_order_id': '7'})
+
+        self.assertIn('purchase_order_id=7', data['payment_url'])
+        self.assertEqual(gateway.lookup(data['pidx'])['status'], 'Completed')
+
+
+class ProductImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        seller = User.objects.create_user(username='seller', password='pass12345')
+        self.product = Product.objects.create(
+            user=seller, name='Camera', description='Test product', price=Decimal('100.00'), condition='new'
+        )
+
+    def upload(self, size, name='photo.jpg'):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_generates_thumbnail_and_webp_variants(self):
+        image = ProductImage.objects.create(product=self.product, image=self.upload((1600, 1200)))
+
+        image.refresh_from_db()
+        self.assertEqual(sorted(image.derivatives['webp'], key=int), ['320', '640', '1024'])
+        storage = image.image.storage
+        with storage.open(image.derivatives['thumbnail']) as f, Image.open(f) as thumb:
+            self.assertEqual(thumb.size, (400, 300))
+        with storage.open(image.derivatives['webp']['640']) as f, Image.open(f) as variant:
+            self.assertEqual((variant.format, variant.width), ('WEBP', 640))
+        self.assertIn('.thumb.jpg', image.thumbnail_url)
+        self.assertIn('640w', image.srcset)
+
+    def test_small_image_is_not_upscaled(self):
+        image = ProductImage.objects.create(product=self.product, image=self.upload((500, 500)))
+
+        self.assertEqual(list(image.derivatives['webp']), ['320', '500'])
+
+    def test_undecodable_image_falls_back_to_original(self):
+        upload = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+        image = ProductImage.objects.create(product=self.product, image=upload)
+
+        self.assertEqual(image.derivatives, {'failed': True})
+        self.assertEqual(image.thumbnail_url, image.image.url)
+        self.assertEqual(image.srcset, '')
+
+    def test_missing_original_is_left_pending(self):
+        image = ProductImage.objects.create(product=self.product, image='product_images/not-synced-yet.jpg')
+
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives, {})
+        self.assertTrue(ProductImage.objects.filter(pk=image.pk, derivatives={}).exists())
+
+    def test_serializer_exposes_thumbnail_and_srcset(self):
+        image = ProductImage.objects.create(product=self.product, image=self.upload((800, 600)))
+
+        data = ProductImageSerializer(image).data
+
+        self.assertEqual(data['thumbnail'], image.thumbnail_url)
+        self.assertEqual(data['srcset'], image.srcset)
+
+
+class UploadStagingTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.root, 'media'),
+            UPLOAD_STAGING_ROOT=os.path.join(self.root, 'staging'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, name='photo.jpg', content=None):
+        if content is None:
+            buffer = BytesIO()
+            Image.new('RGB', (50, 40), 'blue').save(buffer, 'JPEG')
+            content = buffer.getvalue()
+        return SimpleUploadedFile(name, content, content_type='image/jpeg')
+
+    def test_identical_uploads_share_one_staged_file(self):
+        first = stage_upload(self.upload('a.jpg', b'same bytes'))
+        second = stage_upload(self.upload('b.jpg', b'same bytes'))
+
+        self.assertEqual(first['key'], second['key'])
+        self.assertEqual(len(os.listdir(os.path.dirname(staged_path(first['key'])))), 1)
+        self.assertEqual((first['name'], second['name']), ('a.jpg', 'b.jpg'))
+
+    def test_finalize_hard_links_into_media(self):
+        staged = stage_upload(self.upload(content=b'image bytes'))
+
+        name = finalize_upload(staged, 'product_images/')
+
+        self.assertEqual(name, content_addressed_name('product_images/photo.jpg', staged['key']))
+        published = os.path.join(self.root, 'media', name)
+        self.assertTrue(os.path.samefile(published, staged_path(staged['key'])))
+
+    def test_wizard_publishes_staged_images_without_derivatives(self):
+        user = User.objects.create_user(username='seller', password='pass12345')
+        category = Category.objects.create(name='Cameras')
+        self.client.force_login(user)
+        url = reverse('products:create_product')
+
+        self.client.get(url)
+        self.client.post(url, {
+            'step1-name': 'Camera',
+            'step1-description': 'Barely used',
+            'images-images': [self.upload('front.jpg'), self.upload('back.jpg', b'other bytes')],
+        })
+        self.client.post(url, {'step2-category': category.id})
+        response = self.client.post(url, {'step4-price': '1500.00', 'step4-condition': 'used_good'})
+
+        product = Product.objects.get(name='Camera')
+        self.assertRedirects(response, reverse('products:product_details', args=[product.pk]), fetch_redirect_response=False)
+        images = list(product.images.all())
+        self.assertEqual(
+            [image.image.name for image in images],
+            [content_addressed_name(f'product_images/{name}', image.blob.sha256)
+             for name, image in zip(['front.jpg', 'back.jpg'], images)],
+        )
+        self.assertTrue(images[0].is_primary)
+        self.assertEqual(images[0].derivatives, {})
+
+
+class ImageDeduplicationTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.root, 'media'),
+            UPLOAD_STAGING_ROOT=os.path.join(self.root, 'staging'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        seller = User.objects.create_user(username='seller', password='pass12345')
+        self.products = [
+            Product.objects.create(user=seller, name=f'Bag {i}', description='Test', price=Decimal('10.00'), condition='new')
+            for i in range(2)
+        ]
+
+    def test_same_bytes_are_published_once(self):
+        first = publish_upload(stage_upload(SimpleUploadedFile('a.jpg', b'same bytes')), 'product_images/')
+        second = publish_upload(stage_upload(SimpleUploadedFile('b.jpg', b'same bytes')), 'product_images/')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(ImageBlob.objects.get(pk=first.pk).ref_count, 2)
+        self.assertEqual(default_storage.listdir(os.path.dirname(first.name))[1], ['a.jpg'])
+        self.assertEqual(len(default_storage.listdir('product_images')[0]), 1)
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        blob = publish_upload(stage_upload(SimpleUploadedFile('a.jpg', b'same bytes')), 'product_images/')
+        publish_upload(stage_upload(SimpleUploadedFile('b.jpg', b'same bytes')), 'product_images/')
+        images = ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=blob.name, blob=blob) for product in self.products
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            images[0].delete()
+        self.assertTrue(default_storage.exists(blob.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].delete()
+        self.assertFalse(default_storage.exists(blob.name))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_dedupe_command_merges_existing_duplicates(self):
+        names = [default_storage.save(f'product_images/temp_{i}.jpg', ContentFile(b'x' * 100)) for i in range(2)]
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=name) for product, name in zip(self.products, names)
+        ])
+        out = StringIO()
+
+        call_command('dedupe_product_images', stdout=out)
+
+        self.assertIn('Reclaimed 100 bytes', out.getvalue())
+        self.assertEqual(set(ProductImage.objects.values_list('image', flat=True)), {names[0]})
+        self.assertFalse(default_storage.exists(names[1]))
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+
+class FileServingTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.root, 'media'),
+            STATIC_ROOT=os.path.join(self.root, 'static'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_content_addressed_media_is_cached_forever_and_revalidates(self):
+        content = b'jpeg bytes'
+        name = content_addressed_name('product_images/bag.jpg', hashlib.sha256(content).hexdigest())
+        default_storage.save(name, ContentFile(content))
+
+        response = self.client.get(f'/media/{name}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        cached = self.client.get(f'/media/{name}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_reusable_media_names_revalidate(self):
+        name = default_storage.save('profile_pics/me.jpg', ContentFile(b'old bytes'))
+        first = self.client.get(f'/media/{name}')
+        self.assertEqual(first['Cache-Control'], 'public, max-age=0, must-revalidate')
+
+        default_storage.delete(name)
+        self.assertEqual(default_storage.save('profile_pics/me.jpg', ContentFile(b'new bytes!')), name)
+        self.assertEqual(self.client.get(f'/media/{name}', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_missing_or_escaping_paths_are_404(self):
+        self.assertEqual(self.client.get('/media/product_images/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+
+    def test_static_prefers_precompressed_variant(self):
+        os.makedirs(os.path.join(self.root, 'static', 'css'))
+        path = os.path.join(self.root, 'static', 'css', 'site.0123456789ab.css')
+        for suffix, content in (('', b'body {}'), ('.gz', b'gzipped')):
+            with open(path + suffix, 'wb') as f:
+                f.write(content)
+
+        response = self.client.get('/static/css/site.0123456789ab.css', HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(b''.join(response.streaming_content), b'gzipped')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+
+class SharedCacheMixin:
+    """Runs against a cache every process shares, which ETags and the page cache need."""
+
+    @classmethod
+    def setUpClass(cls):
+        location = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, location, ignore_errors=True)
+        shared = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        })
+        shared.enable()
+        cls.addClassCleanup(shared.disable)
+        super().setUpClass()
+
+
+class CachePolicyTests(SharedCacheMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+
+    def test_guest_catalog_page_revalidates_until_catalog_changes(self):
+        url = reverse('products:products_by_category', args=[self.category.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertNotIn('no-store', response['Cache-Control'])
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                user=self.seller, category=self.category, name='Boot',
+                description='Test product', price=Decimal('10.00'), condition='new',
+            )
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_public_json_is_shared_cacheable(self):
+        response = self.client.get(reverse('products:get_subcategories'), {'category_id': self.category.id})
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_per_process_cache_gets_no_etags(self):
+        url = reverse('products:products_by_category', args=[self.category.id])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_bumped_version_never_expires(self):
+        before = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_version()
+        self.assertGreater(catalog_version(), before)
+        with mock.patch('time.time', return_value=time.time() + 3600):
+            self.assertIsNotNone(cache.get(CATALOG_VERSION_KEY))
+
+    def test_authenticated_and_transactional_pages_are_not_stored(self):
+        self.assertIn('no-cache', self.client.get(reverse('user_login'))['Cache-Control'])
+        self.assertNotIn('no-store', self.client.get(reverse('user_login'))['Cache-Control'])
+
+        self.client.force_login(self.seller)
+        url = reverse('products:products_by_category', args=[self.category.id])
+        for response in (self.client.get(url), self.client.get(reverse('products:cart_view'))):
+            self.assertIn('no-store', response['Cache-Control'])
+            self.assertFalse(response.has_header('ETag'))
+
+
+class PageCacheTests(SharedCacheMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products:products_by_category', args=[self.category.id])
+
+    def add_product(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                user=self.seller, category=self.category, name=name,
+                description='Test product', price=Decimal('10.00'), condition='new',
+            )
+
+    def test_guests_share_a_render_with_their_own_csrf_token(self):
+        self.add_product('Boot')
+        first = self.client.get(self.url)
+        self.assertContains(first, 'Boot')
+        self.assertIn('stale-while-revalidate=300', first['Cache-Control'])
+
+        guest = Client()
+        with self.assertNumQueries(0):
+            second = guest.get(self.url)
+        self.assertContains(second, 'Boot')
+        self.assertNotContains(second, CSRF_PLACEHOLDER)
+        self.assertIn('csrftoken', second.cookies)
+        self.assertNotEqual(second.cookies['csrftoken'].value, first.cookies['csrftoken'].value)
+
+    def test_stale_page_is_served_while_another_request_revalidates(self):
+        self.add_product('Boot')
+        first = self.client.get(self.url)
+        self.add_product('Sandal')
+
+        lock = f'{page_cache_key(first.wsgi_request)}:lock'
+        cache.add(lock, 1)
+        stale = Client().get(self.url)
+        self.assertNotContains(stale, 'Sandal')
+        # Labelled with the version it was rendered from, so it revalidates.
+        self.assertNotEqual(stale.wsgi_request.catalog_version, catalog_version())
+
+        cache.delete(lock)
+        fresh = Client().get(self.url)
+        self.assertContains(fresh, 'Sandal')
+
+    def test_signed_in_users_reuse_fragments_but_not_pages(self):
+        self.add_product('Boot')
+        self.client.force_login(self.seller)
+        response = self.client.get(self.url)
+
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertIsNone(cache.get(page_cache_key(response.wsgi_request)))
+        self.assertIsNotNone(cache.get(make_template_fragment_key('category_menu', [catalog_version()])))
+
+
+class CategorySamplerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+
+    def setUp(self):
+        cache.clear()
+
+    def add_products(self, count, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                Product.objects.create(
+                    user=self.seller, category=self.category, name=f'Product {i}',
+                    description='Test product', price=Decimal('10.00'), condition='new', **kwargs
+                )
+                for i in range(count)
+            ]
+
+    def test_samples_are_distinct_and_skip_the_excluded_id(self):
+        ids = np.arange(1, 1001, dtype=np.int64)
+        for population in (ids[:5], ids):
+            sample = sample_ids(population, 8, exclude=3, rng=np.random.default_rng(0))
+            self.assertEqual(len(sample), min(8, len(population) - 1))
+            self.assertEqual(len(set(sample)), len(sample))
+            self.assertNotIn(3, sample)
+            self.assertTrue(set(sample) <= set(population.tolist()))
+
+    def test_ids_refresh_when_catalog_changes(self):
+        active = self.add_products(3)
+        self.add_products(1, is_active=False)
+        self.assertEqual(sorted(category_product_ids(self.category.id)), [p.id for p in active])
+
+        with self.assertNumQueries(0):
+            category_product_ids(self.category.id)
+
+        added = self.add_products(1)
+        self.assertIn(added[0].id, category_product_ids(self.category.id))
+
+    def test_ids_expire_when_another_worker_changes_the_catalog(self):
+        self.add_products(2)
+        category_product_ids(self.category.id)
+        # Stands in for a change whose version bump this process never saw.
+        added = Product.objects.create(
+            user=self.seller, category=self.category, name='Elsewhere',
+            description='Test product', price=Decimal('10.00'), condition='new',
+        )
+        self.assertNotIn(added.id, category_product_ids(self.category.id))
+
+        later = time.monotonic() + CATEGORY_IDS_TTL + 1
+        with mock.patch('products.sampling.time.monotonic', return_value=later):
+            self.assertIn(added.id, category_product_ids(self.category.id))
+
+    def test_product_page_fallback_does_not_sort_randomly(self):
+        products = self.add_products(12)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('products:product_details', args=[products[0].id]))
+
+        recommended = list(response.context['recommended_products'])
+        self.assertEqual(len(recommended), 8)
+        self.assertNotIn(products[0], recommended)
+        self.assertFalse(any('RANDOM()' in query['sql'] for query in ctx.captured_queries))
+
+    def test_category_pages_filter_by_search(self):
+        products = self.add_products(3)
+        subcategory = SubCategory.objects.create(category=self.category, name='Sneakers')
+        subsubcategory = SubSubCategory.objects.create(subcategory=subcategory, name='Running')
+        Product.objects.filter(id=products[0].id).update(
+            name='Trail runner', subcategory=subcategory, subsubcategory=subsubcategory,
+        )
+        for name, arg in (
+            ('products_by_category', self.category.id),
+            ('products_by_subcategory', subcategory.id),
+            ('products_by_subsubcategory', subsubcategory.id),
+        ):
+            response = self.client.get(reverse(f'products:{name}', args=[arg]), {'search': 'trail'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([p.id for p in response.context['products']], [products[0].id])
+
+
+SERVER_TIMING_ON = {**settings.QUERY_PROFILER, 'SERVER_TIMING': True}
+
+
+class QueryProfilerTests(TestCase):
+    PROFILE_EVERYTHING = {'SAMPLE_RATE': 1, 'SLOW_QUERY_MS': 10_000, 'DUPLICATE_THRESHOLD': 3, 'SERVER_TIMING': True}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+        for i in range(4):
+            product = Product.objects.create(
+                user=cls.seller, category=cls.category, name=f'Product {i}',
+                description='Test product', price=Decimal('10.00'), condition='new',
+            )
+            ProductImage.objects.bulk_create([ProductImage(product=product, image=f'product_images/{i}.jpg')])
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products:products_by_category', args=[self.category.id])
+
+    def test_server_timing_reports_queries(self):
+        self.assertFalse(self.client.get(self.url).has_header('Server-Timing'))
+        with override_settings(QUERY_PROFILER=SERVER_TIMING_ON):
+            response = self.client.get(self.url)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$')
+
+    def test_sampled_request_logs_repeated_sql_with_its_origin(self):
+        with override_settings(QUERY_PROFILER=self.PROFILE_EVERYTHING), \
+                self.assertLogs('merobazar.middleware', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertTrue(any(
+            'identical queries' in line and 'products_productimage' in line for line in logs.output
+        ))
+
+    def test_slow_queries_are_logged_on_unsampled_requests(self):
+        options = dict(self.PROFILE_EVERYTHING, SAMPLE_RATE=0, SLOW_QUERY_MS=0, DUPLICATE_THRESHOLD=1000)
+        with override_settings(QUERY_PROFILER=options), self.assertLogs('merobazar.middleware', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertIn('slow query', logs.output[0])
+        self.assertRegex(logs.output[0], r'from \S+\.py:\d+ in \w+')
+
+    def test_unsampled_requests_do_not_keep_statements(self):
+        with override_settings(QUERY_PROFILER=dict(self.PROFILE_EVERYTHING, SAMPLE_RATE=0)):
+            response = self.client.get(self.url)
+        profile = response.wsgi_request.query_profile
+        self.assertGreater(profile.count, 0)
+        self.assertFalse(profile.statements)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(
+            user=cls.seller, category=cls.category, name='Runner',
+            description='Test product', price=Decimal('10.00'), condition='new',
+        )
+
+    @override_settings(QUERY_PROFILER=SERVER_TIMING_ON)
+    async def test_badge_endpoints_over_asgi(self):
+        await self.async_client.aforce_login(self.buyer)
+        response = await self.async_client.post(reverse('products:add_to_cart', args=[self.product.id]))
+        self.assertEqual(response.json()['cart_count'], 1)
+        response = await self.async_client.post(reverse('products:toggle_wishlist', args=[self.product.id]))
+        self.assertEqual(response.json()['status'], 'added')
+
+        response = await self.async_client.get(reverse('products:cart_count'))
+        self.assertEqual(response.json(), {'count': 1})
+        # Queries made by the async ORM are still counted.
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+        response = await self.async_client.get(reverse('products:wishlist_count'))
+        self.assertEqual(response.json(), {'count': 1})
+        response = await self.async_client.get(reverse('products:check_cart_status', args=[self.product.id]))
+        self.assertEqual(response.json(), {'in_cart': True})
+        response = await self.async_client.get(reverse('products:check_wishlist', args=[self.product.id]))
+        self.assertEqual(response.json(), {'in_wishlist': True})
+
+    async def test_badge_endpoints_require_login(self):
+        response = await self.async_client.get(reverse('products:cart_count'))
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(PAYMENT_GATEWAY={'BACKEND': 'products.payments.StubBackend'})
+    async def test_initiate_payment_uses_the_async_gateway(self):
+        order = await Order.objects.acreate(user=self.buyer, total_price=Decimal('10.00'), status='unpaid')
+        await OrderItem.objects.acreate(order=order, product=self.product, seller=self.seller, price=Decimal('10.00'))
+        await self.async_client.aforce_login(self.buyer)
+
+        response = await self.async_client.get(reverse('products:initiate_khalti_payment', args=[order.id]))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/products/payment-response/?pidx=', response['Location'])
+        self.assertTrue(await Payment.objects.filter(order=order).aexists())
+
+    async def test_async_khalti_client_retries_gateway_errors(self):
+        import httpx
+        statuses = [503, 200]
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0), json={'pidx': 'abc', 'status': 'Completed'})
+
+        gateway = PaymentGateway({'SECRET_KEY': 'test', 'BACKOFF_FACTOR': 0})
+        gateway.backend.async_transport = httpx.MockTransport(handler)
+
+        data = await gateway.alookup('abc')
+        self.assertEqual(data['status'], 'Completed')
+        self.assertEqual(statuses, [])
+
+    async def test_async_initiate_only_retries_connection_failures(self):
+        import httpx
+        outcomes = [httpx.ConnectError('refused'), 503, httpx.ReadTimeout('slow'), 200]
+
+        def handler(request):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return httpx.Response(outcome, json={'pidx': 'abc', 'payment_url': 'https://pay.example/abc'})
+
+        gateway = PaymentGateway({'SECRET_KEY': 'test', 'BACKOFF_FACTOR': 0, 'FAILURE_THRESHOLD': 10})
+        gateway.backend.async_transport = httpx.MockTransport(handler)
+
+        # The refused connection is retried; the 503 that follows is not.
+        with self.assertRaises(GatewayUnavailable):
+            await gateway.ainitiate({'purchase_order_id': '1'})
+        self.assertEqual(len(outcomes), 2)
+        with self.assertRaises(GatewayUnavailable):
+            await gateway.ainitiate({'purchase_order_id': '1'})
+        self.assertEqual(outcomes, [200])
+
+    async def test_async_khalti_clients_are_closed_after_each_call(self):
+        import httpx
+        gateway = PaymentGateway({'SECRET_KEY': 'test'})
+        gateway.backend.async_transport = httpx.MockTransport(lambda request: httpx.Response(200, json={}))
+        clients = []
+        make_client = gateway.backend._async_client
+
+        def tracked_client():
+            clients.append(make_client())
+            return clients[-1]
+
+        with mock.patch.object(gateway.backend, '_async_client', tracked_client):
+            await gateway.ainitiate({'purchase_order_id': '1'})
+            await gateway.alookup('abc')
+        self.assertEqual(len(clients), 2)
+        self.assertTrue(all(client.is_closed for client in clients))
+
+
+class ProductStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+        cls.products = [
+            Product.objects.create(
+                user=cls.seller, category=cls.category, name=f'Product {i}',
+                description='Test product', price=Decimal('10.00'), condition='new',
+            )
+            for i in range(4)
+        ]
+        Wishlist.objects.create(user=cls.buyer, product=cls.products[0])
+        Wishlist.objects.create(user=cls.buyer, product=cls.products[3])
+        Cart.objects.create(user=cls.buyer, product=cls.products[1])
+
+    def state(self, ids):
+        return self.client.get(reverse('products:product_state'), {'ids': ','.join(map(str, ids))})
+
+    def test_one_query_per_table(self):
+        self.client.force_login(self.buyer)
+        ids = [p.id for p in self.products[:3]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.state(ids)
+
+        self.assertEqual(response.json(), {
+            'wishlist': [self.products[0].id],
+            'cart': [self.products[1].id],
+            'wishlist_count': 2,
+            'cart_count': 1,
+        })
+        for table in ('products_wishlist', 'products_cart'):
+            self.assertEqual(sum(f'"{table}"' in q['sql'] for q in queries.captured_queries), 1)
+        self.assertIn('no-store', response['Cache-Control'])
+
+    def test_counts_without_ids_and_junk_is_ignored(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('products:product_state'), {'ids': 'abc,,-1,²,١,' + '9' * 40})
+        self.assertEqual(response.json(), {'wishlist': [], 'cart': [], 'wishlist_count': 2, 'cart_count': 1})
+
+    def test_only_the_first_ids_are_read(self):
+        self.client.force_login(self.buyer)
+        ids = [*range(10_000, 10_000 + MAX_STATE_IDS), self.products[0].id]
+        self.assertEqual(self.state(ids).json()['wishlist'], [])
+
+    def test_guests_get_an_empty_state(self):
+        response = self.state([self.products[0].id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'wishlist': [], 'cart': [], 'wishlist_count': 0, 'cart_count': 0})
+
+    def test_only_signed_in_pages_request_it(self):
+        url = reverse('products:products_by_category', args=[self.category.id])
+        self.assertNotContains(self.client.get(url), reverse('products:product_state'))
+        self.client.force_login(self.buyer)
+        page = self.client.get(url).content.decode()
+        self.assertIn(reverse('products:product_state'), page)
+        self.assertNotIn('wishlist/check/', page)
+
+
+class BadgeCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+        cls.products = [
+            Product.objects.create(
+                user=cls.seller, category=cls.category, name=f'Product {i}',
+                description='Test product', price=Decimal('10.00'), condition='new',
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.buyer)
+
+    def counts(self):
+        with CaptureQueriesContext(connection) as queries:
+            counts = (
+                self.client.get(reverse('products:wishlist_count')).json()['count'],
+                self.client.get(reverse('products:cart_count')).json()['count'],
+            )
+        for table in ('products_wishlist', 'products_cart'):
+            self.assertFalse(any(f'"{table}"' in q['sql'] for q in queries.captured_queries))
+        return counts
+
+    def post(self, name, *args, **data):
+        return self.client.post(reverse(f'products:{name}', args=args), data).json()
+
+    def test_counters_follow_every_change_without_counting_rows(self):
+        first, second = self.products
+        self.assertEqual(self.post('add_to_cart', first.id)['cart_count'], 1)
+        self.assertEqual(self.post('add_to_cart', second.id)['cart_count'], 2)
+        self.assertEqual(self.post('add_to_cart', second.id)['cart_count'], 2)
+        self.assertEqual(self.post('toggle_wishlist', first.id)['wishlist_count'], 1)
+        self.assertEqual(self.counts(), (1, 2))
+
+        self.assertEqual(self.post('toggle_wishlist', first.id)['wishlist_count'], 0)
+        item = Cart.objects.get(user=self.buyer, product=first)
+        self.assertEqual(self.post('remove_cart_item', item.id)['cart_count'], 1)
+        item = Cart.objects.get(user=self.buyer, product=second)
+        self.assertEqual(self.post('remove_cart_item', item.id)['cart_count'], 0)
+        self.assertEqual(self.counts(), (0, 0))
+
+        self.post('add_to_cart', first.id)
+        self.client.get(reverse('products:checkout'))
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_header_badges_come_from_the_user_row(self):
+        Wishlist.objects.create(user=self.buyer, product=self.products[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'))
+        self.assertContains(response, 'class="icon-badge wishlist-count "')
+        self.assertContains(response, 'class="icon-badge cart-count d-none"')
+        for table in ('products_wishlist', 'products_cart'):
+            self.assertFalse(any(f'"{table}"' in q['sql'] for q in queries.captured_queries))
+
+    def test_drifted_counts_are_reconciled(self):
+        Cart.objects.bulk_create([Cart(user=self.buyer, product=product) for product in self.products])
+        adjust_count(Wishlist, self.buyer.id, -1)
+        self.buyer.refresh_from_db()
+        self.assertEqual((self.buyer.wishlist_count, self.buyer.cart_count), (0, 0))
+
+        out = StringIO()
+        call_command('reconcile_badge_counts', stdout=out)
+        self.assertIn('Corrected 1 badge counts', out.getvalue())
+        self.assertEqual(get_count(Cart, self.buyer.id), 2)
+
+
+class SellerAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.other_seller = User.objects.create_user(username='other', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(
+            user=cls.seller, category=category, name='Runner',
+            description='Test product', price=Decimal('10.00'), condition='new',
+        )
+        cls.other_product = Product.objects.create(
+            user=cls.other_seller, category=category, name='Boot',
+            description='Test product', price=Decimal('25.00'), condition='new',
+        )
+        for kind in ['view', 'view', 'view', 'wishlist', 'cart', 'click']:
+            UserInteraction.objects.create(user=cls.buyer, product=cls.product, interaction_type=kind)
+        UserInteraction.objects.create(user=cls.buyer, product=cls.other_product, interaction_type='view')
+        Sale.objects.create(product=cls.product, buyer=cls.buyer, sold_price=Decimal('10.00'))
+
+    def setUp(self):
+        self.client.force_login(self.seller)
+
+    def data(self, **params):
+        return self.client.get(reverse('products:seller_analytics_data'), params)
+
+    def test_events_are_counted_as_they_happen(self):
+        stats = ProductDailyStats.objects.get(product=self.product, date=timezone.localdate())
+        self.assertEqual(
+            (stats.seller_id, stats.views, stats.clicks, stats.wishlist_adds, stats.cart_adds, stats.sales, stats.revenue),
+            (self.seller.id, 3, 1, 1, 1, 1, Decimal('10.00')),
+        )
+
+    def test_settled_orders_are_counted_as_sales(self):
+        order = Order.objects.create(user=self.buyer, total_price=Decimal('25.00'), status='unpaid')
+        OrderItem.objects.create(order=order, product=self.other_product, seller=self.other_seller,
+                                 price=Decimal('25.00'))
+        settle_order(order)
+        stats = ProductDailyStats.objects.get(product=self.other_product)
+        self.assertEqual((stats.views, stats.sales, stats.revenue), (1, 1, Decimal('25.00')))
+
+    def test_endpoint_reads_only_the_daily_rows(self):
+        today = timezone.localdate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.data(start=str(today - timedelta(days=6)), end=str(today))
+
+        data = response.json()
+        self.assertEqual(data['totals']['views'], 3)
+        self.assertEqual(Decimal(data['totals']['revenue']), Decimal('10.00'))
+        self.assertEqual(len(data['days']), 7)
+        self.assertEqual(data['days'][-1]['sales'], 1)
+        self.assertEqual(data['days'][0]['views'], 0)
+        self.assertEqual([product['product_id'] for product in data['products']], [self.product.id])
+        for table in ('products_userinteraction', 'products_sale'):
+            self.assertFalse(any(f'"{table}"' in q['sql'] for q in queries.captured_queries))
+
+    def test_bad_ranges_are_rejected(self):
+        self.assertEqual(self.data(start='2024-02-30').status_code, 400)
+        self.assertEqual(self.data(start='2024-03-02', end='2024-03-01').status_code, 400)
+        self.assertEqual(self.data(start='2020-01-01', end='2024-01-01').status_code, 400)
+
+    def test_page_renders(self):
+        response = self.client.get(reverse('products:seller_analytics'))
+        self.assertContains(response, 'Runner')
+        self.assertNotContains(response, 'Boot')
+
+    def test_rebuild_matches_the_incremental_counts(self):
+        today = timezone.localdate()
+        expected = list(ProductDailyStats.objects.order_by('product_id').values())
+        ProductDailyStats.objects.update(views=0, sales=0)
+
+        self.assertEqual(rebuild_stats(today, today), 2)
+        rebuilt = list(ProductDailyStats.objects.order_by('product_id').values())
+        for row in expected + rebuilt:
+            row.pop('id')
+        self.assertEqual(rebuilt, expected)
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='pass12345')
+        buyer = User.objects.create_user(username='buyer', password='pass12345')
+        categories = [Category.objects.create(name=f'Category {i}') for i in range(10)]
+        products = Product.objects.bulk_create([
+            Product(
+                user=seller, category=categories[i % 10], name=f'Product {i}',
+                description='Test product', price=Decimal(i % 500), condition='new', is_active=i % 4 != 0,
+            )
+            for i in range(2000)
+        ])
+        Order.objects.bulk_create([
+            Order(user=buyer, total_price=Decimal('10.00'), status=['paid', 'unpaid', 'cancelled'][i % 3])
+            for i in range(300)
+        ])
+        Sale.objects.bulk_create([Sale(product=products[i], buyer=buyer, sold_price=Decimal('10.00'))
+                                  for i in range(0, 2000, 4)])
+
+    def test_hot_queries_use_their_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', '--analyze', stdout=out)
+        self.assertIn('All 12 hot queries use their indexes.', out.getvalue())
+
+
+class ConnectionBenchmarkTests(TestCase):
+    def test_reused_connections_stay_open_across_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'connections.json')
+            call_command('benchmark_connections', '--requests', '5', '--output', path, stdout=StringIO())
+            with open(path) as f:
+                results = json.load(f)['results']
+
+        self.assertEqual(results['per-request']['server_connections'], 5)
+        self.assertEqual(results['persistent']['server_connections'], 1)
+        if 'pool' in results:
+            self.assertEqual(results['pool']['server_connections'], 1)
+
+
+class MetricsEndpointTests(SharedCacheMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shoes')
+
+    @override_settings(DEBUG=True)
+    def test_requests_and_cache_lookups_are_exported(self):
+        cache.clear()
+        url = reverse('products:products_by_category', args=[self.category.id])
+        self.client.get(url)
+        Client().get(url)
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'merobazar_requests_total{method="GET",status="200",view="products:products_by_category"}', body
+        )
+        self.assertIn('merobazar_request_duration_seconds_bucket{', body)
+        self.assertIn('merobazar_request_db_queries_count{view="products:products_by_category"}', body)
+        self.assertIn('merobazar_cache_lookups_total{cache="page",result="hit"}', body)
+
+    def test_token_is_required_outside_debug(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+
+class LoadTestTests(LiveServerTestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = KhaltiStub().start()
+        self.addCleanup(self.stub.shutdown)
+
+    def test_journeys_run_cleanly_through_the_khalti_stub(self):
+        benchmark.generate(30, 10, 2, 5, 1.1, seed=1, log=lambda message: None)
+        buyer = User.objects.get(username=benchmark.PREFIX + '0')
+        buyer.set_password('pass12345')
+        buyer.save()
+        catalog = list(Product.objects.values_list('category_id', 'id'))
+
+        gateway = {
+            'BACKEND': 'products.payments.KhaltiBackend', 'BASE_URL': self.stub.base_url, 'SECRET_KEY': 'test',
+        }
+        with override_settings(PAYMENT_GATEWAY=gateway):
+            report = asyncio.run(run_load(
+                self.live_server_url, catalog, ['word1'], [(buyer.username, 'pass12345')],
+                guests=1, iterations=2,
+            ))
+
+        self.assertEqual(report['errors'], 0)
+        for label in ('dashboard', 'search', 'toggle_wishlist', 'add_to_cart', 'checkout', 'payment_response'):
+            self.assertGreater(report['endpoints'][label]['requests'], 0)
+        self.assertLessEqual(report['endpoints']['checkout']['p50_ms'], report['endpoints']['checkout']['p99_ms'])
+        self.assertEqual(Order.objects.filter(user=buyer).count(), 2)
+        # Both payments came back through the callback and await verification.
+        self.assertEqual(Order.objects.filter(user=buyer, status='processing').count(), 2)
+        self.assertEqual(Payment.objects.filter(order__user=buyer).count(), 2)
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from merobazar.storage import content_addressed_name
+
+from .images import derivative_names
+from .models import ImageBlob
+
+logger = logging.getLogger(__name__)
+
+
+def staging_root():
+    return str(settings.UPLOAD_STAGING_ROOT)
+
+
+def staged_path(key):
+    """Staged files are addressed by the SHA-256 of their content."""
+    return os.path.join(staging_root(), key[:2], key)
+
+
+def _store(source_path, key):
+    """Move a fully written file into its content-addressed slot."""
+    target = staged_path(key)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        # Same bytes already staged (possibly by another worker); keep the
+        # existing copy and refresh it so it isn't purged.
+        os.utime(target)
+        os.unlink(source_path)
+    else:
+        os.chmod(source_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        os.replace(source_path, target)
+
+
+def stage_upload(uploaded_file):
+    """Stream an upload into the shared staging area.
+
+    Returns the session-safe token ``{'key': sha256, 'name': filename}``.
+    Large uploads Django already spooled to disk are renamed into place
+    when the temp dir is on the same filesystem; everything else is written
+    chunk by chunk.
+    """
+    root = staging_root()
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    name = default_storage.get_valid_name(os.path.basename(uploaded_file.name))
+
+    temporary_path = getattr(uploaded_file, 'temporary_file_path', None)
+    if temporary_path is not None:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+        fd, tmp = tempfile.mkstemp(dir=root)
+        os.close(fd)
+        try:
+            os.replace(temporary_path(), tmp)
+        except OSError:
+            shutil.copyfile(temporary_path(), tmp)
+    else:
+        with tempfile.NamedTemporaryFile(dir=root, delete=False) as out:
+            tmp = out.name
+            for chunk in uploaded_file.chunks():
+                digest.update(chunk)
+                out.write(chunk)
+
+    key = digest.hexdigest()
+    _store(tmp, key)
+    return {'key': key, 'name': name}
+
+
+def finalize_upload(staged, upload_to, storage=default_storage):
+    """Publish a staged file under ``upload_to`` and its content hash, and return its name.
+
+    On local storage this is a hard link, so no bytes are copied; the staged
+    entry stays behind for other sessions and is removed by
+    ``clear_upload_staging``.
+    """
+    source = staged_path(staged['key'])
+    name = content_addressed_name(os.path.join(upload_to, staged['name']), staged['key'])
+
+    try:
+        storage.path(name)
+    except NotImplementedError:
+        with open(source, 'rb') as f:
+            return storage.save(name, File(f))
+
+    for _ in range(5):
+        name = storage.get_available_name(name)
+        target = storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            continue  # lost a race for this name; pick another
+        except OSError:
+            shutil.copyfile(source, target)
+        return name
+    raise FileExistsError(f"Could not find a free name for {name}")
+
+
+def publish_upload(staged, upload_to, storage=default_storage):
+    """Return the ImageBlob for a staged file and take one reference to it.
+
+    Bytes that are already stored are reused as-is; only the first upload of
+    a given file is published into storage.
+    """
+    blob = ImageBlob.objects.filter(sha256=staged['key']).first()
+    if blob is None:
+        name = finalize_upload(staged, upload_to, storage)
+        blob, created = ImageBlob.objects.get_or_create(
+            sha256=staged['key'], defaults={'name': name, 'size': storage.size(name)}
+        )
+        if not created:
+            storage.delete(name)  # another request published the same bytes first
+    ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    return blob
+
+
+def release_blob(blob_id, derivatives=None, storage=default_storage):
+    """Drop one reference to a blob, deleting its files once none remain.
+
+    ``derivatives`` are those of the image being removed; files are deleted
+    only after the surrounding transaction commits.
+    """
+    with transaction.atomic():
+        ImageBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = ImageBlob.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+        if blob is None or blob.images.exists():
+            return
+        names = [blob.name] + derivative_names(derivatives or blob.derivatives())
+        blob.delete()
+
+    def delete_files():
+        for name in names:
+            storage.delete(name)
+
+    transaction.on_commit(delete_files)
+
+
+def clear_staging(max_age):
+    """Delete staged files not touched for ``max_age`` seconds. Returns bytes freed."""
+    cutoff = time.time() - max_age
+    freed = 0
+    for dirpath, _, filenames in os.walk(staging_root()):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime < cutoff:
+                    os.unlink(path)
+                    freed += stat.st_size
+            except FileNotFoundError:
+                pass
+    return freed
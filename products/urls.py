@@ -25,6 +25,9 @@ urlpatterns = [
     path('cart/remove/<int:item_id>/', views.remove_cart_item, name='remove_cart_item'),
     path('wishlist/count/', views.wishlist_count, name='wishlist_count'),
     path('cart/count/', views.cart_count, name='cart_count'),
+    path('state/', views.product_state, name='product_state'),
+    path('analytics/', views.seller_analytics, name='seller_analytics'),
+    path('analytics/data/', views.seller_analytics_data, name='seller_analytics_data'),
     path('checkout/', views.checkout_view, name='checkout'),
     path('order/success/<int:order_id>/', views.order_success, name='order_success'),
     path('order/<int:order_id>/cancel/', views.cancel_order_view, name='cancel_order'),
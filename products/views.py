@@ -1,28 +1,30 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from datetime import timedelta
+
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.views.decorators.http import require_POST
-from tempfile import mkdtemp
-from django.core.files.storage import FileSystemStorage
-from django.core.files import File
-from decouple import config
-import os
-from django.db.models import Q
+from django.db.models import Q, Sum
 from django.views.decorators.csrf import csrf_exempt
-import requests
-from django.core.files.storage import default_storage
 from django.contrib import messages
 from django.http import JsonResponse
 from django.core.paginator import Paginator
 from recommendations.utils import HybridRecommender
+from merobazar.caching import public_cache, no_store
 from django.db import transaction
-from .models import Category, SubCategory, SubSubCategory, Product, ProductImage, Wishlist, Cart, Order, OrderItem, Sale, UserInteraction, ProductSimilarity, UserSimilarity
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import Category, SubCategory, SubSubCategory, Product, ProductImage, Wishlist, Cart, Order, OrderItem, Payment, Sale, UserInteraction, ProductSimilarity, UserSimilarity
+from .counters import aget_count, batched_counts, get_count
+from .payments import get_gateway, record_callback, PaymentGatewayError
+from .sampling import random_category_products
+from .stats import MAX_RANGE_DAYS, seller_stats
+from .uploads import stage_upload, publish_upload
 from .forms import ProductBasicInfoForm, ProductCategoryForm, ProductFinalDetailsForm, ProductImageForm, ProductUpdateForm
 import logging
 
 logger = logging.getLogger(__name__)
-TEMP_IMAGE_STORAGE = FileSystemStorage(location=mkdtemp())
 
 @login_required
 def create_product(request):
@@ -69,15 +71,9 @@ def create_product(request):
         return HttpResponseRedirect(f"{base_url}?reset=1")
 
 def cleanup_failed_process(request):
+    # Staged images are content-addressed and may be shared with other
+    # sessions, so they are left for the clear_upload_staging command.
     if 'product_data' in request.session:
-        temp_images = request.session['product_data'].get('step1', {}).get('temp_images', [])
-        for temp_path in temp_images:
-            try:
-                if TEMP_IMAGE_STORAGE.exists(temp_path):
-                    TEMP_IMAGE_STORAGE.delete(temp_path)
-                    logger.info(f"Deleted temp image: {temp_path}")
-            except Exception as e:
-                logger.error(f"Failed to delete temp image {temp_path}: {str(e)}")
         request.session.pop('product_data', None)
         request.session.pop('current_step', None)
         request.session.modified = True
@@ -95,13 +91,9 @@ def process_step1(request, product_data):
         product_data['step1'].update(step1_data)
 
         if 'images-images' in request.FILES:
-            product_data['step1']['temp_images'] = []
-            for f in request.FILES.getlist('images-images'):
-                original_name = f.name
-                clean_name = os.path.basename(original_name)
-                clean_name = default_storage.get_valid_name(clean_name)
-                temp_path = TEMP_IMAGE_STORAGE.save(f"temp_{clean_name}", f)
-                product_data['step1']['temp_images'].append(temp_path)
+            product_data['step1']['temp_images'] = [
+                stage_upload(f) for f in request.FILES.getlist('images-images')
+            ]
 
         request.session['current_step'] = 2
         request.session.modified = True
@@ -154,17 +146,23 @@ def process_step4(request, product_data):
                 **form.cleaned_data
             )
 
+            # Staged files are hard-linked into place, or reused if the same
+            # bytes are already stored. Missing thumbnails and WebP variants
+            # are built later by generate_image_derivatives, which gunicorn
+            # runs alongside the web workers.
+            upload_to = ProductImage._meta.get_field('image').upload_to
             temp_images = product_data['step1'].get('temp_images', [])
-            for idx, temp_path in enumerate(temp_images):
-                filename = os.path.basename(temp_path)
-                with TEMP_IMAGE_STORAGE.open(temp_path) as f:
-                    django_file = File(f, name=filename)
-                    ProductImage.objects.create(
-                        product=product,
-                        image=django_file,
-                        is_primary=(idx == 0)
-                    )
-                TEMP_IMAGE_STORAGE.delete(temp_path)
+            blobs = [publish_upload(staged, upload_to) for staged in temp_images]
+            ProductImage.objects.bulk_create([
+                ProductImage(
+                    product=product,
+                    image=blob.name,
+                    blob=blob,
+                    derivatives=blob.derivatives(),
+                    is_primary=(idx == 0)
+                )
+                for idx, blob in enumerate(blobs)
+            ])
 
             request.session.pop('product_data', None)
             request.session.pop('current_step', None)
@@ -237,6 +235,7 @@ def render_step4(request, product_data, form=None):
     })
 
 
+@public_cache(stale=300, page=True)
 def products_by_category(request, category_id):
     category = get_object_or_404(Category, id=category_id)
     products_list = Product.objects.filter(category=category, is_active=True)
@@ -287,6 +286,7 @@ def products_by_category(request, category_id):
     }
     return render(request, 'products/category_view.html', context)
 
+@public_cache(stale=300, page=True)
 def products_by_subcategory(request, subcategory_id):
     subcategory = get_object_or_404(SubCategory, id=subcategory_id)
     products_list = Product.objects.filter(subcategory=subcategory, is_active=True)
@@ -339,6 +339,7 @@ def products_by_subcategory(request, subcategory_id):
     }
     return render(request, 'products/category_view.html', context)
 
+@public_cache(stale=300, page=True)
 def products_by_subsubcategory(request, subsubcategory_id):
     subsubcategory = get_object_or_404(SubSubCategory, id=subsubcategory_id)
     products_list = Product.objects.filter(subsubcategory=subsubcategory, is_active=True)
@@ -390,6 +391,7 @@ def products_by_subsubcategory(request, subsubcategory_id):
         }
     }
     return render(request, 'products/category_view.html', context)
+@public_cache()
 def get_category_from_subcategory(request):
     subcategory_id = request.GET.get('subcategory_id')
     try:
@@ -398,18 +400,21 @@ def get_category_from_subcategory(request):
     except SubCategory.DoesNotExist:
         return JsonResponse({'error': 'Subcategory not found'}, status=404)
 
+@public_cache()
 def get_subcategories(request):
     category_id = request.GET.get('category_id')
     subcategories = SubCategory.objects.filter(category_id=category_id).order_by('name')
     data = [{'id': sub.id, 'name': sub.name} for sub in subcategories]
     return JsonResponse(data, safe=False)
 
+@public_cache()
 def get_subsubcategories(request):
     subcategory_id = request.GET.get('subcategory_id')
     subsubcategories = SubSubCategory.objects.filter(subcategory_id=subcategory_id).order_by('name')
     data = [{'id': subsub.id, 'name': subsub.name} for subsub in subsubcategories]
     return JsonResponse(data, safe=False)
 
+@public_cache(stale=300, page=True)
 def product_details(request, pk):
     product = get_object_or_404(Product, pk=pk)
 
@@ -433,21 +438,10 @@ def product_details(request, pk):
                 user_id=request.user.id,
                 top_n=8
             )
-            if not recommended_products:
-                recommended_products = Product.objects.filter(
-                    category=product.category,
-                    is_active=True
-                ).exclude(id=product.id).order_by('?')[:8]
         except Exception:
-            recommended_products = Product.objects.filter(
-                category=product.category,
-                is_active=True
-            ).exclude(id=product.id).order_by('?')[:8]
-    else:
-        recommended_products = Product.objects.filter(
-            category=product.category,
-            is_active=True
-        ).exclude(id=product.id).order_by('?')[:8]
+            pass
+    if not recommended_products:
+        recommended_products = random_category_products(product, 8)
 
     # Cart products for current user
     cart_product_ids = []
@@ -515,70 +509,70 @@ def delete_product(request, pk):
         return redirect('products:product_details', pk=pk)
 @login_required
 @require_POST
-def toggle_wishlist(request, product_id):
+async def toggle_wishlist(request, product_id):
+    user = await request.auser()
     try:
-        product = Product.objects.get(id=product_id)
-        wishlist_item, created = Wishlist.objects.get_or_create(
-            user=request.user,
+        product = await Product.objects.aget(id=product_id)
+        wishlist_item, created = await Wishlist.objects.aget_or_create(
+            user=user,
             product=product
         )
         
-        if request.user.is_authenticated:
-            UserInteraction.objects.create(
-                user=request.user,
-                product=product,
-                interaction_type='wishlist'
-            )
+        await UserInteraction.objects.acreate(
+            user=user,
+            product=product,
+            interaction_type='wishlist'
+        )
 
         if not created:
-            wishlist_item.delete()
+            await wishlist_item.adelete()
             
         return JsonResponse({
             'status': 'added' if created else 'removed',
             'in_wishlist': created,
-            'wishlist_count': request.user.wishlist_items.count()
+            'wishlist_count': await aget_count(Wishlist, user.id)
         })
     except Product.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Product not found'}, status=404)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 @login_required
-def check_wishlist(request, product_id):
-    try:
-        product = Product.objects.get(id=product_id)
-        in_wishlist = Wishlist.objects.filter(
-            user=request.user,
-            product=product
-        ).exists()
-        return JsonResponse({'in_wishlist': in_wishlist})
-    except Product.DoesNotExist:
+async def check_wishlist(request, product_id):
+    user = await request.auser()
+    if not await Product.objects.filter(id=product_id).aexists():
         return JsonResponse({'error': 'Product not found'}, status=404)
+    in_wishlist = await Wishlist.objects.filter(
+        user=user,
+        product_id=product_id
+    ).aexists()
+    return JsonResponse({'in_wishlist': in_wishlist})
     
 @login_required
 @require_POST
-def add_to_cart(request, product_id):
+async def add_to_cart(request, product_id):
+    user = await request.auser()
     try:
-        product = Product.objects.get(id=product_id)
+        product = await Product.objects.aget(id=product_id)
         # Simply create the cart item if it doesn't exist
-        Cart.objects.get_or_create(
-            user=request.user,
+        await Cart.objects.aget_or_create(
+            user=user,
             product=product
         )
-        if request.user.is_authenticated:
-            UserInteraction.objects.create(
-                user=request.user,
-                product=product,
-                interaction_type='cart'
-            )
+        await UserInteraction.objects.acreate(
+            user=user,
+            product=product,
+            interaction_type='cart'
+        )
                 
         return JsonResponse({
             'status': 'success', 
             'message': 'Product added to cart',
-            'cart_count': request.user.cart_items.count()
+            'cart_count': await aget_count(Cart, user.id)
         })
     except Product.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Product not found'}, status=404)
 
+@no_store
 @login_required
 def cart_view(request):
     cart_items = request.user.cart_items.select_related('product').all()
@@ -609,7 +603,7 @@ def update_cart_item(request, item_id):
                 
         return JsonResponse({
             'status': 'success',
-            'cart_count': request.user.cart_items.count()
+            'cart_count': get_count(Cart, request.user.id)
         })
     except Cart.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Item not found'}, status=404)
@@ -622,23 +616,59 @@ def remove_cart_item(request, item_id):
         cart_item.delete()
         return JsonResponse({
             'status': 'success',
-            'cart_count': request.user.cart_items.count()
+            'cart_count': get_count(Cart, request.user.id)
         })
     except Cart.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Item not found'}, status=404)
 @login_required
-def check_cart_status(request, product_id):
-    in_cart = request.user.cart_items.filter(product_id=product_id).exists()
+async def check_cart_status(request, product_id):
+    user = await request.auser()
+    in_cart = await user.cart_items.filter(product_id=product_id).aexists()
     return JsonResponse({'in_cart': in_cart})
 @login_required
-def wishlist_count(request):
-    count = request.user.wishlist_items.count()
-    return JsonResponse({'count': count})
+async def wishlist_count(request):
+    user = await request.auser()
+    return JsonResponse({'count': user.wishlist_count})
 
 @login_required
-def cart_count(request):
-    count = request.user.cart_items.count()
-    return JsonResponse({'count': count})
+async def cart_count(request):
+    user = await request.auser()
+    return JsonResponse({'count': user.cart_count})
+
+# Enough for any product grid; bounds the IN list.
+MAX_STATE_IDS = 100
+
+
+async def saved_products(model, user, product_ids):
+    """Which of ``product_ids`` are in a user's wishlist or cart."""
+    if not product_ids:
+        return []
+    rows = model.objects.filter(user=user, product_id__in=product_ids).values_list('product_id', flat=True)
+    return sorted({product_id async for product_id in rows})
+
+
+@no_store
+async def product_state(request):
+    """Wishlist and cart membership for ``?ids=1,2,3`` plus both badge counts.
+
+    Replaces a check and two count requests per product card. Guests get an
+    empty state rather than a login redirect.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'wishlist': [], 'cart': [], 'wishlist_count': 0, 'cart_count': 0})
+
+    # Only the first MAX_STATE_IDS entries are read. isdigit() alone also
+    # accepts characters like '²' that int() rejects, and the length cap
+    # keeps ids within a bigint.
+    raw_ids = request.GET.get('ids', '').split(',', MAX_STATE_IDS)[:MAX_STATE_IDS]
+    product_ids = sorted({int(i) for i in raw_ids if i.isascii() and i.isdigit() and len(i) <= 18})
+    return JsonResponse({
+        'wishlist': await saved_products(Wishlist, user, product_ids),
+        'cart': await saved_products(Cart, user, product_ids),
+        'wishlist_count': user.wishlist_count,
+        'cart_count': user.cart_count,
+    })
 @login_required
 def wishlist_view(request):
     wishlist_items = request.user.wishlist_items.select_related('product').all()
@@ -668,41 +698,51 @@ def mark_as_sold(request, product_id):
     
     return redirect('user_products')
 
+@no_store
 @login_required
 def checkout_view(request):
-    cart_items = request.user.cart_items.select_related('product')
-
-    if not cart_items.exists():
-        return redirect('products:cart_view')  # cart empty
+    cart_items = Cart.objects.filter(user=request.user)
+
+    with transaction.atomic():
+        # Lock every product in the cart with a single query so concurrent
+        # checkouts of the same listing are serialized.
+        products = list(
+            Product.objects.select_for_update()
+            .filter(id__in=cart_items.values('product_id'))
+            .order_by('id')
+            .only('id', 'user_id', 'price')
+        )
 
-    total_price = sum(item.product.price for item in cart_items)
+        if not products:
+            return redirect('products:cart_view')  # cart empty
 
-    order = Order.objects.create(
-        user=request.user,
-        total_price=total_price,
-        status='unpaid'
-    )
+        total_price = Product.objects.filter(
+            id__in=[product.id for product in products]
+        ).aggregate(total=Sum('price'))['total']
 
-    items_data = []
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            seller=item.product.user,
-            price=item.product.price,
+        order = Order.objects.create(
+            user=request.user,
+            total_price=total_price,
+            status='unpaid'
         )
-        items_data.append({
-            "item_id": item.product.id,
-            "item_name": item.product.name,
-            "item_category": item.product.category.name,
-            "price": item.product.price,
-        })
 
-    cart_items.delete()
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=product.id,
+                seller_id=product.user_id,
+                price=product.price,
+            )
+            for product in products
+        ])
+
+        with batched_counts():
+            cart_items.delete()
 
     return redirect('products:order_success', order_id=order.id)
 
 
+@no_store
 @login_required
 def order_success(request, order_id):
     order = Order.objects.get(id=order_id, user=request.user)
@@ -722,12 +762,51 @@ def cancel_order_view(request, order_id):
 
 
 
+def analytics_range(params):
+    """``(start, end)`` from ``start``/``end`` (YYYY-MM-DD) params, defaulting to the last 30 days."""
+    try:
+        end = parse_date(params.get('end') or '') or timezone.localdate()
+        start = parse_date(params.get('start') or '') or end - timedelta(days=29)
+    except ValueError:
+        raise ValueError('Dates must be valid and in YYYY-MM-DD format.')
+    if start > end:
+        raise ValueError('start must not be after end.')
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValueError(f'The range can be at most {MAX_RANGE_DAYS} days.')
+    return start, end
+
+
+@no_store
 @login_required
-def initiate_khalti_payment(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+def seller_analytics(request):
+    try:
+        start, end = analytics_range(request.GET)
+    except ValueError as e:
+        messages.error(request, str(e))
+        start, end = analytics_range({})
+    return render(request, 'products/seller_analytics.html', {'stats': seller_stats(request.user, start, end)})
+
+
+@no_store
+@login_required
+def seller_analytics_data(request):
+    try:
+        start, end = analytics_range(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(seller_stats(request.user, start, end))
+
+
+@no_store
+@login_required
+async def initiate_khalti_payment(request, order_id):
+    # Async so a slow gateway holds an event-loop slot rather than a whole
+    # worker when served over ASGI.
+    user = await request.auser()
+    order = await aget_object_or_404(Order, id=order_id, user=user)
 
     # Compose a string of product names in the order
-    product_names = ", ".join(item.product.name for item in order.items.all())
+    product_names = ", ".join([item.product.name async for item in order.items.select_related('product')])
     if not product_names:
         product_names = f"Order #{order.id}"
 
@@ -738,34 +817,30 @@ def initiate_khalti_payment(request, order_id):
         "purchase_order_id": str(order.id),
         "purchase_order_name": product_names,
         "customer_info": {
-            "name": request.user.username,
-            "email": request.user.email,
-            "phone": getattr(request.user, 'phone', 'N/A'),
+            "name": user.username,
+            "email": user.email,
+            "phone": getattr(user, 'phone', 'N/A'),
         }
     }
 
-    headers = {
-        'Authorization': f"key {config('KHALTI_SECRET_KEY')}",
-        'Content-Type': 'application/json',
-    }
-
-    response = requests.post('https://a.khalti.com/api/v2/epayment/initiate/', json=post_fields, headers=headers)
-    data = response.json()
-
-    if response.status_code == 200 and 'payment_url' in data:
+    try:
+        data = await get_gateway().ainitiate(post_fields)
+    except PaymentGatewayError as e:
+        logger.warning(f"Payment initiation failed for order {order.id}: {str(e)}")
+        data = {}
+
+    if 'payment_url' in data:
+        if data.get('pidx'):
+            # Lets the reconciler verify the payment even if the buyer never
+            # comes back through the callback.
+            await Payment.objects.aget_or_create(pidx=data['pidx'], defaults={'order': order})
         return redirect(data['payment_url'])
     else:
         messages.error(request, "Payment initiation failed. Please try again.")
         return redirect('products:order_success', order_id=order.id)
-    
-from django.shortcuts import get_object_or_404
-from django.contrib import messages
-from django.contrib.auth.decorators import login_required
-from django.views.decorators.csrf import csrf_exempt
-from decouple import config
-import requests
-from .models import Sale, Order, OrderItem, Product
 
+
+@no_store
 @csrf_exempt
 @login_required
 def payment_response(request):
@@ -776,44 +851,19 @@ def payment_response(request):
         messages.error(request, "Invalid payment response.")
         return redirect('my_orders')
 
-    order = Order.objects.filter(id=purchase_order_id, user=request.user, status='unpaid').first()
+    order = Order.objects.filter(
+        id=purchase_order_id, user=request.user, status__in=['unpaid', 'processing']
+    ).first()
 
     if not order:
         messages.error(request, "No unpaid order found.")
         return redirect('my_orders')
 
-    headers = {
-        'Authorization': f"key {config('KHALTI_SECRET_KEY')}",
-        'Content-Type': 'application/json',
-    }
-
-    response = requests.post('https://a.khalti.com/api/v2/epayment/lookup/', json={"pidx": pidx}, headers=headers)
-    data = response.json()
-
-    if response.status_code == 200 and data.get('status') == 'Completed':
-        # Mark order as paid
-        order.status = 'paid'
-        order.save()
-
-        # For each item in the order:
-        for item in order.items.all():
-            # Mark the product as inactive (sold)
-            product = item.product
-            product.is_active = False
-            product.save()
-
-            # Create Sale record
-            Sale.objects.create(
-                product=product,
-                buyer=order.user,
-                sold_price=item.price,
-                notes="Sold via Khalti payment"
-            )
-
-        messages.success(request, f"Payment successful. Order #{order.id} confirmed.")
-    else:
-        order.status = 'cancelled'
-        order.save()
-        messages.error(request, f"Payment failed or cancelled. Order #{order.id} cancelled.")
+    # Verification against the gateway happens in the reconcile_payments
+    # worker so the buyer isn't kept waiting on Khalti here.
+    if record_callback(order, pidx) is None:
+        messages.error(request, "Invalid payment response.")
+        return redirect('my_orders')
 
-    return redirect('my_orders')
+    messages.info(request, f"Payment received for Order #{order.id}. We are confirming it with Khalti.")
+    return redirect('order_detail', order_id=order.id)
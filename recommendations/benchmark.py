@@ -0,0 +1,248 @@
+"""Synthetic data and a timing harness for HybridRecommender.
+
+Driven by ``manage.py benchmark_recommender``. Generated rows are tagged
+with PREFIX so they can be told apart from real data and removed again.
+"""
+import platform
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+
+from merobazar.profiling import QueryProfiler
+from products.models import Category, Product, ProductSimilarity, UserInteraction, UserSimilarity
+
+from .utils import HybridRecommender
+
+PREFIX = 'bench_'
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+INTERACTION_MIX = {'view': .70, 'click': .15, 'wishlist': .08, 'cart': .05, 'purchase': .02}
+CONDITIONS = [choice for choice, _ in Product.CONDITION_CHOICES]
+BATCH_SIZE = 5000
+# Users are generated this many at a time to keep memory flat at 1M.
+USER_CHUNK = 20_000
+VOCABULARY = [f'word{i}' for i in range(500)]
+
+
+def zipf_weights(n, a):
+    """Probabilities of a Zipf law over ranks 1..n."""
+    weights = np.arange(1, n + 1, dtype=np.float64) ** -a
+    return weights / weights.sum()
+
+
+def bench_users():
+    return get_user_model().objects.filter(username__startswith=PREFIX)
+
+
+def has_data():
+    return bench_users().exists()
+
+
+def generate(users, products, categories, interactions_per_user, zipf_a, seed, log=print):
+    """Create users, categories, products and Zipf-distributed interactions.
+
+    Product popularity follows a Zipf law with exponent ``zipf_a``; how
+    active each user is follows a geometric distribution with mean
+    ``interactions_per_user``.
+    """
+    rng = np.random.default_rng(seed)
+    User = get_user_model()
+    vocabulary_weights = zipf_weights(len(VOCABULARY), 1.0)
+
+    with transaction.atomic():
+        category_objs = Category.objects.bulk_create(
+            [Category(name=f'{PREFIX}category {i}') for i in range(categories)]
+        )
+        user_ids = []
+        for start in range(0, users, BATCH_SIZE):
+            created = User.objects.bulk_create([
+                User(username=f'{PREFIX}{i}', password='!', phone='')
+                for i in range(start, min(start + BATCH_SIZE, users))
+            ])
+            user_ids.extend(user.id for user in created)
+        log(f'{len(user_ids)} users')
+
+        user_array = np.array(user_ids)
+        product_ids = []
+        for start in range(0, products, BATCH_SIZE):
+            count = min(BATCH_SIZE, products - start)
+            sellers = rng.choice(user_array, count)
+            cats = rng.integers(len(category_objs), size=count)
+            created = Product.objects.bulk_create([
+                Product(
+                    user_id=int(sellers[i]),
+                    category=category_objs[cats[i]],
+                    name=' '.join(rng.choice(VOCABULARY, 3, p=vocabulary_weights)),
+                    description=' '.join(rng.choice(VOCABULARY, 20, p=vocabulary_weights)),
+                    price=round(float(rng.uniform(100, 50_000)), 2),
+                    condition=CONDITIONS[i % len(CONDITIONS)],
+                )
+                for i in range(count)
+            ])
+            product_ids.extend(product.id for product in created)
+        log(f'{len(product_ids)} products in {categories} categories')
+
+        # Popularity rank is independent of creation order.
+        by_popularity = rng.permutation(np.array(product_ids))
+        popularity = zipf_weights(len(by_popularity), zipf_a)
+        types = list(INTERACTION_MIX)
+        type_weights = list(INTERACTION_MIX.values())
+        weights = HybridRecommender().interaction_weights
+
+        total = 0
+        for start in range(0, len(user_array), USER_CHUNK):
+            chunk = user_array[start:start + USER_CHUNK]
+            counts = rng.geometric(1 / interactions_per_user, len(chunk))
+            owners = np.repeat(chunk, counts)
+            targets = rng.choice(by_popularity, len(owners), p=popularity)
+            kinds = rng.choice(len(types), len(owners), p=type_weights)
+            rows = [
+                UserInteraction(
+                    user_id=int(user_id),
+                    product_id=int(product_id),
+                    interaction_type=types[kind],
+                    weight=weights[types[kind]],
+                )
+                for user_id, product_id, kind in zip(owners, targets, kinds)
+            ]
+            UserInteraction.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            total += len(rows)
+        log(f'{total} interactions')
+
+
+def clear():
+    """Delete everything ``generate`` created."""
+    users = bench_users()
+    UserInteraction.objects.filter(user__in=users).delete()
+    UserSimilarity.objects.filter(user1__in=users).delete()
+    ProductSimilarity.objects.filter(product1__user__in=users).delete()
+    Product.objects.filter(user__in=users).delete()
+    users.delete()
+    Category.objects.filter(name__startswith=PREFIX).delete()
+
+
+def forget_user(user_id):
+    UserSimilarity.objects.filter(user1_id=user_id).delete()
+
+
+def forget_products(user_id):
+    ProductSimilarity.objects.filter(
+        product1_id__in=UserInteraction.objects.filter(user_id=user_id).values('product_id')
+    ).delete()
+
+
+# name -> (run(recommender, user_id, product_id), reset(user_id, product_id)).
+# Reset drops stored similarities first so every run takes the cold path.
+METHODS = {
+    'create_user_product_matrix': (lambda r, u, p: r.create_user_product_matrix(), None),
+    'calculate_user_similarity': (
+        lambda r, u, p: r.calculate_user_similarity(u, live=True), lambda u, p: forget_user(u),
+    ),
+    'create_product_features': (lambda r, u, p: r.create_product_features(), None),
+    'calculate_product_similarity': (
+        lambda r, u, p: r.calculate_product_similarity(p, live=True),
+        lambda u, p: ProductSimilarity.objects.filter(product1_id=p).delete(),
+    ),
+    'get_collaborative_recommendations': (
+        lambda r, u, p: list(r.get_collaborative_recommendations(u)), lambda u, p: forget_user(u),
+    ),
+    'get_content_based_recommendations': (
+        lambda r, u, p: list(r.get_content_based_recommendations(u)), lambda u, p: forget_products(u),
+    ),
+    'get_hybrid_recommendations': (
+        lambda r, u, p: list(r.get_hybrid_recommendations(u)),
+        lambda u, p: (forget_user(u), forget_products(u)),
+    ),
+    'get_popular_products': (lambda r, u, p: list(r.get_popular_products()), None),
+}
+
+
+def sample_subjects(count, seed):
+    """Pick active users (weighted towards heavy ones) and one product each."""
+    rng = np.random.default_rng(seed)
+    interactions = list(
+        UserInteraction.objects.filter(user__username__startswith=PREFIX)
+        .values_list('user_id', 'product_id')[:100_000]
+    )
+    if not interactions:
+        return []
+    picks = rng.integers(len(interactions), size=count)
+    return [interactions[i] for i in picks]
+
+
+def measure(name, subjects, log=print):
+    run, reset = METHODS[name]
+    recommender = HybridRecommender()
+    seconds, queries = [], []
+    for user_id, product_id in subjects:
+        if reset:
+            reset(user_id, product_id)
+        profiler = QueryProfiler()
+        with connection.execute_wrapper(profiler):
+            start = time.perf_counter()
+            run(recommender, user_id, product_id)
+            seconds.append(time.perf_counter() - start)
+        queries.append(profiler.count)
+
+    # One extra run under tracemalloc; it slows things down, so it is kept
+    # out of the timings. NumPy reports its buffers to tracemalloc too.
+    user_id, product_id = subjects[0]
+    if reset:
+        reset(user_id, product_id)
+    tracemalloc.start()
+    try:
+        run(recommender, user_id, product_id)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'runs': len(seconds),
+        'min_seconds': min(seconds),
+        'median_seconds': statistics.median(seconds),
+        'mean_seconds': statistics.fmean(seconds),
+        'max_seconds': max(seconds),
+        'median_queries': statistics.median(queries),
+        'peak_memory_bytes': peak,
+    }
+    log(f"{name}: median {result['median_seconds'] * 1000:.1f} ms, "
+        f"{result['median_queries']:.0f} queries, peak {peak / 2**20:.1f} MiB")
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(methods, repeat, seed, log=print):
+    subjects = sample_subjects(repeat, seed)
+    if not subjects:
+        raise ValueError('No synthetic interactions to benchmark against.')
+    results = {name: measure(name, subjects, log) for name in methods}
+    return {
+        'benchmark': 'recommender',
+        'created_at': timezone.now().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'database': connection.vendor,
+        'data': {
+            'users': bench_users().count(),
+            'products': Product.objects.filter(user__username__startswith=PREFIX).count(),
+            'interactions': UserInteraction.objects.filter(user__username__startswith=PREFIX).count(),
+        },
+        'results': results,
+        # ru_maxrss is in KiB on Linux.
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
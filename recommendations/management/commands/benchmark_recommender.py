@@ -0,0 +1,78 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from recommendations import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Time HybridRecommender against synthetic users, products and Zipf-distributed interactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=benchmark.SCALES, default='1k',
+                            help='Number of synthetic users (1k to 1m)')
+        parser.add_argument('--users', type=int, help='Exact number of users; overrides --scale')
+        parser.add_argument('--products', type=int, help='Defaults to one product per ten users')
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--interactions-per-user', type=float, default=20,
+                            help='Mean interactions per user')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of product popularity')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per method')
+        parser.add_argument('--methods', default=','.join(benchmark.METHODS),
+                            help='Comma-separated HybridRecommender methods to time')
+        parser.add_argument('--output', default='recommender-benchmark.json', help='Where to write JSON results')
+        parser.add_argument('--reuse-data', action='store_true',
+                            help='Benchmark synthetic data left by an earlier --keep-data run')
+        parser.add_argument('--keep-data', action='store_true', help='Leave the synthetic data in place')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask for confirmation before writing to the database')
+
+    def handle(self, *args, **options):
+        methods = [name.strip() for name in options['methods'].split(',') if name.strip()]
+        unknown = set(methods) - set(benchmark.METHODS)
+        if unknown:
+            raise CommandError(f"Unknown methods: {', '.join(sorted(unknown))}")
+
+        users = options['users'] or benchmark.SCALES[options['scale']]
+        products = options['products'] or max(users // 10, 10)
+        exists = benchmark.has_data()
+
+        if options['interactive'] and not (options['reuse_data'] and exists):
+            database = connection.settings_dict['NAME']
+            answer = input(
+                f"This writes {users} synthetic users and {products} products to database '{database}'.\n"
+                "Type 'yes' to continue: "
+            )
+            if answer != 'yes':
+                raise CommandError('Benchmark cancelled.')
+
+        if options['reuse_data'] and exists:
+            generation = None
+        else:
+            if exists:
+                self.stdout.write('Removing synthetic data from an earlier run...')
+                benchmark.clear()
+            start = time.perf_counter()
+            benchmark.generate(
+                users, products, options['categories'], options['interactions_per_user'],
+                options['zipf'], options['seed'], log=self.stdout.write,
+            )
+            generation = time.perf_counter() - start
+            self.stdout.write(f'Generated data in {generation:.1f}s')
+
+        try:
+            report = benchmark.run_benchmark(methods, options['repeat'], options['seed'], log=self.stdout.write)
+        finally:
+            if not options['keep_data']:
+                benchmark.clear()
+
+        report['parameters'] = {
+            key: options[key] for key in ('categories', 'interactions_per_user', 'zipf', 'seed', 'repeat')
+        }
+        report['generation_seconds'] = generation
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
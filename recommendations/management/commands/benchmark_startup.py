@@ -0,0 +1,99 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: set up Django and load the URLconf, which
+# imports every view, i.e. what a web worker does before its first request.
+CHILD = """
+import json, os, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+from django.urls import get_resolver
+get_resolver().url_patterns
+ready = time.perf_counter() - start
+print(json.dumps({
+    'setup_seconds': setup,
+    'ready_seconds': ready,
+    'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    'modules': sorted(sys.modules),
+}))
+"""
+
+# Packages that should only load once a recommender computation runs.
+HEAVY_PACKAGES = ('sklearn', 'scipy', 'pandas', 'joblib')
+
+
+def parse_importtime(stderr):
+    """Self time in microseconds per top-level package from ``-X importtime`` output."""
+    totals = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us)
+    return totals
+
+
+class Command(BaseCommand):
+    help = 'Measure interpreter startup: import time per package and RSS once the URLconf is loaded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters to start')
+        parser.add_argument('--top', type=int, default=15, help='Packages to list by import time')
+        parser.add_argument('--output', default='startup-benchmark.json', help='Where to write JSON results')
+        parser.add_argument('--check', action='store_true',
+                            help=f"Fail if any of {', '.join(HEAVY_PACKAGES)} is imported at startup")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'merobazar.settings')}
+        runs = []
+        for _ in range(options['repeat']):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', CHILD],
+                capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+            )
+            if result.returncode:
+                raise CommandError(f'Startup failed:\n{result.stderr[-2000:]}')
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            run['imports'] = parse_importtime(result.stderr)
+            runs.append(run)
+
+        modules = runs[0]['modules']
+        heavy = sorted({name.split('.')[0] for name in modules} & set(HEAVY_PACKAGES))
+        packages = {
+            name: statistics.median(run['imports'].get(name, 0) for run in runs) / 1e6
+            for name in runs[0]['imports']
+        }
+        report = {
+            'benchmark': 'startup',
+            'python': sys.version.split()[0],
+            'runs': len(runs),
+            'setup_seconds': statistics.median(run['setup_seconds'] for run in runs),
+            'ready_seconds': statistics.median(run['ready_seconds'] for run in runs),
+            'max_rss_bytes': statistics.median(run['max_rss_bytes'] for run in runs),
+            'modules_loaded': len(modules),
+            'heavy_packages_loaded': heavy,
+            'import_seconds_by_package': dict(sorted(packages.items(), key=lambda item: -item[1])),
+        }
+
+        self.stdout.write(
+            f"django.setup() {report['setup_seconds'] * 1000:.0f} ms, URLconf loaded at "
+            f"{report['ready_seconds'] * 1000:.0f} ms, max RSS {report['max_rss_bytes'] / 2**20:.1f} MiB, "
+            f"{len(modules)} modules"
+        )
+        for name, seconds in list(report['import_seconds_by_package'].items())[:options['top']]:
+            self.stdout.write(f'  {name:<30}{seconds * 1000:>8.1f} ms')
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['check'] and heavy:
+            raise CommandError(f"Imported at startup: {', '.join(heavy)}")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from recommendations.snapshot import build_snapshot, snapshot_options
+
+
+class Command(BaseCommand):
+    help = 'Precompute the recommender matrices into a new memory-mappable snapshot version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Snapshot directory; defaults to RECOMMENDER_SNAPSHOT["DIR"]')
+        parser.add_argument('--loop', action='store_true', help='Keep rebuilding as a background worker')
+        parser.add_argument('--interval', type=float, default=900, help='Seconds between builds with --loop')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or snapshot_options()['DIR']
+        while True:
+            start = time.perf_counter()
+            try:
+                version = build_snapshot(directory)
+            except ValueError as e:
+                if not options['loop']:
+                    raise CommandError(str(e))
+                self.stderr.write(str(e))
+            else:
+                self.stdout.write(f'Built snapshot {version} in {directory} ({time.perf_counter() - start:.1f}s)')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+            close_old_connections()
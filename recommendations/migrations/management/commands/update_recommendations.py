@@ -11,11 +11,13 @@ class Command(BaseCommand):
         
         self.stdout.write('Updating user similarities...')
         for user in User.objects.all():
-            recommender.calculate_user_similarity(user.id)
+            recommender.save_user_similarities(user.id, recommender.calculate_user_similarity(user.id, live=True))
         
         self.stdout.write('Updating product similarities...')
         from products.models import Product
         for product in Product.objects.filter(is_active=True):
-            recommender.calculate_product_similarity(product.id)
+            recommender.save_product_similarities(
+                product.id, recommender.calculate_product_similarity(product.id, live=True)
+            )
         
         self.stdout.write('Recommendations updated successfully!')
\ No newline at end of file
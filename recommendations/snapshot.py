@@ -0,0 +1,201 @@
+"""Precomputed recommender arrays shared by every worker through mmap.
+
+``manage.py build_recommender_snapshot`` writes a new version directory
+under ``RECOMMENDER_SNAPSHOT['DIR']`` and then atomically points the
+CURRENT file at it. Workers open the arrays with
+``np.load(mmap_mode='r')``, so their pages sit once in the OS page cache
+however many workers map them. ``get_state()`` re-reads CURRENT every
+``CHECK_INTERVAL`` seconds and swaps to a new version without a restart.
+
+Each matrix is stored as CSR parts with L2-normalised rows, so cosine
+similarity against every row is one sparse matrix-vector product.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CURRENT = 'CURRENT'
+# Older versions stay on disk briefly for workers that haven't swapped yet.
+KEEP_VERSIONS = 2
+DEFAULTS = {
+    'DIR': os.path.join(settings.BASE_DIR, 'var', 'recommender'),
+    'CHECK_INTERVAL': 30,
+}
+
+
+def snapshot_options():
+    return {**DEFAULTS, **getattr(settings, 'RECOMMENDER_SNAPSHOT', {})}
+
+
+class SnapshotMatrix:
+    """A CSR matrix on disk whose rows are looked up by sorted ids."""
+
+    def __init__(self, path, name, columns):
+        def load(part):
+            return np.load(os.path.join(path, f'{name}_{part}.npy'), mmap_mode='r')
+
+        from scipy import sparse
+
+        self.row_ids = load('rows')
+        # copy=False keeps scipy on the mapped arrays rather than the heap.
+        self.matrix = sparse.csr_matrix(
+            (load('data'), load('indices'), load('indptr')), shape=(len(self.row_ids), columns), copy=False,
+        )
+
+    def row_index(self, row_id):
+        i = int(np.searchsorted(self.row_ids, row_id))
+        if i < len(self.row_ids) and self.row_ids[i] == row_id:
+            return i
+        return None
+
+    def similarities(self, row_id):
+        """``(row index, cosine similarity to every row)``, or None if ``row_id`` isn't in the snapshot."""
+        i = self.row_index(row_id)
+        if i is None:
+            return None
+        return i, (self.matrix @ self.matrix[i].T).toarray().ravel()
+
+
+class RecommenderState:
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.version = self.meta['version']
+        # Users by products, weighted by interaction type.
+        self.users = SnapshotMatrix(path, 'users', self.meta['products'])
+        # Products by TF-IDF terms.
+        self.products = SnapshotMatrix(path, 'products', self.meta['terms'])
+
+
+def save_matrix(path, name, row_ids, matrix):
+    np.save(os.path.join(path, f'{name}_rows.npy'), np.asarray(row_ids, dtype=np.int64))
+    np.save(os.path.join(path, f'{name}_data.npy'), matrix.data.astype(np.float32))
+    np.save(os.path.join(path, f'{name}_indices.npy'), matrix.indices)
+    np.save(os.path.join(path, f'{name}_indptr.npy'), matrix.indptr)
+
+
+def interaction_matrix(weights):
+    """Sorted user ids, sorted product ids and the normalised user-product matrix."""
+    from scipy import sparse
+    from sklearn.preprocessing import normalize
+    from products.models import UserInteraction
+
+    user_ids, product_ids, values = [], [], []
+    rows = UserInteraction.objects.values_list('user_id', 'product_id', 'interaction_type')
+    for user_id, product_id, interaction_type in rows.iterator(chunk_size=10_000):
+        user_ids.append(user_id)
+        product_ids.append(product_id)
+        values.append(weights.get(interaction_type, 1.0))
+    if not values:
+        raise ValueError('There are no interactions to build a snapshot from')
+
+    users, user_rows = np.unique(np.array(user_ids, dtype=np.int64), return_inverse=True)
+    products, product_columns = np.unique(np.array(product_ids, dtype=np.int64), return_inverse=True)
+    # Repeated (user, product) pairs are summed, as in create_user_product_matrix.
+    matrix = sparse.csr_matrix(
+        (np.array(values, dtype=np.float32), (user_rows, product_columns)), shape=(len(users), len(products)),
+    )
+    matrix.sum_duplicates()
+    return users, products, normalize(matrix)
+
+
+def build_snapshot(directory=None):
+    """Write a new snapshot version, make it current and return its name."""
+    from .utils import HybridRecommender
+
+    directory = directory or snapshot_options()['DIR']
+    recommender = HybridRecommender()
+    users, products, interactions = interaction_matrix(recommender.interaction_weights)
+
+    feature_vectors, queryset, _ = recommender.create_product_features()
+    feature_ids = np.array([product.id for product in queryset], dtype=np.int64)
+    order = np.argsort(feature_ids)
+    # TfidfVectorizer already L2-normalises each row.
+    features = feature_vectors[order].tocsr()
+
+    version = f"{timezone.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+    os.makedirs(directory, exist_ok=True)
+    staging = os.path.join(directory, f'.{version}')
+    os.makedirs(staging)
+    save_matrix(staging, 'users', users, interactions)
+    save_matrix(staging, 'products', feature_ids[order], features)
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': version,
+            'created_at': timezone.now().isoformat(),
+            'users': len(users),
+            'products': len(products),
+            'terms': features.shape[1],
+            'featured_products': len(feature_ids),
+        }, f)
+    os.rename(staging, os.path.join(directory, version))
+
+    pointer = os.path.join(directory, f'.{CURRENT}.{version}')
+    with open(pointer, 'w') as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(directory, CURRENT))
+
+    # Mapped files stay readable after unlinking, so pruning is safe even
+    # for workers still on an old version.
+    versions = sorted(
+        name for name in os.listdir(directory) if not name.startswith('.') and name not in (CURRENT, version)
+    )
+    for name in versions[:max(0, len(versions) - (KEEP_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return version
+
+
+def current_version(directory):
+    try:
+        with open(os.path.join(directory, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+_state = None
+_checked_at = None
+_lock = threading.Lock()
+
+
+def get_state():
+    """The current snapshot, or None if none has been built yet."""
+    global _state, _checked_at
+    options = snapshot_options()
+    if _checked_at is not None and time.monotonic() - _checked_at < options['CHECK_INTERVAL']:
+        return _state
+    with _lock:
+        if _checked_at is not None and time.monotonic() - _checked_at < options['CHECK_INTERVAL']:
+            return _state
+        _checked_at = time.monotonic()
+        version = current_version(options['DIR'])
+        if version is None:
+            _state = None
+        elif _state is None or _state.version != version:
+            try:
+                _state = RecommenderState(os.path.join(options['DIR'], version))
+                logger.info(f"Loaded recommender snapshot {version}")
+            except (OSError, ValueError, KeyError) as e:
+                # Keep serving the previous version rather than nothing.
+                logger.error(f"Could not load recommender snapshot {version}: {str(e)}")
+    return _state
+
+
+@receiver(setting_changed)
+def reset_state(setting, **kwargs):
+    global _state, _checked_at
+    if setting == 'RECOMMENDER_SNAPSHOT':
+        _state = None
+        _checked_at = None
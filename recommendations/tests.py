@@ -1,3 +1,132 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from products.models import Category, Product, ProductSimilarity, UserInteraction, UserSimilarity
+
+from . import benchmark
+from .snapshot import build_snapshot, get_state
+from .utils import HybridRecommender, most_similar
+
+User = get_user_model()
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_small_run_reports_every_method_and_cleans_up(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command(
+                'benchmark_recommender', users=40, products=15, categories=3, repeat=2,
+                interactive=False, output=output, stdout=io.StringIO(),
+            )
+            with open(output) as f:
+                report = json.load(f)
+
+        self.assertEqual(set(report['results']), set(benchmark.METHODS))
+        self.assertEqual(report['data']['users'], 40)
+        self.assertEqual(report['data']['products'], 15)
+        for result in report['results'].values():
+            self.assertEqual(result['runs'], 2)
+        self.assertFalse(benchmark.has_data())
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(UserInteraction.objects.exists())
+        self.assertFalse(Category.objects.filter(name__startswith=benchmark.PREFIX).exists())
+
+    def test_startup_does_not_load_the_ml_stack(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'startup.json')
+            call_command('benchmark_startup', repeat=1, check=True, output=output, stdout=io.StringIO())
+            with open(output) as f:
+                report = json.load(f)
+        self.assertEqual(report['heavy_packages_loaded'], [])
+        self.assertIn('django', report['import_seconds_by_package'])
+
+    def test_interactions_follow_popularity(self):
+        benchmark.generate(50, 20, 2, 30, zipf_a=1.5, seed=1, log=lambda message: None)
+        counts = sorted(
+            (UserInteraction.objects.filter(product=p).count() for p in Product.objects.all()),
+            reverse=True,
+        )
+        # With a=1.5 the top product alone takes over a third of the traffic.
+        self.assertGreater(counts[0], sum(counts) / 3)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        settings = override_settings(RECOMMENDER_SNAPSHOT={'DIR': self.directory, 'CHECK_INTERVAL': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def live_and_snapshot(self, method, subject_id):
+        recommender = HybridRecommender()
+        live = getattr(recommender, f'live_{method}')(subject_id)
+        return most_similar(*live, 5), most_similar(*getattr(recommender, method)(subject_id), 5)
+
+    def test_snapshot_matches_live_similarities(self):
+        benchmark.generate(40, 15, 3, 8, 1.1, seed=2, log=lambda message: None)
+        build_snapshot()
+        interaction = UserInteraction.objects.first()
+
+        for method, subject_id in (('user_similarities', interaction.user_id),
+                                   ('product_similarities', interaction.product_id)):
+            live, snapshot = self.live_and_snapshot(method, subject_id)
+            self.assertEqual([i for i, _ in live], [i for i, _ in snapshot])
+            for (_, expected), (_, actual) in zip(live, snapshot):
+                self.assertAlmostEqual(expected, actual, places=5)
+
+    def test_workers_swap_to_a_new_version(self):
+        benchmark.generate(10, 5, 1, 3, 1.1, seed=3, log=lambda message: None)
+        first = build_snapshot()
+        self.assertEqual(get_state().version, first)
+
+        second = build_snapshot()
+        third = build_snapshot()
+        self.assertEqual(get_state().version, third)
+        # The previous version is kept for workers that haven't swapped yet.
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(['CURRENT', second, third]))
+
+    def test_users_missing_from_the_snapshot_are_not_recomputed(self):
+        benchmark.generate(10, 5, 1, 3, 1.1, seed=4, log=lambda message: None)
+        build_snapshot()
+        newcomer = User.objects.create_user(username='newcomer', password='pass12345')
+        UserInteraction.objects.create(user=newcomer, product=Product.objects.first(), interaction_type='cart')
+        recommender = HybridRecommender()
+
+        with mock.patch.object(recommender, 'create_user_product_matrix') as build_matrix:
+            self.assertIsNone(recommender.user_similarities(newcomer.id))
+            self.assertEqual(recommender.calculate_user_similarity(newcomer.id), [])
+        build_matrix.assert_not_called()
+        # Offline jobs can still compute them from the live interactions.
+        self.assertNotEqual(recommender.calculate_user_similarity(newcomer.id, live=True), [])
+
+    def test_requests_read_the_current_snapshot_over_stored_rows(self):
+        benchmark.generate(20, 8, 2, 5, 1.1, seed=5, log=lambda message: None)
+        build_snapshot()
+        interaction = UserInteraction.objects.first()
+        other = User.objects.exclude(pk=interaction.user_id).first()
+        # Left by an earlier offline run; a newer snapshot must win.
+        UserSimilarity.objects.create(user1_id=interaction.user_id, user2=other, similarity_score=99)
+        recommender = HybridRecommender()
+
+        with self.assertNumQueries(0):
+            similar = recommender.similar_users(interaction.user_id)
+        self.assertEqual(similar, most_similar(*recommender.user_similarities(interaction.user_id), 10))
+
+        list(recommender.get_hybrid_recommendations(interaction.user_id))
+        self.assertEqual(UserSimilarity.objects.count(), 1)
+        self.assertFalse(ProductSimilarity.objects.exists())
+
+    def test_building_without_interactions_fails_cleanly(self):
+        with self.assertRaisesMessage(CommandError, 'no interactions'):
+            call_command('build_recommender_snapshot', stdout=io.StringIO())
+        self.assertIsNone(get_state())
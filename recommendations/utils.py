@@ -1,12 +1,23 @@
 # recommendations/utils.py
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+# numpy and scikit-learn are imported inside the methods that use them so
+# that importing this module (every web worker does) doesn't load SciPy.
 from collections import defaultdict
 from products.models import Product
+from merobazar.metrics import RECOMMENDER_STAGE
 import json
 from datetime import datetime, timedelta
 
+
+def most_similar(ids, own_index, similarities, top_n):
+    """The ``top_n`` ``(id, score)`` pairs with positive similarity, best first."""
+    import numpy as np
+    
+    candidates = np.flatnonzero(similarities > 0)
+    candidates = candidates[candidates != own_index]
+    best = candidates[np.argsort(-similarities[candidates], kind='stable')][:top_n]
+    return [(int(ids[i]), float(similarities[i])) for i in best]
+
+
 class HybridRecommender:
     def __init__(self):
         self.interaction_weights = {
@@ -17,9 +28,11 @@ class HybridRecommender:
             'purchase': 5.0
         }
     
+    @RECOMMENDER_STAGE.labels('matrix').time()
     def create_user_product_matrix(self):
         """Create user-product interaction matrix"""
-        from .models import UserInteraction, Product
+        import numpy as np
+        from products.models import UserInteraction
         
         interactions = UserInteraction.objects.all()
         users = list(set(interaction.user_id for interaction in interactions))
@@ -39,40 +52,75 @@ class HybridRecommender:
         
         return matrix, users, products, user_index, product_index
     
-    def calculate_user_similarity(self, user_id, top_n=10):
-        """Calculate similar users based on interaction patterns"""
-        from .models import UserInteraction, UserSimilarity
-        
-        matrix, users, products, user_index, product_index = self.create_user_product_matrix()
-        
-        if user_id not in user_index:
+    def calculate_user_similarity(self, user_id, top_n=10, live=False):
+        """Calculate similar users based on interaction patterns
+        
+        Only users in the snapshot are found unless ``live`` is set, which
+        builds the whole interaction matrix and is for offline jobs.
+        """
+        found = self.user_similarities(user_id)
+        if found is None and live:
+            found = self.live_user_similarities(user_id)
+        if found is None:
             return []
         
-        user_idx = user_index[user_id]
-        user_vector = matrix[user_idx].reshape(1, -1)
-        
-        similarities = cosine_similarity(user_vector, matrix)[0]
-        
-        similar_users = []
-        for other_user_idx, similarity in enumerate(similarities):
-            if other_user_idx != user_idx and similarity > 0:
-                similar_users.append((users[other_user_idx], similarity))
-        
-        similar_users.sort(key=lambda x: x[1], reverse=True)
+        return most_similar(*found, top_n)
+    
+    def save_user_similarities(self, user_id, similar_users):
+        """Store ``(user id, score)`` pairs for users the snapshot doesn't cover yet (offline jobs only)."""
+        from products.models import UserSimilarity
         
-        # Save to database
-        for other_user_id, similarity in similar_users[:top_n]:
+        for other_user_id, similarity in similar_users:
             UserSimilarity.objects.update_or_create(
                 user1_id=user_id,
                 user2_id=other_user_id,
                 defaults={'similarity_score': similarity}
             )
+    
+    def similar_users(self, user_id, top_n=10):
+        """``(user id, score)`` pairs from the current snapshot, falling back to stored rows"""
+        from products.models import UserSimilarity
+        
+        found = self.user_similarities(user_id)
+        if found is not None:
+            return most_similar(*found, top_n)
+        return list(UserSimilarity.objects.filter(
+            user1_id=user_id
+        ).order_by('-similarity_score').values_list('user2_id', 'similarity_score')[:top_n])
+    
+    def user_similarities(self, user_id):
+        """``(user ids, index of user_id, cosine similarities)`` from the shared snapshot, or None."""
+        from .snapshot import get_state
+        
+        state = get_state()
+        if state is None:
+            return None
+        with RECOMMENDER_STAGE.labels('similarity').time():
+            found = state.users.similarities(user_id)
+        if found is None:
+            return None
+        return state.users.row_ids, *found
+    
+    def live_user_similarities(self, user_id):
+        """As ``user_similarities``, computed from the live interactions."""
+        from sklearn.metrics.pairwise import cosine_similarity
+        
+        matrix, users, products, user_index, product_index = self.create_user_product_matrix()
         
-        return similar_users[:top_n]
+        if user_id not in user_index:
+            return None
+        
+        user_idx = user_index[user_id]
+        user_vector = matrix[user_idx].reshape(1, -1)
+        
+        with RECOMMENDER_STAGE.labels('similarity').time():
+            return users, user_idx, cosine_similarity(user_vector, matrix)[0]
     
+    @RECOMMENDER_STAGE.labels('features').time()
     def create_product_features(self):
         """Create feature vectors for products"""
-        from .models import Product
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from products.models import Product
         
         products = Product.objects.filter(is_active=True)
         features = []
@@ -87,63 +135,87 @@ class HybridRecommender:
         
         return feature_vectors, products, vectorizer
     
-    def calculate_product_similarity(self, product_id, top_n=10):
-        """Calculate similar products based on content features"""
-        from .models import ProductSimilarity
-        
-        feature_vectors, products, _ = self.create_product_features()
-        
-        product_ids = [p.id for p in products]
-        if product_id not in product_ids:
+    def calculate_product_similarity(self, product_id, top_n=10, live=False):
+        """Calculate similar products based on content features
+        
+        As ``calculate_user_similarity``, ``live`` refits TF-IDF over the
+        whole catalog for products missing from the snapshot.
+        """
+        found = self.product_similarities(product_id)
+        if found is None and live:
+            found = self.live_product_similarities(product_id)
+        if found is None:
             return []
         
-        product_idx = product_ids.index(product_id)
-        product_vector = feature_vectors[product_idx]
-        
-        similarities = cosine_similarity(product_vector, feature_vectors)[0]
-        
-        similar_products = []
-        for other_idx, similarity in enumerate(similarities):
-            if other_idx != product_idx and similarity > 0:
-                similar_products.append((products[other_idx].id, similarity))
-        
-        similar_products.sort(key=lambda x: x[1], reverse=True)
+        return most_similar(*found, top_n)
+    
+    def save_product_similarities(self, product_id, similar_products):
+        """As ``save_user_similarities``, for products."""
+        from products.models import ProductSimilarity
         
-        # Save to database
-        for other_product_id, similarity in similar_products[:top_n]:
+        for other_product_id, similarity in similar_products:
             ProductSimilarity.objects.update_or_create(
                 product1_id=product_id,
                 product2_id=other_product_id,
                 defaults={'similarity_score': similarity}
             )
+    
+    def similar_products(self, product_id, top_n=10):
+        """``(product id, score)`` pairs from the current snapshot, falling back to stored rows"""
+        from products.models import ProductSimilarity
+        
+        found = self.product_similarities(product_id)
+        if found is not None:
+            return most_similar(*found, top_n)
+        return list(ProductSimilarity.objects.filter(
+            product1_id=product_id
+        ).order_by('-similarity_score').values_list('product2_id', 'similarity_score')[:top_n])
+    
+    def product_similarities(self, product_id):
+        """``(product ids, index of product_id, cosine similarities)`` from the shared snapshot, or None."""
+        from .snapshot import get_state
+        
+        state = get_state()
+        if state is None:
+            return None
+        with RECOMMENDER_STAGE.labels('similarity').time():
+            found = state.products.similarities(product_id)
+        if found is None:
+            return None
+        return state.products.row_ids, *found
+    
+    def live_product_similarities(self, product_id):
+        """As ``product_similarities``, computed from the active catalog."""
+        from sklearn.metrics.pairwise import cosine_similarity
+        
+        feature_vectors, products, _ = self.create_product_features()
+        
+        product_ids = [p.id for p in products]
+        if product_id not in product_ids:
+            return None
+        
+        product_idx = product_ids.index(product_id)
+        product_vector = feature_vectors[product_idx]
         
-        return similar_products[:top_n]
+        with RECOMMENDER_STAGE.labels('similarity').time():
+            return product_ids, product_idx, cosine_similarity(product_vector, feature_vectors)[0]
     
     def get_collaborative_recommendations(self, user_id, top_n=20):
         """Get recommendations based on collaborative filtering"""
-        from .models import UserSimilarity, UserInteraction, Product
-        
-        similar_users = UserSimilarity.objects.filter(
-            user1_id=user_id
-        ).order_by('-similarity_score')[:10]
-        
-        if not similar_users:
-            self.calculate_user_similarity(user_id)
-            similar_users = UserSimilarity.objects.filter(
-                user1_id=user_id
-            ).order_by('-similarity_score')[:10]
+        from products.models import UserInteraction, Product
         
+        # Read-only: similarities come from the current snapshot, or from
+        # rows the offline jobs stored; nothing is computed or written here.
         recommendations = defaultdict(float)
         
-        for similarity in similar_users:
-            similar_user_id = similarity.user2_id
+        for similar_user_id, similarity_score in self.similar_users(user_id):
             similar_user_interactions = UserInteraction.objects.filter(
                 user_id=similar_user_id
             ).exclude(product__user_id=user_id)  # Exclude user's own products
             
             for interaction in similar_user_interactions:
                 weight = self.interaction_weights.get(interaction.interaction_type, 1.0)
-                recommendations[interaction.product_id] += weight * similarity.similarity_score
+                recommendations[interaction.product_id] += weight * similarity_score
         
         # Get top recommendations
         sorted_recommendations = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
@@ -153,7 +225,7 @@ class HybridRecommender:
     
     def get_content_based_recommendations(self, user_id, top_n=20):
         """Get recommendations based on content similarity to user's interactions"""
-        from .models import UserInteraction, ProductSimilarity
+        from products.models import UserInteraction
         
         # Get user's interacted products
         user_interactions = UserInteraction.objects.filter(
@@ -170,19 +242,9 @@ class HybridRecommender:
             weight = self.interaction_weights.get(interaction.interaction_type, 1.0)
             
             # Get similar products
-            similar_products = ProductSimilarity.objects.filter(
-                product1_id=product_id
-            ).order_by('-similarity_score')[:10]
-            
-            if not similar_products:
-                self.calculate_product_similarity(product_id)
-                similar_products = ProductSimilarity.objects.filter(
-                    product1_id=product_id
-                ).order_by('-similarity_score')[:10]
-            
-            for similarity in similar_products:
-                if similarity.product2_id != product_id:  # Exclude the same product
-                    recommendations[similarity.product2_id] += weight * similarity.similarity_score
+            for similar_product_id, similarity_score in self.similar_products(product_id):
+                if similar_product_id != product_id:  # Exclude the same product
+                    recommendations[similar_product_id] += weight * similarity_score
         
         # Get top recommendations
         sorted_recommendations = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
@@ -192,30 +254,31 @@ class HybridRecommender:
     
     def get_hybrid_recommendations(self, user_id, top_n=20, collaborative_weight=0.6, content_weight=0.4):
         """Combine collaborative and content-based recommendations"""
-        from .models import Product
-        
-        collaborative_recs = self.get_collaborative_recommendations(user_id, top_n * 2)
-        content_recs = self.get_content_based_recommendations(user_id, top_n * 2)
-        
-        recommendations = defaultdict(float)
+        from products.models import Product
         
-        # Add collaborative recommendations with weight
-        for product in collaborative_recs:
-            recommendations[product.id] += collaborative_weight
+        collaborative_recs = list(self.get_collaborative_recommendations(user_id, top_n * 2))
+        content_recs = list(self.get_content_based_recommendations(user_id, top_n * 2))
         
-        # Add content-based recommendations with weight
-        for product in content_recs:
-            recommendations[product.id] += content_weight
-        
-        # Get top recommendations
-        sorted_recommendations = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
-        product_ids = [item[0] for item in sorted_recommendations[:top_n]]
+        with RECOMMENDER_STAGE.labels('blend').time():
+            recommendations = defaultdict(float)
+
+            # Add collaborative recommendations with weight
+            for product in collaborative_recs:
+                recommendations[product.id] += collaborative_weight
+
+            # Add content-based recommendations with weight
+            for product in content_recs:
+                recommendations[product.id] += content_weight
+
+            # Get top recommendations
+            sorted_recommendations = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
+            product_ids = [item[0] for item in sorted_recommendations[:top_n]]
         
         return Product.objects.filter(id__in=product_ids, is_active=True).exclude(user_id=user_id)
     
     def get_popular_products(self, top_n=20, days=30):
         """Fallback: Get popular products from recent interactions"""
-        from .models import UserInteraction, Product
+        from products.models import Product
         from django.db.models import Count
         
         recent_date = datetime.now() - timedelta(days=days)
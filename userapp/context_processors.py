@@ -1,6 +1,16 @@
+from django.utils.functional import SimpleLazyObject
+
 from products.models import Category
 
 def categories(request):
     return {
         'categories': Category.objects.prefetch_related('subcategories').all()
-    }
\ No newline at end of file
+    }
+
+
+def badge_counts(request):
+    """Header badge counts from the signed-in user's row, read only when a page renders them."""
+    return {
+        'wishlist_count': SimpleLazyObject(lambda: getattr(request.user, 'wishlist_count', 0)),
+        'cart_count': SimpleLazyObject(lambda: getattr(request.user, 'cart_count', 0)),
+    }
@@ -0,0 +1,85 @@
+"""Data for the homepage, gathered in as few queries as possible.
+
+Featured and recently added products are the same eight newest listings,
+so they share one query. Sections that don't depend on the visitor are
+cached per catalog version. Product cards are plain dicts holding only
+what a card renders, so the shared cache never stores model instances
+(and with them sellers' user rows).
+"""
+from django.core.cache import cache
+
+from merobazar.metrics import record_cache_lookup
+from products.catalog import catalog_version
+from products.models import Product
+from recommendations.utils import HybridRecommender
+
+SECTION_SIZE = 8
+SECTION_TIMEOUT = 300
+CARD_FIELDS = ('id', 'name', 'price', 'created_at')
+
+_recommender = None
+
+
+def get_recommender():
+    global _recommender
+    if _recommender is None:
+        _recommender = HybridRecommender()
+    return _recommender
+
+
+def product_cards(queryset):
+    cards = []
+    for product in queryset.only(*CARD_FIELDS).prefetch_related('images'):
+        card = {field: getattr(product, field) for field in CARD_FIELDS}
+        image = next(iter(product.images.all()), None)
+        card['image'] = image and {'thumbnail_url': image.thumbnail_url, 'srcset': image.srcset}
+        cards.append(card)
+    return cards
+
+
+def cached_section(name, build):
+    key = f'dashboard:{name}:{catalog_version()}'
+    section = cache.get(key)
+    record_cache_lookup('dashboard', 'miss' if section is None else 'hit')
+    if section is None:
+        section = build()
+        cache.set(key, section, SECTION_TIMEOUT)
+    return section
+
+
+def latest_products():
+    return product_cards(Product.objects.filter(is_active=True).order_by('-created_at')[:SECTION_SIZE])
+
+
+def popular_products():
+    try:
+        return product_cards(get_recommender().get_popular_products(top_n=SECTION_SIZE))
+    except Exception:
+        return []
+
+
+def recommended_products(user):
+    try:
+        return product_cards(get_recommender().get_hybrid_recommendations(user_id=user.id, top_n=SECTION_SIZE))
+    except Exception:
+        return []
+
+
+def dashboard_sections(user):
+    latest = cached_section('latest', latest_products)
+    sections = {
+        'featured_products': latest,
+        'recent_products': latest,
+        'recommended_products': [],
+        'popular_products': [],
+    }
+    if user.is_authenticated:
+        # Personalized recommendations, or popular and then recent products
+        # for users the offline similarity jobs haven't covered yet.
+        sections['recommended_products'] = (
+            recommended_products(user) or cached_section('popular', popular_products) or latest
+        )
+    else:
+        # Show popular products for guests
+        sections['popular_products'] = cached_section('popular', popular_products)
+    return sections
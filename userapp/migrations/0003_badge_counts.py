@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_saved_products(apps, schema_editor):
+    CustomUser = apps.get_model('userapp', 'CustomUser')
+    for field, model in (('wishlist_count', 'Wishlist'), ('cart_count', 'Cart')):
+        rows = apps.get_model('products', model).objects.filter(user=OuterRef('pk')).order_by()
+        CustomUser.objects.update(**{field: Coalesce(Subquery(
+            rows.values('user').annotate(rows=Count('pk')).values('rows')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userapp', '0002_remove_customuser_first_name_and_more'),
+        ('products', '0019_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='wishlist_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_saved_products, migrations.RunPython.noop),
+    ]
@@ -10,6 +10,9 @@ class CustomUser(AbstractUser):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
     status = models.BooleanField(default=True)
     profile_pic = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
+    # Header badge counts, kept in step with the rows by products.counters.
+    wishlist_count = models.PositiveIntegerField(default=0)
+    cart_count = models.PositiveIntegerField(default=0)
     
     first_name = None
     last_name = None
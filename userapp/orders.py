@@ -0,0 +1,101 @@
+"""Orders a seller has received, a page at a time.
+
+Pages are keyed on ``(created_at, id)`` instead of numbered, so each one is
+a single ordered, limited query however long the seller's history is, and
+new orders arriving don't shift the page a seller is reading. Only the
+page's orders have their items loaded.
+"""
+import datetime
+
+from django.db.models import Count, Prefetch, Q, Sum
+
+from products.models import Order, OrderItem
+
+PAGE_SIZE = 5
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def encode_cursor(order):
+    return f'{(order.created_at - EPOCH) // MICROSECOND}-{order.id}'
+
+
+def decode_cursor(value):
+    """``(created_at, id)`` from a cursor, or None if ``value`` isn't one."""
+    try:
+        micros, order_id = value.split('-')
+        return EPOCH + int(micros) * MICROSECOND, int(order_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def received_orders_page(seller, after=None, before=None, page_size=PAGE_SIZE):
+    """Newest-first orders containing ``seller``'s items, with cursors to the pages around them.
+
+    ``after`` continues with older orders than a cursor, ``before`` goes
+    back to newer ones. Each order's ``seller_items`` holds only this
+    seller's items, with their products.
+    """
+    orders = Order.objects.filter(
+        id__in=OrderItem.objects.filter(seller=seller).values('order_id')
+    ).select_related('user').prefetch_related(Prefetch(
+        'items',
+        queryset=OrderItem.objects.filter(seller=seller).select_related('product').order_by('id'),
+        to_attr='seller_items',
+    ))
+
+    after, before = decode_cursor(after), decode_cursor(before)
+    if before:
+        created_at, order_id = before
+        orders = orders.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=order_id)
+        ).order_by('created_at', 'id')
+    else:
+        if after:
+            created_at, order_id = after
+            orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id))
+        orders = orders.order_by('-created_at', '-id')
+
+    # One extra row tells whether there is another page in this direction.
+    page = list(orders[:page_size + 1])
+    more = len(page) > page_size
+    page = page[:page_size]
+    if before:
+        page.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = after is not None, more
+    return {
+        'orders': page,
+        'newer': encode_cursor(page[0]) if page and has_newer else None,
+        'older': encode_cursor(page[-1]) if page and has_older else None,
+    }
+
+
+def received_orders_summary(seller):
+    """Orders, items and revenue from ``seller``'s items per order status, in one query."""
+    rows = (
+        OrderItem.objects.filter(seller=seller)
+        .values('order__status')
+        .annotate(orders=Count('order', distinct=True), items=Count('id'), revenue=Sum('price'))
+        .order_by()
+    )
+    by_status = {row['order__status']: row for row in rows}
+    labels = dict(Order.STATUS_CHOICES)
+    statuses = [
+        {
+            'status': status,
+            'label': labels.get(status, status.title()),
+            'orders': by_status.get(status, {}).get('orders', 0),
+            'items': by_status.get(status, {}).get('items', 0),
+            'revenue': by_status.get(status, {}).get('revenue') or 0,
+        }
+        # Statuses outside the choices (the model's 'pending' default) still show up.
+        for status in [*labels, *sorted(set(by_status) - set(labels))]
+    ]
+    return {
+        'statuses': statuses,
+        # An order has one status, so these add up without double counting.
+        'orders': sum(row['orders'] for row in statuses),
+        'revenue': sum(row['revenue'] for row in statuses),
+    }
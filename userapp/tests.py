@@ -1,3 +1,180 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from products.catalog import catalog_version
+from products.models import Category, Order, OrderItem, Product, ProductImage, UserInteraction
+from recommendations.utils import HybridRecommender
+
+User = get_user_model()
+
+
+class DashboardQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        cls.category = Category.objects.create(name='Shoes')
+
+    def setUp(self):
+        cache.clear()
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                user=self.seller, category=self.category, name=f'Product {i}',
+                description='Test product', price=Decimal('10.00'), condition='new',
+            )
+            ProductImage.objects.bulk_create([ProductImage(product=product, image=f'product_images/{i}.jpg')])
+
+    def dashboard_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('user_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in ctx.captured_queries]
+
+    def test_guest_query_count_does_not_grow_with_products(self):
+        self.add_products(2)
+        few = self.dashboard_queries()
+        self.add_products(10)
+        many = self.dashboard_queries()
+        # Newest products with their sellers, their images, popular
+        # products, then the category tree (categories and subcategories).
+        self.assertEqual(len(few), 5)
+        self.assertEqual(len(many), 5)
+
+    def test_signed_in_dashboard_reuses_cached_sections(self):
+        self.add_products(12)
+        self.client.force_login(self.buyer)
+        cold = self.dashboard_queries()
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('user_dashboard'))
+
+        # Session, user and two recommender lookups for a user with no
+        # history (badge counts come with the user), plus five catalog
+        # queries (the popular fallback among them) while the sections and
+        # fragments are cold.
+        self.assertEqual(len(cold), 9)
+        self.assertEqual(len(ctx.captured_queries), 4)
+        self.assertFalse(any('FROM "products_product"' in query['sql'] for query in ctx.captured_queries))
+
+    def test_cached_sections_hold_no_model_instances(self):
+        self.add_products(2)
+        self.client.get(reverse('user_dashboard'))
+
+        section = cache.get(f'dashboard:latest:{catalog_version()}')
+        self.assertEqual([card['name'] for card in section], ['Product 1', 'Product 0'])
+        self.assertEqual(set(section[0]), {'id', 'name', 'price', 'created_at', 'image'})
+        self.assertEqual(section[0]['image']['thumbnail_url'], '/media/product_images/1.jpg')
+
+    def test_users_without_stored_similarities_get_popular_products(self):
+        self.add_products(3)
+        products = list(Product.objects.all())
+        for product in products[:2]:
+            UserInteraction.objects.create(user=self.seller, product=product, interaction_type='view')
+        UserInteraction.objects.create(user=self.buyer, product=products[0], interaction_type='cart')
+        self.client.force_login(self.buyer)
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                override_settings(RECOMMENDER_SNAPSHOT={'DIR': tmp}), \
+                mock.patch.object(HybridRecommender, 'create_user_product_matrix') as build_matrix, \
+                mock.patch.object(HybridRecommender, 'create_product_features') as build_features:
+            response = self.client.get(reverse('user_dashboard'))
+            self.client.get(reverse('products:product_details', args=[products[2].id]))
+
+        build_matrix.assert_not_called()
+        build_features.assert_not_called()
+        self.assertEqual(
+            {p['id'] for p in response.context['recommended_products']}, {products[0].id, products[1].id},
+        )
+
+
+class OrdersReceivedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass12345')
+        cls.other_seller = User.objects.create_user(username='other', password='pass12345')
+        cls.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(
+            user=cls.seller, category=category, name='Runner',
+            description='Test product', price=Decimal('10.00'), condition='new',
+        )
+        cls.other_product = Product.objects.create(
+            user=cls.other_seller, category=category, name='Boot',
+            description='Test product', price=Decimal('25.00'), condition='new',
+        )
+        statuses = ['paid', 'paid', 'unpaid', 'cancelled'] * 3
+        now = timezone.now()
+        cls.orders = []
+        for status in statuses:
+            order = Order.objects.create(user=cls.buyer, total_price=Decimal('35.00'), status=status)
+            OrderItem.objects.create(order=order, product=cls.product, seller=cls.seller, price=Decimal('10.00'))
+            OrderItem.objects.create(order=order, product=cls.other_product, seller=cls.other_seller,
+                                     price=Decimal('25.00'))
+            cls.orders.append(order)
+        # Two orders share a timestamp so the id tie-break is exercised.
+        for i, order in enumerate(cls.orders):
+            Order.objects.filter(id=order.id).update(created_at=now - timedelta(minutes=i // 2 * 2))
+        Order.objects.create(user=cls.buyer, total_price=Decimal('25.00'), status='paid').items.create(
+            product=cls.other_product, seller=cls.other_seller, price=Decimal('25.00'),
+        )
+
+    def setUp(self):
+        self.client.force_login(self.seller)
+
+    def get(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('orders_received'), params)
+        return response, len(ctx.captured_queries)
+
+    def test_pages_walk_every_order_once_in_a_fixed_number_of_queries(self):
+        expected = list(
+            Order.objects.filter(id__in=[o.id for o in self.orders]).order_by('-created_at', '-id')
+            .values_list('id', flat=True)
+        )
+        response, first_queries = self.get()
+        pages = [response.context['received_orders']]
+        while response.context['older_cursor']:
+            response, queries = self.get(after=response.context['older_cursor'])
+            self.assertEqual(queries, first_queries)
+            pages.append(response.context['received_orders'])
+
+        self.assertEqual([order.id for page in pages for order in page], expected)
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        for order in pages[1]:
+            self.assertEqual([item.product_id for item in order.seller_items], [self.product.id])
+
+        response, _ = self.get(before=response.context['newer_cursor'])
+        self.assertEqual([order.id for order in response.context['received_orders']], [o.id for o in pages[1]])
+        response, _ = self.get(before=response.context['newer_cursor'])
+        self.assertEqual([order.id for order in response.context['received_orders']], [o.id for o in pages[0]])
+        self.assertIsNone(response.context['newer_cursor'])
+
+    def test_summary_counts_only_the_sellers_items(self):
+        response, _ = self.get()
+        summary = response.context['summary']
+        rows = {row['status']: (row['orders'], row['revenue']) for row in summary['statuses']}
+        self.assertEqual(rows, {
+            'unpaid': (3, Decimal('30.00')),
+            'processing': (0, 0),
+            'paid': (6, Decimal('60.00')),
+            'cancelled': (3, Decimal('30.00')),
+        })
+        self.assertEqual((summary['orders'], summary['revenue']), (12, Decimal('120.00')))
+
+    def test_a_bad_cursor_shows_the_first_page(self):
+        first, _ = self.get()
+        response, _ = self.get(after='nonsense')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['received_orders']), list(first.context['received_orders']))
@@ -15,8 +15,10 @@ from django.http import JsonResponse
 from django.core.paginator import Paginator
 from .models import CustomUser
 from django.db.models import Q
-from recommendations.utils import HybridRecommender
-from products.models import Product, Category, SubCategory, Order, OrderItem
+from merobazar.caching import public_cache
+from .dashboard import dashboard_sections
+from .orders import received_orders_page, received_orders_summary
+from products.models import Product, Category, SubCategory, Order
 
 User = get_user_model()
 def register_view(request):
@@ -121,37 +123,9 @@ def login_view(request):
     return render(request, 'userapp/login.html', {'form': form})
 
 
+@public_cache(stale=300, page=True)
 def user_dashboard(request):
-    categories = Category.objects.prefetch_related('subcategories').all()
-    featured_products = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
-    recent_products = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
-
-    recommender = HybridRecommender()
-    recommended_products = []
-    popular_products = []
-
-    if request.user.is_authenticated:
-        # Personalized recommendations
-        try:
-            recommended_products = recommender.get_hybrid_recommendations(
-                user_id=request.user.id,
-                top_n=8
-            )
-        except Exception:
-            pass
-    else:
-        # Show popular products for guests
-        try:
-            popular_products = recommender.get_popular_products(top_n=8)
-        except Exception:
-            pass
-    context = {
-        'categories': categories,
-        'featured_products': featured_products,
-        'recent_products': recent_products,
-        'recommended_products': recommended_products,
-        'popular_products': popular_products,
-    }
+    context = dashboard_sections(request.user)
     return render(request, 'userapp/dashboard.html', context)
 
 
@@ -196,25 +170,13 @@ def my_orders_view(request):
 @login_required
 def orders_received_view(request):
     # Orders received by the user (as seller)
-    received_items = OrderItem.objects.filter(seller=request.user).select_related('order', 'product')
-    
-    # Group received items by order
-    received_orders_dict = {}
-    for item in received_items:
-        if item.order.id not in received_orders_dict:
-            received_orders_dict[item.order.id] = {
-                'order': item.order,
-                'items': []
-            }
-        received_orders_dict[item.order.id]['items'].append(item)
-    
-    received_orders_list = list(received_orders_dict.values())
-    received_paginator = Paginator(received_orders_list, 5)  # 5 orders per page
-    page_number = request.GET.get('page')
-    received_orders = received_paginator.get_page(page_number)
+    page = received_orders_page(request.user, after=request.GET.get('after'), before=request.GET.get('before'))
 
     context = {
-        'received_orders': received_orders,
+        'received_orders': page['orders'],
+        'newer_cursor': page['newer'],
+        'older_cursor': page['older'],
+        'summary': received_orders_summary(request.user),
     }
     return render(request, 'userapp/orders_received.html', context)
 
@@ -234,6 +196,7 @@ def user_products_view(request):
     return render(request, 'userapp/user_products.html', context)
 
 
+@public_cache()
 def search_products(request):
     query = request.GET.get('q', '')
     min_price = request.GET.get('min_price')
@@ -284,5 +247,6 @@ def search_products(request):
     }
     return render(request, 'userapp/search_results.html', context)
 
+@public_cache()
 def landing_page(request):
      return render(request, 'userapp/landing.html') 
\ No newline at end of file